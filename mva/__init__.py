@@ -19,6 +19,16 @@ DAT_DIR = os.path.join(BASE_DIR, 'dat')
 BDT_DIR = os.path.join(BASE_DIR, 'bdts')
 NTUPLE_PATH = os.path.join(os.getenv('HIGGSTAUTAU_NTUPLE_DIR'), 'prod_v29')
 DEFAULT_STUDENT = 'hhskim'
+# 'hdf5' to read <student>.h5, 'columnar' to read the memory-mapped
+# <student>.columns store (see samples/columnar.py) or 'shm' to attach to
+# the columns served in shared memory by ntup-server (see samples/server.py)
+NTUPLE_BACKEND = os.getenv('HHANA_NTUPLE_BACKEND', 'hdf5')
+# name of the shared memory store used by the 'shm' backend
+# (the student by default)
+NTUPLE_SERVER = os.getenv('HHANA_NTUPLE_SERVER', None)
+# HDF5 driver used to open <student>.h5, for example H5FD_CORE to read the
+# whole file into memory (the default driver of PyTables if not set)
+NTUPLE_H5_DRIVER = os.getenv('HHANA_H5_DRIVER', None)
 
 # import rootpy before ROOT
 import rootpy
@@ -0,0 +1,135 @@
+"""
+Vectorised derived columns.
+
+The scripts adding branches to the ntuples (higgs-pt, patch-ntup) used to
+loop over the events in Python, calling Hist.Interpolate and building
+LorentzVectors for each entry. Here the input branches are read in blocks of
+rows, the new columns are computed with numpy on each block and written back
+in bulk, either as new branches of a ROOT tree (with array2tree), as new
+columns of a PyTables table or as new columns of a columnar store.
+
+A derivation is a function taking a mapping of the input field names to
+arrays and returning an OrderedDict of the new field names to arrays of the
+same length::
+
+    def resonance_pt(columns):
+        px = columns['MET_x'] + ...
+        return OrderedDict([('resonance_pt', np.hypot(px, py))])
+
+    augment_tree(tree, ['MET_x', ...], resonance_pt)
+"""
+import os
+
+import numpy as np
+
+from . import log; log = log[__name__]
+
+# number of rows read and derived at once
+READ_CHUNKSIZE = 100000
+
+
+def merge_fields(rec, columns):
+    """
+    Copy of a structured array with the columns added (or replaced)
+    """
+    descr = [(name, rec.dtype[name]) for name in rec.dtype.names]
+    descr += [(name, column.dtype) for name, column in columns.items()
+              if name not in rec.dtype.names]
+    out = np.empty(len(rec), dtype=descr)
+    for name in rec.dtype.names:
+        out[name] = rec[name]
+    for name, column in columns.items():
+        out[name] = column
+    return out
+
+
+def derived_records(columns, length):
+    """
+    Structured array of the derived columns
+    """
+    out = np.empty(length, dtype=[
+        (name, column.dtype) for name, column in columns.items()])
+    for name, column in columns.items():
+        out[name] = column
+    return out
+
+
+def augment_tree(tree, fields, func, chunksize=READ_CHUNKSIZE):
+    """
+    Add the columns derived by func from the branches (or TTreeFormula
+    expressions) in fields as new branches of a tree. The tree must be in a
+    writeable file and is not written.
+    """
+    from root_numpy import tree2array, array2tree
+    entries = tree.GetEntries()
+    log.info("deriving columns of {0} ({1:d} entries) ...".format(
+        tree.GetName(), entries))
+    # read at least once to create the branches of an empty tree
+    for start in xrange(0, max(entries, 1), chunksize):
+        rec = tree2array(tree, branches=fields,
+                         start=start, stop=start + chunksize)
+        columns = func(dict((name, rec[name]) for name in fields))
+        # array2tree appends the entries to the existing branches
+        array2tree(derived_records(columns, len(rec)), tree=tree)
+    return tree
+
+
+def augment_table(table, fields, func, chunksize=READ_CHUNKSIZE):
+    """
+    Add the columns derived by func from the fields of a PyTables table. The
+    columns of a table cannot be extended in place so the table is rewritten
+    block by block into a new table that replaces it. Return the new table.
+    """
+    h5file = table._v_file
+    parent = table._v_parent
+    name = table.name
+    tmp_name = name + '_augmented'
+    if tmp_name in parent:
+        # left by an interrupted augmentation
+        h5file.remove_node(parent, tmp_name)
+    log.info("deriving columns of {0} ({1:d} rows) ...".format(
+        name, table.nrows))
+    new_table = None
+    # read at least once to create the new table of an empty table
+    for begin in xrange(0, max(table.nrows, 1), chunksize):
+        rec = table.read(start=begin, stop=min(begin + chunksize, table.nrows))
+        columns = func(dict((field, rec[field]) for field in fields))
+        rec = merge_fields(rec, columns)
+        if new_table is None:
+            new_table = h5file.create_table(
+                parent, tmp_name, rec.dtype, filters=table.filters,
+                expectedrows=table.nrows)
+        new_table.append(rec)
+    new_table.flush()
+    table.attrs._f_copy(new_table)
+    table.remove()
+    new_table.move(parent, name)
+    return new_table
+
+
+def augment_columnar(path, name, fields, func):
+    """
+    Add the columns derived by func from the fields of a table of a
+    columnar store. The fields are memory-mapped so func is applied to all
+    rows at once.
+    """
+    from .samples.columnar import ColumnarStore, write_metadata
+    store = ColumnarStore(path)
+    table = store.get_table(name)
+    log.info("deriving columns of {0} ({1:d} rows) ...".format(
+        name, table.nrows))
+    columns = func(dict((field, table.col(field)) for field in fields))
+    info = dict(store.metadata['tables'][name])
+    info['columns'] = list(info['columns'])
+    for column_name, column in columns.items():
+        column_path = os.path.join(table.path, column_name + '.npy')
+        # a replaced column may still be memory-mapped
+        tmp_path = column_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(column))
+        os.rename(tmp_path, column_path)
+        if column_name not in info['columns']:
+            info['columns'].append(column_name)
+    store.close()
+    write_metadata(path, {name: info})
+    return info
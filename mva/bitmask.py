@@ -0,0 +1,326 @@
+"""
+Precomputed category and region bitmasks.
+
+The ntup-selection script (run by the ntup target of the Makefile) evaluates
+every category in CATEGORIES (for each year) and every region in REGIONS
+once on each table and stores the results as bitfields in
+<student>.selection.h5 next to <student>.h5::
+
+    /<table>/categories_2011   (nrows, nwords) uint64
+    /<table>/categories_2012   (nrows, nwords) uint64
+    /<table>/regions           (nrows, nwords) uint64
+
+The categories are identified by their class names (unique in the
+CategoryMeta registry, unlike Category.name which is shared by variants such
+as Category_VBF and Category_VBF_NO_DETAJJ_CUT). These names, the names of
+the regions assigned to each bit and the version of their definitions (a
+hash of the bitmask format and of the modules defining the categories and
+regions) are stored in the attributes of the root group, with the
+modification time of <student>.h5. A bitmask file with another version or
+older than <student>.h5 is ignored, so changing a category or a region or
+remerging the ntuples only requires rerunning ntup-selection.
+
+Sample.table_selection() returns a Selection: the usual numexpr condition that
+also remembers its category, region and the remaining cuts. The selection
+of the rows then only requires a bitmask test followed by the evaluation of
+the remaining cuts (trigger, cut systematics, ...) on the candidate rows.
+"""
+import os
+import atexit
+import hashlib
+from glob import glob
+
+import numpy as np
+import tables
+
+from . import log; log = log[__name__]
+from .selection import evaluate, where_fields
+from . import cutengine
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+# the modules defining the categories and regions and the constants they
+# use (MMC_MASS). The other cuts are residual cuts evaluated when reading.
+DEFINITION_FILES = (
+    sorted(glob(os.path.join(BASE, 'categories', '*.py'))) +
+    [os.path.join(BASE, name) for name in ('__init__.py', 'regions.py')])
+# increment when the layout or the naming of the bits changes
+FORMAT = 2
+YEARS = (2011, 2012)
+ENABLED = not os.getenv('NOBITMASK', None)
+# evaluate the remaining cuts on blocks of this many candidate rows
+READ_CHUNKSIZE = 100000
+
+
+def definitions_version():
+    """
+    Hash of the bitmask format and of the files defining the categories and
+    the regions
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(str(FORMAT))
+    for path in DEFINITION_FILES:
+        with open(path) as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+VERSION = definitions_version()
+
+
+class Selection(str):
+    """
+    A numexpr condition that remembers the category and region it is built
+    from and the remaining cuts (condition without the category and region).
+    It can be used anywhere a condition string is expected.
+    """
+    def __new__(cls, condition, category=None, region=None, year=None,
+                residual=''):
+        self = str.__new__(cls, condition)
+        self.category = category
+        self.region = region
+        self.year = year
+        self.residual = residual
+        return self
+
+
+SUFFIX = '.selection.h5'
+
+
+def bitmask_path(table):
+    """
+    The path of the bitmask file of the ntuple holding a table
+    """
+    if hasattr(table, 'store'):
+        # columnar store
+        base = table.store.path
+    else:
+        base = table._v_file.filename
+    return os.path.splitext(os.path.normpath(base))[0] + SUFFIX
+
+
+def source_path(path):
+    """
+    The path of the HDF5 ntuple file of a bitmask file
+    """
+    return path[:-len(SUFFIX)] + '.h5'
+
+
+def word_bit(index):
+    return index // 64, np.uint64(1) << np.uint64(index % 64)
+
+
+def pack(masks):
+    """
+    Pack a list of boolean arrays into a (nrows, nwords) uint64 bitfield
+    """
+    nrows = len(masks[0]) if masks else 0
+    nwords = max(1, (len(masks) + 63) // 64)
+    bits = np.zeros((nrows, nwords), dtype=np.uint64)
+    for index, mask in enumerate(masks):
+        word, bit = word_bit(index)
+        bits[mask, word] |= bit
+    return bits
+
+
+def test(bits, index):
+    word, bit = word_bit(index)
+    return (bits[:, word] & bit) != 0
+
+
+def category_definitions():
+    from .categories import CATEGORIES
+    categories = {}
+    for category_list in CATEGORIES.values():
+        for category in category_list:
+            categories[category.__name__] = category
+    return [categories[name] for name in sorted(categories.keys())]
+
+
+def region_definitions():
+    from .regions import REGIONS
+    return [(name, REGIONS[name]) for name in sorted(REGIONS.keys())]
+
+
+def table_mask(table, cut):
+    condition = cut.where()
+    if not condition:
+        return np.ones(table.nrows, dtype=np.bool_)
+    # the categories and regions share most of their atoms
+    return cutengine.table_mask(table, condition)
+
+
+def write(h5_path, output=None, table_names=None):
+    """
+    Evaluate all categories and regions on each table of an HDF5 ntuple
+    file and write the bitmasks into output (<student>.selection.h5 by
+    default). If table_names is not None only these tables are updated,
+    unless the bitmasks of the other tables are missing or outdated.
+    """
+    if output is None:
+        output = os.path.splitext(h5_path)[0] + SUFFIX
+    categories = category_definitions()
+    regions = region_definitions()
+    mode = 'w'
+    if table_names and os.path.exists(output):
+        # only update the requested tables if the bits are unchanged
+        with tables.open_file(output) as outfile:
+            if getattr(outfile.root._v_attrs, 'version', None) == VERSION:
+                mode = 'a'
+    if mode == 'w' and table_names:
+        log.info("the bitmasks in {0} are outdated, "
+                 "rebuilding all tables".format(output))
+        table_names = None
+    h5file = tables.open_file(h5_path)
+    outfile = tables.open_file(output, mode)
+    try:
+        outfile.root._v_attrs.version = VERSION
+        outfile.root._v_attrs.source_mtime = os.path.getmtime(h5_path)
+        outfile.root._v_attrs.categories = [
+            category.__name__ for category in categories]
+        outfile.root._v_attrs.regions = [name for name, _ in regions]
+        for table in h5file.root:
+            if not isinstance(table, tables.Table):
+                continue
+            if table_names and table.name not in table_names:
+                continue
+            log.info("evaluating {0:d} categories and {1:d} regions "
+                     "on {2} ...".format(
+                         len(categories), len(regions), table.name))
+            if table.name in outfile.root:
+                outfile.remove_node(outfile.root, table.name, recursive=True)
+            group = outfile.create_group(outfile.root, table.name)
+            group._v_attrs.nrows = table.nrows
+            for year in YEARS:
+                bits = pack([table_mask(table, category.get_cuts(year))
+                             for category in categories])
+                outfile.create_array(
+                    group, 'categories_{0:d}'.format(year), bits)
+            bits = pack([table_mask(table, cut) for _, cut in regions])
+            outfile.create_array(group, 'regions', bits)
+    finally:
+        h5file.close()
+        outfile.close()
+    return output
+
+
+class BitmaskFile(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.h5file = tables.open_file(path)
+        attrs = self.h5file.root._v_attrs
+        self.version = attrs.version
+        self.source_mtime = attrs.source_mtime
+        self.categories = dict(
+            (name, index) for index, name in enumerate(attrs.categories))
+        self.regions = dict(
+            (name, index) for index, name in enumerate(attrs.regions))
+
+    def array(self, table_name, name):
+        """
+        A bitfield of a table, kept in the table cache (see cachedtable.py)
+        """
+        from .cachedtable import TABLE_CACHE, readonly
+        key = ('bitmask', self.path, self.version, self.source_mtime,
+               table_name, name)
+        bits = TABLE_CACHE.get(key)
+        if bits is None:
+            bits = getattr(getattr(self.h5file.root, table_name), name).read()
+            readonly(bits)
+            TABLE_CACHE.put(key, bits)
+        return bits
+
+    def mask(self, table, selection):
+        """
+        Return the mask of the rows passing the category and region of a
+        selection or None if the bitmasks of this selection are not
+        available
+        """
+        if table.name not in self.h5file.root:
+            return None
+        group = getattr(self.h5file.root, table.name)
+        if group._v_attrs.nrows != table.nrows:
+            return None
+        mask = np.ones(table.nrows, dtype=np.bool_)
+        if selection.category is not None:
+            if (selection.category not in self.categories or
+                    selection.year not in YEARS):
+                return None
+            mask &= test(
+                self.array(table.name,
+                           'categories_{0:d}'.format(selection.year)),
+                self.categories[selection.category])
+        if selection.region is not None:
+            if selection.region not in self.regions:
+                return None
+            mask &= test(self.array(table.name, 'regions'),
+                         self.regions[selection.region])
+        return mask
+
+    def close(self):
+        self.h5file.close()
+
+
+FILES = {}
+
+
+def get_file(path):
+    if path not in FILES:
+        bitmask_file = None
+        if os.path.exists(path):
+            bitmask_file = BitmaskFile(path)
+            if bitmask_file.version != VERSION:
+                log.warning(
+                    "ignoring {0} since the categories or regions have "
+                    "changed, rebuild it with ntup-selection".format(path))
+                bitmask_file.close()
+                bitmask_file = None
+            elif (os.path.exists(source_path(path)) and
+                    os.path.getmtime(source_path(path)) !=
+                    bitmask_file.source_mtime):
+                log.warning(
+                    "ignoring {0} since {1} was modified, rebuild it with "
+                    "ntup-selection".format(path, source_path(path)))
+                bitmask_file.close()
+                bitmask_file = None
+        FILES[path] = bitmask_file
+    return FILES[path]
+
+
+def get_where_list(table, selection, start=None, stop=None, step=None):
+    """
+    Same as table.get_where_list(selection) using the bitmasks. Return None
+    if selection is not a Selection or if its bitmasks are not available.
+    """
+    if not ENABLED or not isinstance(selection, Selection):
+        return None
+    if selection.category is None and selection.region is None:
+        return None
+    bitmask_file = get_file(bitmask_path(table))
+    if bitmask_file is None:
+        return None
+    mask = bitmask_file.mask(table, selection)
+    if mask is None:
+        return None
+    start, stop, step = slice(start, stop, step).indices(table.nrows)
+    idx = np.arange(start, stop, step)
+    idx = idx[mask[start:stop:step]]
+    if selection.residual:
+        # evaluate the remaining cuts on the candidate rows
+        names = where_fields(selection.residual, table.colnames)
+        passes = []
+        for begin in xrange(0, len(idx), READ_CHUNKSIZE):
+            block_idx = idx[begin:begin + READ_CHUNKSIZE]
+            rows = table.read_coordinates(block_idx)
+            passes.append(evaluate(selection.residual,
+                                   dict((name, rows[name]) for name in names)))
+        if passes:
+            idx = idx[np.concatenate(passes)]
+    return idx.astype(np.int64)
+
+
+@atexit.register
+def cleanup():
+    for bitmask_file in FILES.values():
+        if bitmask_file is not None:
+            bitmask_file.close()
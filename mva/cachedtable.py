@@ -1,21 +1,143 @@
 from . import log; log = log[__name__]
+from . import index_cache
 from tables import Table
 import numpy as np
 from functools import partial
+from collections import OrderedDict
+import atexit
+import json
 import os
 
+# number of rows read from a table at once when projecting out fields
+READ_CHUNKSIZE = 100000
+# memory budget of the table cache
+TABLE_CACHE_MB = float(os.getenv('HHANA_TABLE_CACHE_MB', 4096))
+# append the reads of the tables to this file (replayed by ntup-benchmark)
+TRACE = os.getenv('HHANA_H5_TRACE', None)
+
 
 def nothing(f):
     return f
 
 
+def readonly(res):
+    """
+    Mark an array or a tuple of arrays as read-only
+    """
+    if isinstance(res, tuple):
+        for arr in res:
+            arr.flags.writeable = False
+    else:
+        res.flags.writeable = False
+    return res
+
+
+def writeable(arr):
+    """
+    Return arr if it can be modified in place, otherwise a copy of it.
+    Callers that modify arrays that may come from the table cache must go
+    through this function.
+    """
+    if arr.flags.writeable:
+        return arr
+    return arr.copy()
+
+
+def trace(table, condition, fields, start, stop, step):
+    """
+    Record a read of a table in the trace file if HHANA_H5_TRACE is set
+    """
+    if TRACE is None:
+        return
+    access = {
+        'table': table.name,
+        'condition': str(condition) if condition else None,
+        'fields': list(fields) if fields is not None else None,
+        'start': start,
+        'stop': stop,
+        'step': step,
+    }
+    with open(TRACE, 'a') as f:
+        f.write(json.dumps(access) + '\n')
+
+
+def nbytes(res):
+    if isinstance(res, tuple):
+        return sum(arr.nbytes for arr in res)
+    return res.nbytes
+
+
+class TableCache(object):
+    """
+    Process-wide cache of arrays read from tables. The total size of the
+    cached arrays is bounded by max_bytes and the least recently used arrays
+    are evicted first.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __str__(self):
+        return (
+            "table cache: {0:d} entries, {1:.1f}/{2:.1f} MB, "
+            "{3:d} hits, {4:d} misses, {5:d} evictions".format(
+                len(self), self.nbytes / 1024. ** 2,
+                self.max_bytes / 1024. ** 2,
+                self.hits, self.misses, self.evictions))
+
+    def get(self, key):
+        try:
+            res = self._cache.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        # move to the most recently used position
+        self._cache[key] = res
+        self.hits += 1
+        return res
+
+    def put(self, key, res):
+        size = nbytes(res)
+        if size > self.max_bytes:
+            log.debug("array is larger than the table cache")
+            return
+        while self._cache and self.nbytes + size > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self.nbytes -= nbytes(evicted)
+            self.evictions += 1
+        self._cache[key] = res
+        self.nbytes += size
+
+    def clear(self):
+        self._cache.clear()
+        self.nbytes = 0
+
+
+TABLE_CACHE = TableCache(TABLE_CACHE_MB * 1024 ** 2)
+
+
+@atexit.register
+def log_table_cache():
+    if TABLE_CACHE.hits or TABLE_CACHE.misses:
+        log.debug(str(TABLE_CACHE))
+
+
 class memoize(object):
     """cache the return value of a method
 
     This class is meant to be used as a decorator of methods. The return value
-    from a given method invocation will be cached on the instance whose method
-    was invoked. All arguments passed to a method decorated with memoize must
-    be hashable.
+    from a given method invocation will be cached in the process-wide
+    TABLE_CACHE. All arguments passed to a method decorated with memoize must
+    be hashable. The return value must be an array or a tuple of arrays. It
+    is marked as read-only and returned without copying on later
+    invocations (see writeable()).
 
     If a memoized method is invoked directly on its class the result will not
     be cached. Instead the method will be invoked like a static method:
@@ -33,19 +155,15 @@ class memoize(object):
             return self.func
         return partial(self, obj)
     def __call__(self, *args, **kw):
-        obj = args[0]
-        try:
-            cache = obj.__cache
-        except AttributeError:
-            cache = obj.__cache = {}
-        key = (self.func, args[1:], frozenset(kw.items()))
-        try:
-            res = cache[key]
+        key = (self.func, args, frozenset(kw.items()))
+        res = TABLE_CACHE.get(key)
+        if res is not None:
             log.debug("using cached table")
-        except KeyError:
-            log.debug("table not cached (first read)")
-            res = cache[key] = self.func(*args, **kw)
-        return np.copy(res)
+            return res
+        log.debug("table not cached (first read)")
+        res = readonly(self.func(*args, **kw))
+        TABLE_CACHE.put(key, res)
+        return res
 
 
 if os.getenv('NOCACHE', None):
@@ -69,3 +187,76 @@ class CachedTable(Table):
     @memoize_or_nothing
     def read_where(self, *args, **kwargs):
         return Table.read_where(self, *args, **kwargs)
+
+    @memoize_or_nothing
+    def read_fields(self, condition=None, fields=None,
+                    start=None, stop=None, step=None,
+                    return_idx=False):
+        """
+        Read only the requested fields of the rows passing condition.
+
+        Rows are read in blocks of READ_CHUNKSIZE and only the requested
+        fields are kept, so the full rows of the selection are never
+        materialised at once. The row coordinates are computed only once and
+        are also returned if return_idx is True. fields must be hashable
+        (i.e. a tuple) for the result to be cached.
+        """
+        trace(self, condition, fields, start, stop, step)
+        idx = self.coordinates(condition, start=start, stop=stop, step=step)
+        if fields is None:
+            dtype = self.dtype
+        else:
+            dtype = np.dtype([(name, self.dtype[name]) for name in fields])
+        rec = np.empty(len(idx), dtype=dtype)
+        for begin in xrange(0, len(idx), READ_CHUNKSIZE):
+            block_idx = idx[begin:begin + READ_CHUNKSIZE]
+            block = self.read_coordinates(block_idx)
+            block_rec = rec[begin:begin + len(block_idx)]
+            if fields is None:
+                block_rec[:] = block
+            else:
+                for name in fields:
+                    block_rec[name] = block[name]
+            del block
+        if return_idx:
+            return rec, idx
+        return rec
+
+    def iter_fields(self, condition=None, fields=None,
+                    start=None, stop=None, step=None,
+                    chunksize=READ_CHUNKSIZE,
+                    return_idx=False):
+        """
+        Same as read_fields() but yield the rows in blocks of at most
+        chunksize rows. The blocks are not cached so only one block is held
+        in memory at a time.
+        """
+        trace(self, condition, fields, start, stop, step)
+        idx = self.coordinates(condition, start=start, stop=stop, step=step)
+        if fields is not None:
+            dtype = np.dtype([(name, self.dtype[name]) for name in fields])
+        for begin in xrange(0, len(idx), chunksize):
+            block_idx = idx[begin:begin + chunksize]
+            block = self.read_coordinates(block_idx)
+            if fields is None:
+                rec = block
+            else:
+                rec = np.empty(len(block_idx), dtype=dtype)
+                for name in fields:
+                    rec[name] = block[name]
+                del block
+            if return_idx:
+                yield rec, block_idx
+            else:
+                yield rec
+
+    def coordinates(self, condition=None, start=None, stop=None, step=None):
+        """
+        The coordinates of the rows passing condition within the range
+        defined by start, stop and step. Coordinates are stored in the
+        persistent selection index cache (see index_cache.py).
+        """
+        if condition:
+            return index_cache.get_where_list(
+                self, condition, start=start, stop=stop, step=step)
+        return np.arange(*slice(start, stop, step).indices(self.nrows))
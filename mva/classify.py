@@ -29,6 +29,9 @@ from .plotting import plot_grid_scores
 from . import variables, CACHE_DIR, BDT_DIR
 from .systematics import systematic_name
 from .grid_search import BoostGridSearchCV
+from .manifest import file_hash
+from .forest import decision_function
+from . import score_cache
 
 
 def print_feature_ranking(clf, fields):
@@ -371,6 +374,8 @@ class Classifier(object):
         # classifiers for the left and right partitions
         # each trained on the opposite partition
         self.clfs = None
+        # the SHA1 hashes of their pickles (see score_cache.py)
+        self.clf_hashes = None
 
     def binning(self, year, overflow=None):
         # get the binning (see the optimize-binning script)
@@ -391,6 +396,7 @@ class Classifier(object):
         use_cache = True
         # attempt to load existing classifiers
         clfs = [None, None]
+        clf_hashes = [None, None]
         for partition_idx in range(2):
 
             category_name = self.category.get_parent().name
@@ -415,14 +421,18 @@ class Classifier(object):
                     # DANGER
                     log.warning("will apply classifiers on swapped partitions")
                     clfs[partition_idx] = clf
+                    clf_hashes[partition_idx] = file_hash(clf_filename)
                 else:
                     clfs[(partition_idx + 1) % 2] = clf
+                    clf_hashes[(partition_idx + 1) % 2] = file_hash(
+                        clf_filename)
             else:
                 log.warning("could not open %s" % clf_filename)
                 use_cache = False
                 break
         if use_cache:
             self.clfs = clfs
+            self.clf_hashes = clf_hashes
             log.info("using previously trained classifiers")
             return True
         else:
@@ -448,10 +458,16 @@ class Classifier(object):
               min_fraction_steps=200,
               cv_nfold=10,
               n_jobs=-1,
+              shared_memory=True,
+              resume=True,
               dry_run=False):
         """
         Determine best BDTs on left and right partitions. Each BDT will then be
         used on the other partition.
+
+        With shared_memory=True the grid search workers share memory-mapped
+        training arrays and with resume=True the scores of each grid point
+        are stored in the cache and reused if the search is run again.
         """
         signal_arrs, signal_weight_arrs, \
         background_arrs, background_weight_arrs = make_partitioned_dataset(
@@ -464,6 +480,7 @@ class Classifier(object):
 
         if not dry_run:
             self.clfs = [None, None]
+            self.clf_hashes = [None, None]
 
         for partition_idx in range(2):
 
@@ -527,7 +544,10 @@ class Classifier(object):
                     #score_func=accuracy_score,
                     score_func=roc_auc_score, # area under the ROC curve
                     cv=StratifiedKFold(labels_train, cv_nfold),
-                    n_jobs=n_jobs)
+                    n_jobs=n_jobs,
+                    shared_memory=shared_memory,
+                    results_dir=(os.path.join(CACHE_DIR, 'grid_search')
+                                 if resume else None))
 
                 #grid_clf = GridSearchCV(
                 #    clf, grid_params,
@@ -626,6 +646,8 @@ class Classifier(object):
             print_feature_ranking(clf, self.fields)
 
             self.clfs[(partition_idx + 1) % 2] = clf
+            self.clf_hashes[(partition_idx + 1) % 2] = file_hash(
+                '{0}.pickle'.format(clf_filename))
 
     def classify(self, sample, category, region,
                  cuts=None, systematic='NOMINAL'):
@@ -633,6 +655,27 @@ class Classifier(object):
         if self.clfs == None:
             raise RuntimeError("you must train the classifiers first")
 
+        # the scores of each table are stored (see score_cache.py)
+        keys = self.score_keys(sample, category, region,
+                               cuts=cuts, systematic=systematic)
+        table_scores = score_cache.get_all(keys)
+        if table_scores is not None:
+            # only read the weights
+            batches = sample.record_batches(
+                category=category,
+                region=region,
+                fields=[],
+                cuts=cuts,
+                systematic=systematic)
+            if ([len(batch) for batch in batches] ==
+                    [len(scores) for scores in table_scores]):
+                log.info("using stored classifier scores")
+                scores = np.concatenate(table_scores)
+                weight = np.concatenate(
+                    [batch['weight'] for batch in batches])
+                return self.transform_scores(scores), weight
+            log.warning("stored classifier scores do not match the events")
+
         partitions = sample.partitioned_records(
             category=category,
             region=region,
@@ -649,7 +692,7 @@ class Classifier(object):
                 weight = rec['weight']
                 arr = rec2array(rec, self.fields)
                 # each classifier is never used on the partition that trained it
-                scores = self.clfs[i].decision_function(arr)
+                scores = decision_function(self.clfs[i], arr)
                 score_idx[i].append((idx, scores, weight))
 
         # must preserve order of scores wrt the other fields!
@@ -665,9 +708,32 @@ class Classifier(object):
             merged_scores.append(scores)
             merged_weight.append(weight)
 
+        if keys is not None and len(keys) == len(merged_scores):
+            score_cache.put_all(keys, merged_scores)
+
         scores = np.concatenate(merged_scores)
         weight = np.concatenate(merged_weight)
+        return self.transform_scores(scores), weight
 
+    def score_keys(self, sample, category, region,
+                   cuts=None, systematic='NOMINAL'):
+        """
+        The keys of the stored scores of the tables of a sample or None if
+        the scores of this sample or classifier can not be stored
+        """
+        if not score_cache.ENABLED or self.clf_hashes is None:
+            return None
+        tables = sample.tables(systematic)
+        if tables is None:
+            return None
+        clf_key = score_cache.classifier_key(
+            self.clf_hashes, self.fields, self.partition_key)
+        condition = sample.table_selection(
+            category, region, systematic=systematic, cuts=cuts)
+        return [score_cache.get_key(clf_key, table, condition)
+                for table in tables]
+
+    def transform_scores(self, scores):
         if self.transform:
             log.info("classifier scores are transformed")
             if isinstance(self.transform, types.FunctionType):
@@ -678,5 +744,4 @@ class Classifier(object):
                 scores = -1 + 2.0 / (1.0 +
                     np.exp(-self.clfs[0].n_estimators *
                             self.clfs[0].learning_rate * scores / 1.5))
-
-        return scores, weight
+        return scores
@@ -0,0 +1,334 @@
+"""
+Compiled cut expressions.
+
+A numexpr condition (as returned by ``Cut.where()``) is decomposed into a
+tree of ``&``, ``|`` and ``~`` over atomic predicates such as
+``tau1_numTrack == 1`` or ``abs(tau1_eta) < 2.5``. The categories and
+regions share most of their atoms (preselection, tau ID, OS/SS, track
+isolation, ...) so the boolean mask of each atom is only evaluated once per
+table and the masks of the conditions are composed with numpy bitwise
+operations. Evaluating all combinations of categories and regions on a table
+then evaluates each distinct atom once instead of each combination.
+
+The atom masks are kept in the process-wide table cache (see cachedtable.py)
+and the atoms of a condition that are not cached yet are evaluated together
+in a single pass over the table. If the zone maps (see zonemap.py) show
+that only a few zones may pass the whole condition, the missing atoms are
+only evaluated on these zones instead and are not cached.
+"""
+import os
+import ast
+
+import numpy as np
+import numexpr
+
+from . import log; log = log[__name__]
+from . import zonemap
+from .zonemap import table_source
+
+ENABLED = not os.getenv('NOCUTENGINE', None)
+# number of rows evaluated at once when evaluating several atoms
+READ_CHUNKSIZE = 100000
+
+if not ENABLED:
+    log.warning("cut engine is disabled")
+
+BINARY_OPERATORS = {
+    ast.Add: '+',
+    ast.Sub: '-',
+    ast.Mult: '*',
+    ast.Div: '/',
+    ast.Mod: '%',
+    ast.Pow: '**',
+}
+
+COMPARE_OPERATORS = {
+    ast.Eq: '==',
+    ast.NotEq: '!=',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+    ast.Gt: '>',
+    ast.GtE: '>=',
+}
+
+UNARY_OPERATORS = {
+    ast.USub: '-',
+    ast.UAdd: '+',
+}
+
+CONSTANTS = {
+    'True': True,
+    'False': False,
+}
+
+
+def source(node):
+    """
+    Canonical (fully parenthesized) numexpr source of an expression
+    """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Num):
+        if isinstance(node.n, float):
+            return repr(node.n)
+        return str(node.n)
+    if isinstance(node, ast.Str):
+        return repr(node.s)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        return '({0}{1})'.format(
+            UNARY_OPERATORS[type(node.op)], source(node.operand))
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return '({0} {1} {2})'.format(
+            source(node.left), BINARY_OPERATORS[type(node.op)],
+            source(node.right))
+    if isinstance(node, ast.Compare):
+        if not all(type(op) in COMPARE_OPERATORS for op in node.ops):
+            raise ValueError("unsupported comparison")
+        terms = [source(node.left)]
+        for op, comparator in zip(node.ops, node.comparators):
+            terms.append(COMPARE_OPERATORS[type(op)])
+            terms.append(source(comparator))
+        return '({0})'.format(' '.join(terms))
+    if isinstance(node, ast.Call):
+        if (not isinstance(node.func, ast.Name) or node.keywords or
+                getattr(node, 'starargs', None) or
+                getattr(node, 'kwargs', None)):
+            raise ValueError("unsupported call")
+        return '{0}({1})'.format(
+            node.func.id, ', '.join(source(arg) for arg in node.args))
+    raise ValueError("unsupported expression {0}".format(
+        node.__class__.__name__))
+
+
+def decompose(node):
+    """
+    Return the tree of a boolean expression as nested tuples:
+    ('and', children), ('or', children), ('not', child), ('const', value) or
+    ('atom', source)
+    """
+    if isinstance(node, ast.Expression):
+        return decompose(node.body)
+    if isinstance(node, ast.BinOp) and isinstance(
+            node.op, (ast.BitAnd, ast.BitOr)):
+        op = 'and' if isinstance(node.op, ast.BitAnd) else 'or'
+        children = []
+        for child in (decompose(node.left), decompose(node.right)):
+            # flatten nested operations of the same type
+            if child[0] == op:
+                children.extend(child[1])
+            else:
+                children.append(child)
+        return op, children
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+        return 'not', decompose(node.operand)
+    if isinstance(node, ast.Name) and node.id in CONSTANTS:
+        return 'const', CONSTANTS[node.id]
+    return 'atom', source(node)
+
+
+class Compiled(object):
+    """
+    A condition compiled into a tree of atoms
+    """
+    def __init__(self, condition):
+        self.condition = condition
+        try:
+            self.tree = decompose(ast.parse(condition.strip(), mode='eval'))
+        except (SyntaxError, ValueError) as e:
+            log.debug("evaluating {0} as a single atom: {1}".format(
+                condition, e))
+            # evaluate the whole condition at once
+            self.tree = 'atom', ''.join(condition.split())
+
+    def __repr__(self):
+        return "Compiled('{0}')".format(self.condition)
+
+    @property
+    def atoms(self):
+        """
+        The sources of the distinct atoms of the condition
+        """
+        atoms = []
+        stack = [self.tree]
+        while stack:
+            op, arg = stack.pop()
+            if op == 'atom':
+                if arg not in atoms:
+                    atoms.append(arg)
+            elif op == 'not':
+                stack.append(arg)
+            elif op in ('and', 'or'):
+                stack.extend(reversed(arg))
+        return atoms
+
+    def mask(self, atom_mask, nrows):
+        """
+        Compose the mask of the condition from the masks of the atoms
+        returned by atom_mask(source). The returned array may be an atom
+        mask and must not be modified.
+        """
+        return self._compose(self.tree, atom_mask, nrows)
+
+    def _compose(self, tree, atom_mask, nrows):
+        op, arg = tree
+        if op == 'atom':
+            return atom_mask(arg)
+        if op == 'const':
+            mask = np.empty(nrows, dtype=np.bool_)
+            mask.fill(arg)
+            return mask
+        if op == 'not':
+            return ~self._compose(arg, atom_mask, nrows)
+        masks = [self._compose(child, atom_mask, nrows) for child in arg]
+        if op == 'and':
+            mask = masks[0] & masks[1]
+            for other in masks[2:]:
+                mask &= other
+        else:
+            mask = masks[0] | masks[1]
+            for other in masks[2:]:
+                mask |= other
+        return mask
+
+
+COMPILED = {}
+
+
+def compile(condition):
+    """
+    Return the compiled condition, reusing previous compilations
+    """
+    try:
+        return COMPILED[condition]
+    except KeyError:
+        compiled = Compiled(condition)
+        COMPILED[condition] = compiled
+        return compiled
+
+
+def atom_fields(source, colnames):
+    """
+    The columns referenced by an atom
+    """
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError:
+        return list(colnames)
+    names = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Name) and node.id in colnames and
+                node.id not in names):
+            names.append(node.id)
+    return names
+
+
+def read_block(table, names, start, stop):
+    """
+    Mapping of column names to the rows in [start, stop) of these columns
+    """
+    if hasattr(table, 'chunkshape'):
+        # PyTables stores rows so decompress each chunk only once
+        rec = table.read(start=start, stop=stop)
+        return dict((name, rec[name]) for name in names)
+    return dict((name, table.col(name)[start:stop]) for name in names)
+
+
+def candidate_zones(table, condition):
+    """
+    Boolean array of the zones of a table that may contain rows passing a
+    condition or None if the zone maps are disabled or most zones may pass
+    """
+    if not zonemap.ENABLED:
+        return None
+    passes = zonemap.passing_zones(table, condition)
+    if len(passes) == 0 or passes.mean() > zonemap.MAX_PASS_FRACTION:
+        return None
+    return passes
+
+
+def evaluate_atoms(table, sources, zones=None):
+    """
+    Evaluate atoms on a table and return their masks. Only the rows of the
+    zones selected by the boolean array zones are evaluated if not None and
+    the other rows are False. Otherwise a single atom is evaluated with the
+    zone maps. Several atoms are evaluated together in a single pass over
+    the table.
+    """
+    masks = [np.zeros(table.nrows, dtype=np.bool_) for _ in sources]
+    if zones is not None:
+        rows = zonemap.zone_rows(table)
+        runs = [(begin * rows, min(end * rows, table.nrows))
+                for begin, end in zonemap.zone_runs(zones)]
+    elif len(sources) == 1:
+        masks[0][zonemap.get_where_list(table, sources[0])] = True
+        return masks
+    else:
+        runs = [(0, table.nrows)]
+    colnames = set(table.colnames)
+    fields = [atom_fields(source, colnames) for source in sources]
+    names = sorted(set().union(*fields))
+    for run_begin, run_end in runs:
+        for begin in xrange(run_begin, run_end, READ_CHUNKSIZE):
+            end = min(begin + READ_CHUNKSIZE, run_end)
+            columns = read_block(table, names, begin, end)
+            for source, atom_names, mask in zip(sources, fields, masks):
+                mask[begin:end] = numexpr.evaluate(
+                    source,
+                    local_dict=dict((name, columns[name])
+                                    for name in atom_names))
+    return masks
+
+
+def table_mask(table, condition):
+    """
+    The boolean mask of the rows of a table passing a condition. The masks
+    of the atoms are kept in the table cache and the atoms that are not
+    cached yet are evaluated together, only on the zones that may pass the
+    condition if there are few of them. The mask may be an atom mask and
+    must not be modified.
+    """
+    from .cachedtable import TABLE_CACHE, readonly
+    compiled = compile(condition)
+    source = table_source(table)
+    atoms = {}
+    missing = []
+    for atom in compiled.atoms:
+        mask = TABLE_CACHE.get(('atom', source, table.nrows, atom))
+        if mask is None:
+            missing.append(atom)
+        else:
+            atoms[atom] = mask
+    zones = None
+    if len(missing) > 1:
+        zones = candidate_zones(table, condition)
+    if zones is not None:
+        log.debug("evaluating {0:d} of {1:d} atoms on {2:d} of {3:d} zones "
+                  "of {4}".format(
+                      len(missing), len(atoms) + len(missing),
+                      int(zones.sum()), len(zones), table.name))
+        for atom, mask in zip(missing,
+                              evaluate_atoms(table, missing, zones)):
+            atoms[atom] = mask
+        # the missing atoms are False outside of the candidate zones
+        rows = np.repeat(zones, zonemap.zone_rows(table))[:table.nrows]
+        return compiled.mask(atoms.__getitem__, table.nrows) & rows
+    if missing:
+        log.debug("evaluating {0:d} of {1:d} atoms on {2}".format(
+            len(missing), len(atoms) + len(missing), table.name))
+        for atom, mask in zip(missing, evaluate_atoms(table, missing)):
+            readonly(mask)
+            TABLE_CACHE.put(('atom', source, table.nrows, atom), mask)
+            atoms[atom] = mask
+    return compiled.mask(atoms.__getitem__, table.nrows)
+
+
+def get_where_list(table, condition, start=None, stop=None, step=None):
+    """
+    Same as table.get_where_list(condition, start, stop, step) but evaluate
+    each atom of the condition on the whole table only once
+    """
+    mask = table_mask(table, condition)
+    start, stop, step = slice(start, stop, step).indices(table.nrows)
+    idx = np.flatnonzero(mask[start:stop:step]) * step + start
+    return idx.astype(np.int64)
+
@@ -0,0 +1,203 @@
+"""
+Flat-array evaluation of the boosted decision trees.
+
+AdaBoostClassifier.decision_function evaluates its (up to a few hundred)
+trees one after the other in Python and computes the SAMME.R contribution
+of each tree from its predicted probabilities. Here the nodes of all trees
+are copied once into contiguous arrays (feature, threshold, children and the
+SAMME.R contribution of each leaf) and the events are passed down all trees
+at once, one level of the trees per numpy operation. The contributions of
+the trees are then summed in the same order as scikit-learn so the scores
+are identical to decision_function.
+
+Only AdaBoost SAMME.R ensembles of single-output DecisionTreeClassifiers are
+compiled. Set NOCOMPILEDFOREST to always use decision_function.
+"""
+import os
+
+import numpy as np
+
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.ensemble.weight_boosting import _samme_proba
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.tree._tree import DTYPE, TREE_LEAF
+
+from . import log; log = log[__name__]
+
+ENABLED = not os.getenv('NOCOMPILEDFOREST', None)
+# number of events passed down the trees at once
+CHUNKSIZE = 10000
+
+
+class LeafProba(object):
+    """
+    Stand-in for a tree whose predict_proba returns the class probabilities
+    of its leaves, so the SAMME.R contributions of the leaves are computed
+    by scikit-learn itself
+    """
+    def __init__(self, proba):
+        self.proba = proba
+
+    def predict_proba(self, X):
+        # _samme_proba modifies the probabilities in place
+        return self.proba.copy()
+
+
+def leaf_proba(tree, n_classes):
+    """
+    The class probabilities predicted in each node of a tree as
+    DecisionTreeClassifier.predict_proba
+    """
+    proba = tree.value[:, 0, :n_classes].copy()
+    normalizer = proba.sum(axis=1)[:, np.newaxis]
+    normalizer[normalizer == 0.0] = 1.0
+    proba /= normalizer
+    return proba
+
+
+def node_depth(children_left, children_right):
+    """
+    The depth of each node of a tree (the children of a node always follow
+    it in scikit-learn trees)
+    """
+    depth = np.zeros(len(children_left), dtype=np.intp)
+    for node in xrange(len(children_left)):
+        left = children_left[node]
+        if left != TREE_LEAF:
+            depth[left] = depth[node] + 1
+            depth[children_right[node]] = depth[node] + 1
+    return depth
+
+
+class CompiledForest(object):
+
+    def __init__(self, feature, threshold, children_left, children_right,
+                 values, roots, max_depth, norm, n_classes):
+        self.feature = feature
+        self.threshold = threshold
+        # the children of the leaves are the leaves themselves
+        self.children_left = children_left
+        self.children_right = children_right
+        # the SAMME.R contribution of each node
+        self.values = values
+        self.roots = roots
+        self.max_depth = max_depth
+        self.norm = norm
+        self.n_classes = n_classes
+
+    @classmethod
+    def compile(cls, clf):
+        if not isinstance(clf, AdaBoostClassifier):
+            raise TypeError("not an AdaBoostClassifier")
+        if clf.algorithm != 'SAMME.R':
+            raise TypeError("only SAMME.R is supported")
+        n_classes = clf.n_classes_
+        features = []
+        thresholds = []
+        lefts = []
+        rights = []
+        values = []
+        roots = []
+        max_depth = 0
+        offset = 0
+        for estimator in clf.estimators_:
+            if (not isinstance(estimator, DecisionTreeClassifier)
+                    or estimator.n_outputs_ != 1):
+                raise TypeError("only single-output decision trees "
+                                "are supported")
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count) + offset
+            leaf = tree.children_left == TREE_LEAF
+            left = np.where(leaf, nodes, tree.children_left + offset)
+            right = np.where(leaf, nodes, tree.children_right + offset)
+            feature = np.where(leaf, 0, tree.feature)
+            proba = LeafProba(leaf_proba(tree, n_classes))
+            roots.append(offset)
+            features.append(feature)
+            thresholds.append(tree.threshold)
+            lefts.append(left)
+            rights.append(right)
+            values.append(_samme_proba(proba, n_classes, None))
+            max_depth = max(max_depth, node_depth(
+                tree.children_left, tree.children_right).max())
+            offset += tree.node_count
+        return cls(np.concatenate(features).astype(np.intp),
+                   np.concatenate(thresholds).astype(np.float64),
+                   np.concatenate(lefts).astype(np.intp),
+                   np.concatenate(rights).astype(np.intp),
+                   np.concatenate(values),
+                   np.array(roots, dtype=np.intp),
+                   max_depth,
+                   clf.estimator_weights_.sum(),
+                   n_classes)
+
+    def leaves(self, X):
+        """
+        The leaf reached by each event in each tree
+        """
+        rows = np.arange(len(X))[:, np.newaxis]
+        nodes = np.repeat(self.roots[np.newaxis, :], len(X), axis=0)
+        for depth in xrange(self.max_depth):
+            # compared as the float32 inputs of scikit-learn trees
+            goes_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(goes_left,
+                             self.children_left[nodes],
+                             self.children_right[nodes])
+        return nodes
+
+    def decision_function(self, X):
+        """
+        Same as AdaBoostClassifier.decision_function
+        """
+        X = np.asarray(X, dtype=DTYPE)
+        if self.n_classes == 2:
+            scores = np.empty(len(X), dtype=np.float64)
+        else:
+            scores = np.empty((len(X), self.n_classes), dtype=np.float64)
+        for begin in xrange(0, len(X), CHUNKSIZE):
+            values = self.values[self.leaves(X[begin:begin + CHUNKSIZE])]
+            # summed tree after tree like sum() in scikit-learn
+            pred = np.add.accumulate(values, axis=1)[:, -1]
+            pred /= self.norm
+            if self.n_classes == 2:
+                pred[:, 0] *= -1
+                pred = pred.sum(axis=1)
+            scores[begin:begin + len(pred)] = pred
+        return scores
+
+
+# the compiled forests and the classifiers themselves (keeping them alive so
+# their id is not reused) by id
+CACHE = {}
+
+
+def compiled(clf):
+    """
+    The cached CompiledForest of a classifier or None if the classifier can
+    not be compiled
+    """
+    try:
+        forest, cached_clf = CACHE[id(clf)]
+        if cached_clf is clf:
+            return forest
+    except KeyError:
+        pass
+    try:
+        forest = CompiledForest.compile(clf)
+    except TypeError as e:
+        log.warning("using decision_function: {0}".format(e))
+        forest = None
+    CACHE[id(clf)] = forest, clf
+    return forest
+
+
+def decision_function(clf, X):
+    """
+    The decision function of a classifier evaluated with its compiled forest
+    if possible
+    """
+    if ENABLED:
+        forest = compiled(clf)
+        if forest is not None:
+            return forest.decision_function(X)
+    return clf.decision_function(X)
@@ -7,8 +7,15 @@ of an estimator.
 #         Gael Varoquaux <gael.varoquaux@normalesup.org>
 # License: BSD Style.
 
+import os
 import time
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+import cPickle as pickle
 from copy import copy
+from collections import Sized
 import operator
 
 import numpy as np
@@ -21,8 +28,13 @@ from sklearn.utils import safe_mask
 from sklearn.grid_search import GridSearchCV, ParameterGrid, _CVScoreTuple
 from sklearn.metrics.scorer import check_scoring
 
+from . import log; log = log[__name__]
+
 __all__ = ['BoostGridSearchCV',]
 
+# the arrays are placed in memory rather than on disk if possible
+SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
 
 def fit_grid_point(base_estimator, parameters,
                    X, y, sample_weight,
@@ -119,12 +131,157 @@ def score_each_boost(estimator, parameters,
     return all_scores, all_clf_params, n_test_samples
 
 
+class SharedArrays(object):
+    """
+    The training arrays and the train and test indices of each fold saved
+    once as .npy files (in memory under /dev/shm if available) and
+    memory-mapped by the worker processes, so the jobs only carry the name
+    of the directory instead of pickled copies of the arrays
+    """
+    def __init__(self, X, y, sample_weight, cv, directory=SHARED_DIR):
+        if not isinstance(X, np.ndarray):
+            raise ValueError(
+                "only dense arrays can be shared with the workers")
+        self.path = tempfile.mkdtemp(prefix='grid_search_', dir=directory)
+        try:
+            self.save('X', X)
+            self.save('y', y)
+            self.save('sample_weight', sample_weight)
+            self.n_folds = 0
+            for train, test in cv:
+                self.save('train_{0:d}'.format(self.n_folds), train)
+                self.save('test_{0:d}'.format(self.n_folds), test)
+                self.n_folds += 1
+        except:
+            self.remove()
+            raise
+
+    def save(self, name, arr):
+        if arr is not None:
+            np.save(os.path.join(self.path, name + '.npy'), arr)
+
+    def load(self, name):
+        path = os.path.join(self.path, name + '.npy')
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def fold(self, fold):
+        return (self.load('train_{0:d}'.format(fold)),
+                self.load('test_{0:d}'.format(fold)))
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def fit_and_score(args):
+    """
+    Fit one grid point on one fold of the shared arrays and score the
+    ensemble for each number of estimators
+    """
+    (index, shared, base_estimator, parameters, fold,
+     min_n_estimators, score_func, verbose, fit_params) = args
+    X = shared.load('X')
+    y = shared.load('y')
+    sample_weight = shared.load('sample_weight')
+    train, test = shared.fold(fold)
+    estimator, parameters, train, test = fit_grid_point(
+        base_estimator, parameters,
+        X, y, sample_weight,
+        train, test, verbose,
+        **fit_params)
+    return index, score_each_boost(
+        estimator, parameters,
+        min_n_estimators,
+        X, y, sample_weight,
+        score_func, train, test,
+        verbose)
+
+
+def search_key(base_estimator, shared, min_n_estimators, score_func):
+    """
+    A SHA1 hash of the estimator, the scoring function and the contents of
+    the shared arrays and folds
+    """
+    sha1 = hashlib.sha1()
+    sha1.update(repr(sorted(base_estimator.get_params().items())))
+    sha1.update(getattr(score_func, '__name__', repr(score_func)))
+    sha1.update(str(min_n_estimators))
+    names = ['X', 'y', 'sample_weight']
+    for fold in xrange(shared.n_folds):
+        names.extend(['train_{0:d}'.format(fold), 'test_{0:d}'.format(fold)])
+    for name in names:
+        arr = shared.load(name)
+        if arr is None:
+            sha1.update('{0}:None'.format(name))
+            continue
+        sha1.update('{0}:{1}:{2}'.format(name, arr.dtype.str, arr.shape))
+        sha1.update(np.ascontiguousarray(arr).data)
+    return sha1.hexdigest()
+
+
+class ResultStore(object):
+    """
+    The scores of each fit of a grid search written to disk as soon as they
+    are computed, one pickle per grid point and fold, so an interrupted
+    search can be resumed
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, parameters, fold):
+        key = hashlib.sha1('{0!r}:{1:d}'.format(
+            sorted(parameters.items()), fold)).hexdigest()
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, parameters, fold):
+        try:
+            with open(self.path(parameters, fold), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, parameters, fold, result):
+        path = self.path(parameters, fold)
+        # write to a temporary file first so that an interrupted search
+        # never leaves a partially written result
+        tmp_path = '{0}.{1:d}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+
+def log_progress(done, n_fits, n_resumed, start_time):
+    elapsed = time.time() - start_time
+    n_computed = done - n_resumed
+    if n_computed > 0:
+        eta = logger.short_format_time(
+            elapsed / n_computed * (n_fits - done))
+    else:
+        eta = '?'
+    log.info("[BoostGridSearchCV] {0:d}/{1:d} fits done ({2:.0%}), "
+             "elapsed {3}, ETA {4}".format(
+                 done, n_fits, done / float(n_fits),
+                 logger.short_format_time(elapsed), eta))
+
+
 class BoostGridSearchCV(GridSearchCV):
 
     def __init__(self, estimator, param_grid,
             max_n_estimators,
             min_n_estimators=1,
+            shared_memory=False,
+            results_dir=None,
             **kwargs):
+        """
+        With shared_memory=True the training arrays and folds are shared
+        with the worker processes through memory-mapped files and each job
+        fits and scores one grid point on one fold. The scores of each fit
+        are then also stored under results_dir (if not None) and reused by
+        a later search on the same arrays.
+        """
 
         if 'n_estimators' in param_grid:
             raise ValueError(
@@ -136,6 +293,8 @@ class BoostGridSearchCV(GridSearchCV):
                 'max_n_estimators')
         self.max_n_estimators = max_n_estimators
         self.min_n_estimators = min_n_estimators
+        self.shared_memory = shared_memory
+        self.results_dir = results_dir
         super(BoostGridSearchCV, self).__init__(
             estimator=estimator,
             param_grid=param_grid,
@@ -178,32 +337,36 @@ class BoostGridSearchCV(GridSearchCV):
         param_grid['n_estimators'] = [self.max_n_estimators]
         grid = ParameterGrid(param_grid)
 
-        pre_dispatch = self.pre_dispatch
-
-        clfs = Parallel(
-            n_jobs=self.n_jobs, verbose=self.verbose,
-            pre_dispatch=pre_dispatch
-        )(
-            delayed(fit_grid_point)(base_estimator, clf_params,
-                                    X, y, sample_weight,
-                                    train, test,
-                                    self.verbose, **self.fit_params)
-            for clf_params in grid
-            for train, test in cv)
-
-        # now use the already fitted ensembles but trancate to N estimators for
-        # N from 1 to n_estimators_max - 1 (inclusive)
-        out = Parallel(
-            n_jobs=self.n_jobs, verbose=self.verbose,
-            pre_dispatch=pre_dispatch
-        )(
-            delayed(score_each_boost)(clf, clf_params,
-                                      self.min_n_estimators,
-                                      X, y, sample_weight,
-                                      self.score_func,
-                                      train, test,
-                                      self.verbose)
-            for clf, clf_params, train, test in clfs)
+        if self.shared_memory:
+            out = self._fit_shared(base_estimator, grid,
+                                   X, y, sample_weight, cv)
+        else:
+            pre_dispatch = self.pre_dispatch
+
+            clfs = Parallel(
+                n_jobs=self.n_jobs, verbose=self.verbose,
+                pre_dispatch=pre_dispatch
+            )(
+                delayed(fit_grid_point)(base_estimator, clf_params,
+                                        X, y, sample_weight,
+                                        train, test,
+                                        self.verbose, **self.fit_params)
+                for clf_params in grid
+                for train, test in cv)
+
+            # now use the already fitted ensembles but trancate to N
+            # estimators for N from 1 to n_estimators_max - 1 (inclusive)
+            out = Parallel(
+                n_jobs=self.n_jobs, verbose=self.verbose,
+                pre_dispatch=pre_dispatch
+            )(
+                delayed(score_each_boost)(clf, clf_params,
+                                          self.min_n_estimators,
+                                          X, y, sample_weight,
+                                          self.score_func,
+                                          train, test,
+                                          self.verbose)
+                for clf, clf_params, train, test in clfs)
 
         out = reduce(operator.add, [zip(*stage) for stage in out])
         # out is now a list of triplet: score, estimator_params, n_test_samples
@@ -261,3 +424,65 @@ class BoostGridSearchCV(GridSearchCV):
                 best_estimator.fit(X, **fit_params)
             self.best_estimator_ = best_estimator
         return self
+
+    def _fit_shared(self, base_estimator, grid, X, y, sample_weight, cv):
+        """
+        Fit and score each grid point on each fold in a pool of processes
+        sharing the memory-mapped training arrays
+        """
+        n_jobs = self.n_jobs
+        if n_jobs < 0:
+            n_jobs = max(multiprocessing.cpu_count() + 1 + n_jobs, 1)
+        shared = SharedArrays(X, y, sample_weight, cv)
+        pool = None
+        try:
+            store = None
+            if self.results_dir is not None:
+                store = ResultStore(os.path.join(
+                    self.results_dir,
+                    search_key(base_estimator, shared,
+                               self.min_n_estimators, self.score_func)))
+                log.info("[BoostGridSearchCV] storing the results in "
+                         "{0}".format(store.directory))
+            points = [(clf_params, fold)
+                      for clf_params in grid
+                      for fold in xrange(shared.n_folds)]
+            n_fits = len(points)
+            out = [None] * n_fits
+            jobs = []
+            for index, (clf_params, fold) in enumerate(points):
+                if store is not None:
+                    out[index] = store.get(clf_params, fold)
+                    if out[index] is not None:
+                        continue
+                jobs.append((index, shared, base_estimator, clf_params, fold,
+                             self.min_n_estimators, self.score_func,
+                             self.verbose, self.fit_params))
+            n_resumed = n_fits - len(jobs)
+            if n_resumed:
+                log.info("[BoostGridSearchCV] resuming with {0:d} of {1:d} "
+                         "fits already done".format(n_resumed, n_fits))
+            start_time = time.time()
+            if n_jobs > 1 and len(jobs) > 1:
+                pool = multiprocessing.Pool(min(n_jobs, len(jobs)))
+                iterator = pool.imap_unordered(fit_and_score, jobs)
+                # a timeout keeps the wait interruptible in python 2
+                results = (iterator.next(2 ** 31) for job in jobs)
+            else:
+                results = (fit_and_score(job) for job in jobs)
+            for done, (index, result) in enumerate(results, n_resumed + 1):
+                out[index] = result
+                if store is not None:
+                    clf_params, fold = points[index]
+                    store.put(clf_params, fold, result)
+                log_progress(done, n_fits, n_resumed, start_time)
+            if pool is not None:
+                pool.close()
+                pool.join()
+                pool = None
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            shared.remove()
+        return out
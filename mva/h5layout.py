@@ -0,0 +1,193 @@
+"""
+HDF5 layouts of the ntuples.
+
+A layout is the compression library and level, the shuffle filter and the
+number of rows in each HDF5 chunk of the tables, written as a string::
+
+    lzo:0                   (the layout written by ntup-merge by default)
+    blosc:5:shuffle         (blosc level 5 with the shuffle filter)
+    zlib:1:noshuffle:16384  (zlib level 1, chunks of 16384 rows)
+
+ntup-repack rewrites <student>.h5 with another layout. ntup-benchmark
+repacks <student>.h5 into each candidate layout and replays an access trace
+recorded by the samples (set HHANA_H5_TRACE=<file> while running the
+analysis, see cachedtable.py) against each of them, reporting the file size,
+the read throughput and the peak memory.
+"""
+import os
+import json
+import time
+import resource
+
+import numpy as np
+import tables
+
+from . import log; log = log[__name__]
+
+# number of rows copied or read at once
+READ_CHUNKSIZE = 100000
+
+
+class Layout(object):
+
+    def __init__(self, complib='lzo', complevel=0, shuffle=False,
+                 chunkrows=None):
+        self.complib = complib
+        self.complevel = complevel
+        self.shuffle = shuffle
+        # None lets PyTables choose the chunk shape from the expected rows
+        self.chunkrows = chunkrows
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Layout of a string complib:complevel[:shuffle|noshuffle][:chunkrows]
+        """
+        parts = spec.split(':')
+        if len(parts) < 2:
+            raise ValueError("invalid layout {0}".format(spec))
+        layout = cls(parts[0], int(parts[1]))
+        for part in parts[2:]:
+            if part == 'shuffle':
+                layout.shuffle = True
+            elif part == 'noshuffle':
+                layout.shuffle = False
+            elif part.isdigit():
+                layout.chunkrows = int(part)
+            else:
+                raise ValueError("invalid layout {0}".format(spec))
+        return layout
+
+    def __str__(self):
+        spec = '{0}:{1:d}:{2}'.format(
+            self.complib, self.complevel,
+            'shuffle' if self.shuffle else 'noshuffle')
+        if self.chunkrows is not None:
+            spec += ':{0:d}'.format(self.chunkrows)
+        return spec
+
+    @property
+    def filters(self):
+        return tables.Filters(complib=self.complib,
+                              complevel=self.complevel,
+                              shuffle=self.shuffle)
+
+    @property
+    def chunkshape(self):
+        if self.chunkrows is None:
+            return None
+        return (self.chunkrows,)
+
+    def create_table(self, h5file, where, name, description, expectedrows):
+        return h5file.create_table(
+            where, name, description, filters=self.filters,
+            chunkshape=self.chunkshape, expectedrows=expectedrows)
+
+
+DEFAULT_LAYOUT = Layout()
+
+
+def repack(h5_path, output, layout):
+    """
+    Rewrite the tables of an HDF5 file with a layout
+    """
+    tmp_output = output + '.tmp'
+    h5file = tables.open_file(h5_path)
+    outfile = tables.open_file(tmp_output, 'w')
+    try:
+        h5file.root._v_attrs._f_copy(outfile.root)
+        for node in h5file.root:
+            if not isinstance(node, tables.Table):
+                node._f_copy(outfile.root, recursive=True)
+                continue
+            log.info("repacking {0} ({1:d} rows) ...".format(
+                node.name, node.nrows))
+            table = layout.create_table(
+                outfile, outfile.root, node.name, node.description,
+                node.nrows)
+            for begin in xrange(0, node.nrows, READ_CHUNKSIZE):
+                table.append(node.read(begin, begin + READ_CHUNKSIZE))
+            table.flush()
+            node.attrs._f_copy(table)
+    finally:
+        h5file.close()
+        outfile.close()
+    os.rename(tmp_output, output)
+    return output
+
+
+def read_trace(path):
+    """
+    The reads recorded in a trace file
+    """
+    accesses = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                accesses.append(json.loads(line))
+    return accesses
+
+
+def replay_access(table, access):
+    """
+    Read the fields of the rows passing a condition like
+    CachedTable.read_fields() without the caches. Return the number of rows
+    and bytes read.
+    """
+    condition = access['condition']
+    start, stop, step = access['start'], access['stop'], access['step']
+    if condition:
+        idx = table.get_where_list(condition, start=start, stop=stop,
+                                   step=step)
+    else:
+        idx = np.arange(*slice(start, stop, step).indices(table.nrows))
+    fields = access['fields']
+    if fields is None:
+        dtype = table.dtype
+    else:
+        dtype = np.dtype([(name, table.dtype[name]) for name in fields])
+    rec = np.empty(len(idx), dtype=dtype)
+    for begin in xrange(0, len(idx), READ_CHUNKSIZE):
+        block_idx = idx[begin:begin + READ_CHUNKSIZE]
+        block = table.read_coordinates(block_idx)
+        block_rec = rec[begin:begin + len(block_idx)]
+        if fields is None:
+            block_rec[:] = block
+        else:
+            for name in fields:
+                block_rec[name] = block[name]
+        del block
+    return len(rec), rec.nbytes
+
+
+def replay(h5_path, accesses, driver=None):
+    """
+    Replay the reads of a trace on an HDF5 file. Return the number of rows
+    and bytes read, the time spent and the peak resident memory in bytes of
+    this process (run each replay in a new process to compare layouts).
+    """
+    kwargs = {}
+    if driver is not None:
+        kwargs['driver'] = driver
+    rows = 0
+    nbytes = 0
+    begin = time.time()
+    h5file = tables.open_file(h5_path, **kwargs)
+    try:
+        for access in accesses:
+            table = getattr(h5file.root, access['table'])
+            access_rows, access_bytes = replay_access(table, access)
+            rows += access_rows
+            nbytes += access_bytes
+    finally:
+        h5file.close()
+    seconds = time.time() - begin
+    # kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {
+        'rows': rows,
+        'bytes': nbytes,
+        'seconds': seconds,
+        'peak_memory': peak,
+    }
@@ -0,0 +1,131 @@
+"""
+One-pass histogram filling.
+
+Filling ROOT histograms with fill_hist calls TH1::Fill for each entry of
+each histogram, for the nominal weights and again for each weight
+systematic. Here the bin of each entry is found once per set of fields and
+binning with numpy (the same bin as TAxis::FindBin, including the underflow
+and overflow) and the sums of the weights and of the squared weights of all
+histograms and weight variations sharing these bins are accumulated with
+np.bincount. The ROOT histograms are only updated once at the end by
+HistFiller.flush(). A Histogram (see histogram.py) may be filled in place of
+a ROOT histogram and then only its arrays are updated.
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from . import log; log = log[__name__]
+from .histogram import Axis, Histogram, hist_axes, num_cells
+
+
+def bin_index(axes, columns):
+    """
+    The global bin (as returned by TH1::GetBin) of each entry
+    """
+    if len(axes) != len(columns):
+        raise ValueError("{0:d} columns for {1:d} axes".format(
+            len(columns), len(axes)))
+    index = None
+    stride = 1
+    for axis, column in zip(axes, columns):
+        axis_index = axis.index(column)
+        if index is None:
+            index = axis_index
+        else:
+            index += axis_index * stride
+        stride *= axis.nbins + 2
+    return index
+
+
+class Sums(object):
+    """
+    The sums of the weights and of the squared weights in each cell of a
+    histogram
+    """
+    def __init__(self, hist, ncells):
+        self.hist = hist
+        self.sumw = np.zeros(ncells)
+        self.sumw2 = np.zeros(ncells)
+        self.entries = 0
+        # True if any weight differs from 1
+        self.weighted = False
+
+
+class HistFiller(object):
+    """
+    Accumulate the sums of weights of histograms and write them into the
+    histograms with flush(). The bins returned by index() may be filled into
+    any histogram with the same binning, such as the weight variations of a
+    histogram.
+    """
+    def __init__(self):
+        self.axes = {}
+        self.sums = OrderedDict()
+
+    def hist_axes(self, hist):
+        try:
+            return self.axes[id(hist)]
+        except KeyError:
+            axes = hist_axes(hist)
+            self.axes[id(hist)] = axes
+            return axes
+
+    def index(self, hist, columns):
+        """
+        The global bins of the entries with the given values of the columns
+        in a histogram
+        """
+        return bin_index(self.hist_axes(hist), columns)
+
+    def fill(self, hist, index, weights=None):
+        """
+        Add entries given by their global bins to a histogram
+        """
+        try:
+            sums = self.sums[id(hist)]
+        except KeyError:
+            sums = Sums(hist, num_cells(self.hist_axes(hist)))
+            self.sums[id(hist)] = sums
+        ncells = len(sums.sumw)
+        sums.entries += len(index)
+        if weights is None:
+            counts = np.bincount(index, minlength=ncells)
+            sums.sumw += counts
+            sums.sumw2 += counts
+            return
+        weights = np.asarray(weights, dtype=np.float64)
+        sums.sumw += np.bincount(index, weights=weights, minlength=ncells)
+        sums.sumw2 += np.bincount(index, weights=weights * weights,
+                                  minlength=ncells)
+        if not sums.weighted and np.any(weights != 1):
+            sums.weighted = True
+
+    def flush(self):
+        """
+        Add the accumulated sums to the histograms
+        """
+        for sums in self.sums.values():
+            hist = sums.hist
+            if isinstance(hist, Histogram):
+                hist.sumw += sums.sumw
+                hist.sumw2 += sums.sumw2
+                hist.entries += sums.entries
+                continue
+            entries = hist.GetEntries() + sums.entries
+            if sums.weighted and hist.GetSumw2N() == 0:
+                # as TH1::Fill with the first weight other than 1
+                hist.Sumw2()
+            for cell in np.flatnonzero(sums.sumw):
+                cell = int(cell)
+                hist.SetBinContent(
+                    cell, hist.GetBinContent(cell) + sums.sumw[cell])
+            if hist.GetSumw2N() > 0:
+                hist_sumw2 = hist.GetSumw2()
+                for cell in np.flatnonzero(sums.sumw2):
+                    cell = int(cell)
+                    hist_sumw2.AddAt(
+                        hist_sumw2.At(cell) + sums.sumw2[cell], cell)
+            hist.SetEntries(entries)
+        self.sums.clear()
+        self.axes.clear()
@@ -0,0 +1,365 @@
+"""
+Histograms held in numpy arrays.
+
+Adding, subtracting and scaling rootpy histograms goes through PyROOT for
+each operation and each systematic variation and every intermediate result
+is a Clone() of a TH1. A Histogram holds the sums of the weights and of the
+squared weights of all cells (including the underflow and overflow, in the
+order of the global bins of TH1::GetBin) in numpy arrays and the histograms
+of its systematic variations in the systematics dict like the rootpy
+histograms of the samples. Arithmetic applies to the nominal and to all the
+systematic variations at once (a variation missing from one of the operands
+is taken as its nominal).
+
+Histogram also implements the few TH1 methods used while filling the
+histograms of the samples (Clone, Reset, GetDimension, GetName, GetTitle and
+SetTitle) so the samples can fill a Histogram in place of a rootpy histogram
+(see HistFiller in histfill.py). The ROOT histograms are only created or updated at the end
+with to_hist() or add_to_hist().
+"""
+import numpy as np
+
+from . import log; log = log[__name__]
+
+# the numpy types of the cells of the TH1 classes by their TArray base class
+BUFFER_DTYPES = (
+    ('TArrayD', np.float64),
+    ('TArrayF', np.float32),
+    ('TArrayI', np.int32),
+    ('TArrayS', np.int16),
+    ('TArrayC', np.int8),
+)
+
+
+class Axis(object):
+    """
+    The binning of an axis of a histogram
+    """
+    def __init__(self, nbins, xmin, xmax, edges=None):
+        self.nbins = nbins
+        self.xmin = xmin
+        self.xmax = xmax
+        # the bin edges of variable bins or None for fixed bins
+        self.edges = None if edges is None else np.asarray(
+            edges, dtype=np.float64)
+
+    @classmethod
+    def from_axis(cls, axis):
+        """
+        Binning of a ROOT TAxis
+        """
+        nbins = axis.GetNbins()
+        edges = None
+        if axis.IsVariableBinSize():
+            edges = [axis.GetBinLowEdge(i) for i in xrange(1, nbins + 2)]
+        return cls(nbins, axis.GetXmin(), axis.GetXmax(), edges)
+
+    @property
+    def key(self):
+        if self.edges is None:
+            return self.nbins, self.xmin, self.xmax
+        return tuple(self.edges)
+
+    def index(self, values):
+        """
+        The bins of the values as found by TAxis::FindBin: 0 below xmin and
+        nbins + 1 at or above xmax (and for NaN)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self.edges is not None:
+            return np.searchsorted(self.edges, values, side='right')
+        index = np.empty(len(values), dtype=np.intp)
+        index.fill(self.nbins + 1)
+        with np.errstate(invalid='ignore'):
+            inside = (values >= self.xmin) & (values < self.xmax)
+            index[values < self.xmin] = 0
+        index[inside] = 1 + (
+            self.nbins * (values[inside] - self.xmin) /
+            (self.xmax - self.xmin)).astype(np.intp)
+        return index
+
+
+def hist_axes(hist):
+    """
+    The binning of the axes of a ROOT histogram or a Histogram
+    """
+    if isinstance(hist, Histogram):
+        return hist.axes
+    getters = (hist.GetXaxis, hist.GetYaxis, hist.GetZaxis)
+    return [Axis.from_axis(getters[dim]())
+            for dim in xrange(hist.GetDimension())]
+
+
+def num_cells(axes):
+    return reduce(lambda cells, axis: cells * (axis.nbins + 2), axes, 1)
+
+
+def hist_buffer(hist):
+    """
+    A numpy array sharing the memory of the cells of a ROOT histogram
+    """
+    for base, dtype in BUFFER_DTYPES:
+        if hist.InheritsFrom(base):
+            break
+    else:
+        raise TypeError(
+            "unsupported histogram class {0}".format(hist.ClassName()))
+    ncells = hist.GetSize()
+    buf = hist.GetArray()
+    buf.SetSize(ncells)
+    return np.frombuffer(buf, dtype=dtype, count=ncells)
+
+
+def sumw2_buffer(hist):
+    """
+    A numpy array sharing the memory of the sums of the squared weights of a
+    ROOT histogram (see TH1::Sumw2)
+    """
+    if hist.GetSumw2N() == 0:
+        hist.Sumw2()
+    sumw2 = hist.GetSumw2()
+    ncells = sumw2.GetSize()
+    buf = sumw2.GetArray()
+    buf.SetSize(ncells)
+    return np.frombuffer(buf, dtype=np.float64, count=ncells)
+
+
+class Histogram(object):
+
+    def __init__(self, axes, sumw=None, sumw2=None, entries=0.,
+                 name=None, title=None):
+        self.axes = list(axes)
+        ncells = num_cells(self.axes)
+        if sumw is None:
+            self.sumw = np.zeros(ncells)
+        else:
+            self.sumw = np.array(sumw, dtype=np.float64)
+        if sumw2 is None:
+            self.sumw2 = np.zeros(ncells)
+        else:
+            self.sumw2 = np.array(sumw2, dtype=np.float64)
+        if len(self.sumw) != ncells or len(self.sumw2) != ncells:
+            raise ValueError(
+                "the binning has {0:d} cells but the sums have {1:d}".format(
+                    ncells, len(self.sumw)))
+        self.entries = entries
+        self.name = name
+        self.title = title
+        # the Histograms of the systematic variations by term
+        self.systematics = {}
+
+    @classmethod
+    def from_hist(cls, hist, empty=False):
+        """
+        Histogram of the contents and the systematic variations of a ROOT
+        histogram or an empty Histogram with the same binning
+        """
+        self = cls(hist_axes(hist), name=hist.GetName(),
+                   title=hist.GetTitle())
+        if empty:
+            return self
+        self.sumw[:] = hist_buffer(hist)
+        if hist.GetSumw2N() > 0:
+            self.sumw2[:] = sumw2_buffer(hist)
+        else:
+            # the errors of unweighted histograms
+            self.sumw2[:] = np.abs(self.sumw)
+        self.entries = hist.GetEntries()
+        for term, sys_hist in getattr(hist, 'systematics', {}).items():
+            self.systematics[term] = cls.from_hist(sys_hist)
+        return self
+
+    @property
+    def key(self):
+        return tuple(axis.key for axis in self.axes)
+
+    def copy(self, systematics=True, name=None):
+        """
+        A copy of this Histogram and (by default) of its systematic
+        variations
+        """
+        hist = Histogram(self.axes, self.sumw, self.sumw2,
+                         entries=self.entries,
+                         name=self.name if name is None else name,
+                         title=self.title)
+        if systematics:
+            for term, sys_hist in self.systematics.items():
+                hist.systematics[term] = sys_hist.copy()
+        return hist
+
+    def Clone(self, name=None, **kwargs):
+        # like rootpy's Clone the systematics are not copied
+        return self.copy(systematics=False, name=name)
+
+    def Reset(self):
+        self.sumw.fill(0)
+        self.sumw2.fill(0)
+        self.entries = 0.
+
+    def GetDimension(self):
+        return len(self.axes)
+
+    def GetName(self):
+        return self.name
+
+    def GetTitle(self):
+        return self.title
+
+    def SetTitle(self, title):
+        self.title = title
+
+    def integral(self, overflow=False):
+        if overflow:
+            return self.sumw.sum()
+        shape = [axis.nbins + 2 for axis in reversed(self.axes)]
+        inner = tuple([slice(1, -1)] * len(self.axes))
+        return self.sumw.reshape(shape)[inner].sum()
+
+    def check_compatible(self, other):
+        if not isinstance(other, Histogram):
+            raise TypeError(
+                "unsupported operand {0}".format(type(other).__name__))
+        if self.key != other.key:
+            raise ValueError("histograms have different binning")
+
+    def _add_sums(self, other, factor):
+        self.sumw += factor * other.sumw
+        self.sumw2 += factor * factor * other.sumw2
+        # as TH1::Add
+        self.entries = abs(self.entries + factor * other.entries)
+
+    def add(self, other, factor=1.):
+        """
+        Add another Histogram multiplied by a factor to this one and to each
+        systematic variation
+        """
+        self.check_compatible(other)
+        # the variations are updated before the nominal they may start from
+        for term in set(self.systematics) | set(other.systematics):
+            if term not in self.systematics:
+                self.systematics[term] = self.copy(systematics=False)
+            self.systematics[term]._add_sums(
+                other.systematics.get(term, other), factor)
+        self._add_sums(other, factor)
+        return self
+
+    def scale(self, factor):
+        self.sumw *= factor
+        self.sumw2 *= factor * factor
+        for sys_hist in self.systematics.values():
+            sys_hist.scale(factor)
+        return self
+
+    def __iadd__(self, other):
+        return self.add(other)
+
+    def __isub__(self, other):
+        return self.add(other, -1.)
+
+    def __imul__(self, factor):
+        return self.scale(factor)
+
+    def __add__(self, other):
+        return self.copy().add(other)
+
+    def __radd__(self, other):
+        # for sum()
+        if other == 0:
+            return self.copy()
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        return self.copy().add(other, -1.)
+
+    def __mul__(self, factor):
+        return self.copy().scale(factor)
+
+    __rmul__ = __mul__
+
+    def _write(self, hist, add):
+        contents = hist_buffer(hist)
+        if len(contents) != len(self.sumw):
+            raise ValueError("histograms have different binning")
+        sumw2 = sumw2_buffer(hist)
+        entries = self.entries
+        if add:
+            contents += self.sumw
+            sumw2 += self.sumw2
+            entries += hist.GetEntries()
+        else:
+            contents[:] = self.sumw
+            sumw2[:] = self.sumw2
+        hist.SetEntries(entries)
+
+    def root_hist(self, name=None):
+        """
+        A new empty rootpy histogram with the binning of this Histogram
+        """
+        from rootpy.plotting import Hist, Hist2D, Hist3D
+        variable = any(axis.edges is not None for axis in self.axes)
+        args = []
+        for axis in self.axes:
+            if not variable:
+                args.extend([axis.nbins, axis.xmin, axis.xmax])
+            elif axis.edges is not None:
+                args.append(list(axis.edges))
+            else:
+                args.append(list(np.linspace(
+                    axis.xmin, axis.xmax, axis.nbins + 1)))
+        cls = (Hist, Hist2D, Hist3D)[len(self.axes) - 1]
+        return cls(*args, name=name or self.name, title=self.title)
+
+    def to_hist(self, template=None, name=None):
+        """
+        A new ROOT histogram filled with this Histogram and its systematic
+        variations, cloned from a template with the same binning if one is
+        given
+        """
+        from .systematics import systematic_name
+        if name is None:
+            name = self.name
+        if template is None:
+            hist = self.root_hist(name)
+        elif name is None:
+            hist = template.Clone()
+        else:
+            hist = template.Clone(name=name)
+        name = hist.GetName()
+        self._write(hist, add=False)
+        if self.title is not None:
+            hist.SetTitle(self.title)
+        if self.systematics:
+            hist.systematics = {}
+            for term, sys_hist in self.systematics.items():
+                hist.systematics[term] = sys_hist.to_hist(
+                    template, name=name + '_' + systematic_name(term))
+        return hist
+
+    def add_to_hist(self, hist, nominal=True, systematics=True):
+        """
+        Add this Histogram to a ROOT histogram (or another Histogram) and
+        its systematic variations to the variations of that histogram. A
+        variation missing from that histogram is set to the variation of
+        this Histogram.
+        """
+        from .systematics import systematic_name
+        numpy_hist = isinstance(hist, Histogram)
+        if nominal:
+            if numpy_hist:
+                hist.check_compatible(self)
+                hist._add_sums(self, 1.)
+            else:
+                self._write(hist, add=True)
+        if not systematics or not self.systematics:
+            return hist
+        if not hasattr(hist, 'systematics'):
+            hist.systematics = {}
+        for term, sys_hist in self.systematics.items():
+            name = hist.GetName() + '_' + systematic_name(term)
+            if term in hist.systematics:
+                sys_hist.add_to_hist(hist.systematics[term])
+            elif numpy_hist:
+                hist.systematics[term] = sys_hist.copy(name=name)
+            else:
+                hist.systematics[term] = sys_hist.to_hist(hist, name=name)
+        return hist
@@ -0,0 +1,171 @@
+"""
+Persistent cache of the row coordinates selected by a condition on a table.
+
+Entries are keyed by the path of the HDF5 file, the table name and version
+(see manifest.table_version), the canonical condition string and the row
+range. Rewriting the HDF5 file therefore invalidates all of its entries
+while updating some datasets with ntup-merge --update only invalidates the
+entries of these datasets. The total size of the
+cache is bounded by HHANA_INDEX_CACHE_MB and the least recently used entries
+are evicted first.
+"""
+import os
+import hashlib
+from glob import glob
+
+import numpy as np
+
+from . import log; log = log[__name__]
+from . import CACHE_DIR
+from . import zonemap
+from . import bitmask
+from . import cutengine
+from .zonemap import table_source
+from .manifest import table_version
+
+
+INDEX_CACHE_DIR = os.path.join(CACHE_DIR, 'index')
+INDEX_CACHE_MB = float(os.getenv('HHANA_INDEX_CACHE_MB', 1024))
+ENABLED = not os.getenv('NOINDEXCACHE', None)
+
+if not ENABLED:
+    log.warning("selection index cache is disabled")
+
+# increment to invalidate all entries (2: rows selected with the bitmasks of
+# another category of the same name)
+VERSION = 2
+
+
+def canonical(condition):
+    """
+    Canonical form of a numexpr condition string
+    """
+    return ''.join(condition.split())
+
+
+def get_key(table, condition, start=None, stop=None, step=None):
+    filename, name = table_source(table)
+    filename = os.path.abspath(filename)
+    key = '{0}:{1}:{2}:{3}:{4}:{5}:{6}:{7}'.format(
+        VERSION, filename, table_version(table), name,
+        canonical(condition), start, stop, step)
+    return hashlib.sha1(key).hexdigest()
+
+
+def entry_path(key):
+    return os.path.join(INDEX_CACHE_DIR, key + '.npy')
+
+
+def entries():
+    return glob(os.path.join(INDEX_CACHE_DIR, '*.npy'))
+
+
+def get(key):
+    path = entry_path(key)
+    try:
+        idx = np.load(path)
+    except (IOError, ValueError):
+        return None
+    # mark as recently used
+    os.utime(path, None)
+    return idx
+
+
+def put(key, idx):
+    if not os.path.isdir(INDEX_CACHE_DIR):
+        os.makedirs(INDEX_CACHE_DIR)
+    path = entry_path(key)
+    # write to a temporary file first so that other processes never read a
+    # partially written entry
+    tmp_path = '{0}.{1:d}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, idx)
+    os.rename(tmp_path, path)
+    evict()
+
+
+def evict(max_mb=None):
+    """
+    Remove the least recently used entries until the total size of the
+    cache is below max_mb (HHANA_INDEX_CACHE_MB by default)
+    """
+    if max_mb is None:
+        max_mb = INDEX_CACHE_MB
+    max_bytes = max_mb * 1024 ** 2
+    stats = []
+    for path in entries():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed by another process
+            continue
+        stats.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in stats)
+    removed = 0
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        log.info("evicted {0:d} entries from the selection index cache".format(
+            removed))
+    return removed
+
+
+def clear():
+    """
+    Remove all entries from the cache
+    """
+    removed = evict(0)
+    log.info("cleared the selection index cache")
+    return removed
+
+
+def info():
+    """
+    Return the number of entries and the total size in bytes of the cache
+    """
+    paths = entries()
+    return len(paths), sum(os.path.getsize(path) for path in paths)
+
+
+def evaluate(table, condition, start=None, stop=None, step=None):
+    """
+    Evaluate a selection with the precomputed category and region bitmasks
+    if available (see bitmask.py) or else by composing the cached masks of
+    its atoms (see cutengine.py) evaluated with the zone maps (see
+    zonemap.py)
+    """
+    idx = bitmask.get_where_list(
+        table, condition, start=start, stop=stop, step=step)
+    if idx is not None:
+        log.debug("selected rows of {0} with the bitmasks".format(table.name))
+        return idx
+    if cutengine.ENABLED:
+        return cutengine.get_where_list(
+            table, condition, start=start, stop=stop, step=step)
+    return zonemap.get_where_list(
+        table, condition, start=start, stop=stop, step=step)
+
+
+def get_where_list(table, condition, start=None, stop=None, step=None):
+    """
+    Same as table.get_where_list(condition) but use the cached coordinates
+    if this selection was already evaluated on this table. New selections
+    are evaluated with evaluate().
+    """
+    if not ENABLED:
+        return evaluate(table, condition, start=start, stop=stop, step=step)
+    key = get_key(table, condition, start=start, stop=stop, step=step)
+    idx = get(key)
+    if idx is not None:
+        log.debug("using cached selection index for {0}".format(table.name))
+        return idx
+    idx = evaluate(table, condition, start=start, stop=stop, step=step)
+    put(key, idx)
+    return idx
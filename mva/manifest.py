@@ -0,0 +1,139 @@
+"""
+Ntuple manifest.
+
+ntup-merge writes <student>.manifest.json next to <student>.h5 mapping each
+dataset to the input file it was converted from (with its size,
+modification time and SHA1 hash) and to its output table::
+
+    {
+        "outputs": {"/path/hhskim.h5": 1400000000.0, ...},
+        "datasets": {
+            "data12_JetTauEtmiss": {
+                "source": "/path/hhskim.data12-JetTauEtmiss.root",
+                "size": 123456789,
+                "mtime": 1399999999.0,
+                "sha1": "...",
+                "nrows": 1234567
+            },
+            ...
+        }
+    }
+
+``ntup-merge --update`` only reconverts the datasets whose input changed.
+The derived caches (selection index cache, zone maps, classifier scores) are
+keyed by table_version(): the hash of the input of a table if the file
+holding the table is the one recorded in the manifest, or the modification
+time of that file otherwise. Updating some datasets therefore only
+invalidates the cached entries of these datasets.
+"""
+import os
+import json
+import hashlib
+
+from . import log; log = log[__name__]
+
+SUFFIX = '.manifest.json'
+# read the input files in blocks of this many bytes when hashing
+HASH_BLOCKSIZE = 2 ** 20
+
+
+def manifest_path(path):
+    """
+    The path of the manifest of the ntuple <student>.h5 or <student>.columns
+    """
+    return os.path.splitext(os.path.normpath(path))[0] + SUFFIX
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCKSIZE)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def file_info(path, sha1=None):
+    """
+    The manifest entry of an input file (without the number of rows)
+    """
+    stat = os.stat(path)
+    return {
+        'source': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha1': sha1 if sha1 is not None else file_hash(path),
+    }
+
+
+def read(path):
+    if not os.path.exists(path):
+        return {'outputs': {}, 'datasets': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def changed(manifest, name, path):
+    """
+    True if the input file of a dataset differs from the one in the
+    manifest. The file is only hashed if its size or modification time
+    differ.
+    """
+    entry = manifest['datasets'].get(name)
+    if entry is None:
+        return True
+    stat = os.stat(path)
+    if stat.st_size != entry['size']:
+        return True
+    if stat.st_mtime == entry['mtime']:
+        return False
+    if file_hash(path) != entry['sha1']:
+        return True
+    # touched but not modified
+    entry['mtime'] = stat.st_mtime
+    return False
+
+
+MANIFESTS = {}
+
+
+def get_manifest(path):
+    """
+    Return the manifest at path (reread if it was modified) or None
+    """
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    if path not in MANIFESTS or MANIFESTS[path][0] != mtime:
+        MANIFESTS[path] = mtime, read(path)
+    return MANIFESTS[path][1]
+
+
+def table_version(table):
+    """
+    A string identifying the content of a table: the hash of its input in
+    the manifest or the modification time of the file holding the table
+    """
+    if hasattr(table, 'store'):
+        # columnar store
+        filename = table.store.metadata_path
+        base = table.store.path
+    else:
+        filename = base = table._v_file.filename
+    filename = os.path.abspath(filename)
+    mtime = os.path.getmtime(filename)
+    manifest = get_manifest(manifest_path(base))
+    if manifest is not None and manifest['outputs'].get(filename) == mtime:
+        entry = manifest['datasets'].get(table.name)
+        if entry is not None and entry.get('nrows') == table.nrows:
+            return entry['sha1']
+    return repr(mtime)
@@ -1,5 +1,5 @@
-# stdlib imports
-import math
+# numpy imports
+import numpy as np
 
 # ROOT/rootpy imports
 import ROOT
@@ -11,6 +11,7 @@ import rootpy.plotting.utils as rootpy_utils
 from .. import PLOTS_DIR, save_canvas
 from .templates import RatioPlot, SimplePlot
 from ..utils import fold_overflow
+from ..histogram import Histogram
 from .utils import label_plot, legend_params, set_colors
 from . import log
 
@@ -22,6 +23,9 @@ def uncertainty_band(model, systematics): #, systematics_components):
     # add separate variations in quadrature
     # also include stat error in quadrature
     total_model = sum(model)
+    # the variations are summed with numpy (see histogram.py)
+    numpy_model = [Histogram.from_hist(m) for m in model]
+    total = Histogram.from_hist(total_model)
     var_high = []
     var_low = []
     for term, variations in systematics.items():
@@ -48,69 +52,46 @@ def uncertainty_band(model, systematics): #, systematics_components):
         if high == 'NOMINAL' and low == 'NOMINAL':
             continue
 
-        total_high = model[0].Clone()
-        total_high.Reset()
-        total_low = total_high.Clone()
-        total_max = total_high.Clone()
-        total_min = total_high.Clone()
-        for m in model:
-            if high == 'NOMINAL' or high not in m.systematics:
-                total_high += m.Clone()
-            else:
-                #print m.title, high, list(m.systematics[high])
-                total_high += m.systematics[high]
-
-            if low == 'NOMINAL' or low not in m.systematics:
-                total_low += m.Clone()
-            else:
-                #print m.title, low, list(m.systematics[low])
-                total_low += m.systematics[low]
+        total_high = sum([m.systematics.get(high, m) for m in numpy_model])
+        total_low = sum([m.systematics.get(low, m) for m in numpy_model])
 
-        if total_low.Integral() <= 0:
+        if total_low.integral() <= 0:
             log.warning("{0}_DOWN is non-positive".format(term))
-        if total_high.Integral() <= 0:
+        if total_high.integral() <= 0:
             log.warning("{0}_UP is non-positive".format(term))
 
-        for i in total_high.bins_range(overflow=True):
-            total_max[i].value = max(total_high[i].value, total_low[i].value, total_model[i].value)
-            total_min[i].value = min(total_high[i].value, total_low[i].value, total_model[i].value)
+        values = [total_high.sumw, total_low.sumw, total.sumw]
+        total_max = Histogram(total.axes, np.maximum.reduce(values))
+        total_min = Histogram(total.axes, np.minimum.reduce(values))
 
-        if total_min.Integral() <= 0:
+        if total_min.integral() <= 0:
             log.warning("{0}: lower bound is non-positive".format(term))
-        if total_max.Integral() <= 0:
+        if total_max.integral() <= 0:
             log.warning("{0}: upper bound is non-positive".format(term))
 
-        var_high.append(total_max)
-        var_low.append(total_min)
+        var_high.append(total_max.sumw)
+        var_low.append(total_min.sumw)
 
         log.debug("{0} {1}".format(str(term), str(variations)))
         log.debug("{0} {1} {2}".format(
             total_max.integral(),
-            total_model.integral(),
+            total.integral(),
             total_min.integral()))
 
     #log.debug(str(systematics_components))
     # include stat error variation
-    total_model_stat_high = total_model.Clone()
-    total_model_stat_low = total_model.Clone()
-    for i in total_model.bins_range(overflow=True):
-        total_model_stat_high[i].value += total_model.yerrh(i)
-        total_model_stat_low[i].value -= total_model.yerrl(i)
-    var_high.append(total_model_stat_high)
-    var_low.append(total_model_stat_low)
+    stat_error = np.sqrt(total.sumw2)
+    var_high.append(total.sumw + stat_error)
+    var_low.append(total.sumw - stat_error)
 
     # sum variations in quadrature bin-by-bin
-    high_band = total_model.Clone()
-    high_band.Reset()
-    low_band = high_band.Clone()
-    for i in high_band.bins_range(overflow=True):
-        sum_high = math.sqrt(
-            sum([(v[i].value - total_model[i].value)**2 for v in var_high]))
-        sum_low = math.sqrt(
-            sum([(v[i].value - total_model[i].value)**2 for v in var_low]))
-        high_band[i].value = sum_high
-        low_band[i].value = sum_low
-    return total_model, high_band, low_band
+    high_band = Histogram(total.axes, np.sqrt(
+        ((np.array(var_high) - total.sumw) ** 2).sum(axis=0)))
+    low_band = Histogram(total.axes, np.sqrt(
+        ((np.array(var_low) - total.sumw) ** 2).sum(axis=0)))
+    return (total_model,
+            high_band.to_hist(total_model),
+            low_band.to_hist(total_model))
 
 
 def draw(name,
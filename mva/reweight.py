@@ -0,0 +1,122 @@
+"""
+Event weights looked up in histograms.
+
+The score and field weight histograms of the samples, the posterior trigger
+correction of the embedded Z->tautau and the Higgs pT weights are
+histograms evaluated at the values of one to three fields of each event.
+The binning and the contents of a histogram are read into numpy arrays once
+and cached by the identity of the histogram, then all events are looked up
+at once. WeightHist returns the content of the bin containing each event,
+as TH1::FindBin and TH1::GetBinContent would: with clip=True the values
+below the first or above the last bin of an axis take the content of that
+bin instead of the underflow or overflow. Interpolator interpolates linearly
+between the bin centers like TH1::Interpolate.
+"""
+import numpy as np
+
+from . import log; log = log[__name__]
+from .histogram import hist_axes, hist_buffer, num_cells
+
+
+class WeightHist(object):
+
+    def __init__(self, axes, values, clip=True):
+        self.axes = list(axes)
+        # the contents of all cells in the order of TH1::GetBin
+        self.values = np.array(values, dtype=np.float64)
+        if len(self.values) != num_cells(self.axes):
+            raise ValueError(
+                "the binning has {0:d} cells but there are {1:d} "
+                "values".format(num_cells(self.axes), len(self.values)))
+        self.clip = clip
+
+    @classmethod
+    def from_hist(cls, hist, clip=True):
+        return cls(hist_axes(hist), hist_buffer(hist), clip=clip)
+
+    def index(self, columns):
+        """
+        The global bin of each entry
+        """
+        if len(columns) != len(self.axes):
+            raise ValueError("{0:d} columns for a {1:d}-D histogram".format(
+                len(columns), len(self.axes)))
+        index = None
+        stride = 1
+        for axis, column in zip(self.axes, columns):
+            axis_index = axis.index(column)
+            if self.clip:
+                np.clip(axis_index, 1, axis.nbins, out=axis_index)
+            if index is None:
+                index = axis_index
+            else:
+                index += axis_index * stride
+            stride *= axis.nbins + 2
+        return index
+
+    def __call__(self, *columns):
+        return self.values.take(self.index(columns))
+
+
+class Interpolator(object):
+    """
+    Vectorised TH1::Interpolate: linear interpolation between the bin
+    centers, constant beyond the first and last bin centers
+    """
+    def __init__(self, centers, contents):
+        self.centers = np.array(centers, dtype=np.float64)
+        self.contents = np.array(contents, dtype=np.float64)
+        if len(self.centers) != len(self.contents):
+            raise ValueError("the number of bin centers and contents differ")
+        if np.any(np.diff(self.centers) <= 0):
+            raise ValueError("the bin centers are not increasing")
+
+    @classmethod
+    def from_hist(cls, hist):
+        """
+        Interpolator of the contents of a 1-D ROOT histogram
+        """
+        axis = hist.GetXaxis()
+        nbins = hist.GetNbinsX()
+        return cls([axis.GetBinCenter(i) for i in xrange(1, nbins + 1)],
+                   hist_buffer(hist)[1:nbins + 1])
+
+    def __call__(self, x):
+        return np.interp(np.asarray(x, dtype=np.float64),
+                         self.centers, self.contents)
+
+
+# the compiled histograms and the histograms themselves (keeping them alive
+# so their id is not reused) by id and options
+CACHE = {}
+
+
+def compiled(hist, cls, *args):
+    key = id(hist), cls, args
+    try:
+        lookup, cached_hist = CACHE[key]
+        if cached_hist is hist:
+            return lookup
+    except KeyError:
+        pass
+    lookup = cls.from_hist(hist, *args)
+    CACHE[key] = lookup, hist
+    return lookup
+
+
+def weight_hist(hist, clip=True):
+    """
+    The cached WeightHist of a ROOT histogram
+    """
+    return compiled(hist, WeightHist, clip)
+
+
+def interpolator(hist):
+    """
+    The cached Interpolator of a 1-D ROOT histogram
+    """
+    return compiled(hist, Interpolator)
+
+
+def clear_cache():
+    CACHE.clear()
@@ -0,0 +1,297 @@
+"""
+Column batches: the records of a sample held as separate 1-D arrays.
+
+Appending a field to a structured array (rec_append_fields), stacking
+structured arrays (stack) or selecting fields and converting them into a
+2-D array (rec2array) copies every row. The records flow through
+records() -> merged_records() -> draw_array_helper() -> fill_field_hist() as
+ColumnBatch objects instead so appending a field does not copy anything
+and each histogram only copies the columns it is filled with. The records
+of the datasets of a sample are not concatenated but held in a
+ChunkedBatch and the histograms are filled chunk by chunk. Batches are
+converted into record arrays with to_records() only when records are
+returned by the public API, and concatenated only when contiguous arrays
+are needed (such as for training a classifier).
+"""
+from collections import OrderedDict
+
+import numpy as np
+
+from ..utils import unique
+
+
+class ColumnBatch(object):
+    """
+    Ordered mapping of field names to 1-D arrays of the same length
+    """
+    def __init__(self, columns=None, length=None):
+        self.columns = OrderedDict()
+        self.length = length
+        if columns is not None:
+            for name, column in columns:
+                self.add(name, column)
+        if self.length is None:
+            self.length = 0
+
+    @classmethod
+    def from_records(cls, rec, fields=None):
+        """
+        Batch of views of the fields of a record array
+        """
+        if isinstance(rec, ColumnBatch):
+            return rec.select(fields) if fields is not None else rec
+        if fields is None:
+            fields = rec.dtype.names
+        return cls([(name, rec[name]) for name in unique(fields)],
+                   length=len(rec))
+
+    def __repr__(self):
+        return "ColumnBatch({0:d} rows: {1})".format(
+            len(self), ', '.join(self.names))
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return self.columns[key]
+        if isinstance(key, (list, tuple)) and key and all(
+                isinstance(name, basestring) for name in key):
+            return self.select(key)
+        # boolean mask or indices of the rows to keep
+        selected = ColumnBatch([
+            (name, column[key]) for name, column in self.columns.items()])
+        if not self.columns:
+            selected.length = len(np.arange(self.length)[key])
+        return selected
+
+    def __setitem__(self, name, column):
+        self.add(name, column)
+
+    @property
+    def names(self):
+        return self.columns.keys()
+
+    @property
+    def dtype(self):
+        return np.dtype([
+            (name, column.dtype) for name, column in self.columns.items()])
+
+    def add(self, name, column):
+        """
+        Add (or replace) a field without copying it
+        """
+        column = np.asarray(column)
+        if column.ndim != 1:
+            raise ValueError(
+                "field {0} is not a 1-D array".format(name))
+        if self.length is None:
+            self.length = len(column)
+        elif len(column) != self.length:
+            raise ValueError(
+                "field {0} has {1:d} rows instead of {2:d}".format(
+                    name, len(column), self.length))
+        self.columns[name] = column
+        return self
+
+    def select(self, fields):
+        """
+        Batch holding only some fields, without copying them
+        """
+        return ColumnBatch([(name, self.columns[name])
+                            for name in unique(fields)], length=self.length)
+
+    def array(self, fields, field_scale=None, extra=None):
+        """
+        Same as rec2array(rec[fields]) with the fields in field_scale
+        multiplied by their scale and extra (if not None) as the last column
+        """
+        columns = []
+        for name in fields:
+            column = self.columns[name]
+            if field_scale is not None and name in field_scale:
+                column = column * field_scale[name]
+            columns.append(column)
+        if extra is not None:
+            columns.append(extra)
+        if not columns:
+            return np.empty((self.length, 0))
+        arr = np.empty((self.length, len(columns)),
+                       dtype=np.result_type(*columns))
+        for i, column in enumerate(columns):
+            arr[:, i] = column
+        return arr
+
+    def to_records(self, fields=None):
+        """
+        Copy the fields (all by default) into a record array
+        """
+        batch = self if fields is None else self.select(fields)
+        rec = np.empty(len(batch), dtype=batch.dtype)
+        for name, column in batch.columns.items():
+            rec[name] = column
+        return rec.view(np.recarray)
+
+
+class ChunkedBatch(object):
+    """
+    Lazy concatenation of ColumnBatch objects holding the same fields, such
+    as the records of each dataset of a sample. Selecting fields, masking
+    rows, adding fields and scaling fields act on each chunk separately.
+    The chunks are only copied into contiguous arrays when a column, a 2-D
+    array or a record array of all rows is requested.
+    """
+    def __init__(self, chunks, fields=None):
+        chunks = list(chunks)
+        if fields is None:
+            # the fields common to all chunks
+            fields = []
+            if chunks:
+                fields = [name for name in chunks[0].names
+                          if all(name in chunk for chunk in chunks[1:])]
+        self.fields = unique(fields)
+        self.chunks = [chunk.select(self.fields) for chunk in chunks]
+
+    @classmethod
+    def from_records(cls, rec):
+        """
+        Chunked view of a ChunkedBatch, a ColumnBatch or a record array
+        """
+        if isinstance(rec, ChunkedBatch):
+            return rec
+        return cls([ColumnBatch.from_records(rec)])
+
+    def __repr__(self):
+        return "ChunkedBatch({0:d} rows in {1:d} chunks: {2})".format(
+            len(self), len(self.chunks), ', '.join(self.names))
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            # a contiguous copy of the column
+            return self.column(key)
+        if isinstance(key, (list, tuple)) and key and all(
+                isinstance(name, basestring) for name in key):
+            return self.select(key)
+        # boolean mask of the rows to keep
+        mask = np.asarray(key)
+        if mask.dtype != np.bool_:
+            raise TypeError("chunked batches can only be indexed by fields "
+                            "or by boolean masks")
+        return ChunkedBatch([
+            chunk[chunk_mask] for chunk, chunk_mask in
+            zip(self.chunks, self.split(mask))], fields=self.fields)
+
+    @property
+    def names(self):
+        return list(self.fields)
+
+    @property
+    def dtype(self):
+        if self.chunks:
+            return self.chunks[0].dtype
+        return np.dtype([(name, 'f8') for name in self.fields])
+
+    @property
+    def offsets(self):
+        """
+        The index of the first row of each chunk and the number of rows
+        """
+        return np.cumsum([0] + [len(chunk) for chunk in self.chunks])
+
+    def split(self, column):
+        """
+        Split an array of one value per row into views for each chunk
+        """
+        offsets = self.offsets
+        if len(column) != offsets[-1]:
+            raise ValueError(
+                "array has {0:d} rows instead of {1:d}".format(
+                    len(column), offsets[-1]))
+        return [column[begin:end]
+                for begin, end in zip(offsets[:-1], offsets[1:])]
+
+    def column_chunks(self, name):
+        """
+        The arrays of a field in each chunk
+        """
+        return [chunk[name] for chunk in self.chunks]
+
+    def column(self, name):
+        if name not in self.fields:
+            raise KeyError(name)
+        columns = self.column_chunks(name)
+        if len(columns) == 1:
+            return columns[0]
+        return np.concatenate(columns)
+
+    def add(self, name, column):
+        """
+        Add (or replace) a field, given as an array of all rows, as views in
+        each chunk
+        """
+        column = np.asarray(column)
+        for chunk, chunk_column in zip(self.chunks, self.split(column)):
+            chunk.add(name, chunk_column)
+        if name not in self.fields:
+            self.fields.append(name)
+        return self
+
+    def scale(self, name, factor):
+        """
+        Multiply a field in place
+        """
+        for column in self.column_chunks(name):
+            column *= factor
+        return self
+
+    def select(self, fields):
+        return ChunkedBatch(self.chunks, fields=fields)
+
+    def concatenate(self):
+        """
+        ColumnBatch holding contiguous copies of the fields
+        """
+        if len(self.chunks) == 1:
+            return self.chunks[0]
+        return ColumnBatch([
+            (name, self.column(name)) for name in self.fields],
+            length=len(self))
+
+    def array(self, fields, field_scale=None, extra=None):
+        """
+        Same as ColumnBatch.array() for all rows
+        """
+        if extra is not None:
+            extras = self.split(np.asarray(extra))
+        else:
+            extras = [None] * len(self.chunks)
+        arrays = [
+            chunk.array(fields, field_scale=field_scale, extra=chunk_extra)
+            for chunk, chunk_extra in zip(self.chunks, extras)]
+        if len(arrays) == 1:
+            return arrays[0]
+        if not arrays:
+            return np.empty((0, len(fields) + (extra is not None)))
+        return np.concatenate(arrays)
+
+    def to_records(self, fields=None):
+        """
+        Copy the fields (all by default) of all chunks into a record array
+        """
+        batch = self if fields is None else self.select(fields)
+        rec = np.empty(len(batch), dtype=batch.dtype)
+        for name in batch.fields:
+            for (begin, end), column in zip(
+                    zip(batch.offsets[:-1], batch.offsets[1:]),
+                    batch.column_chunks(name)):
+                rec[name][begin:end] = column
+        return rec.view(np.recarray)
@@ -0,0 +1,307 @@
+"""
+Memory-mapped columnar ntuple backend.
+
+A columnar store is a directory holding one directory per table with one
+``.npy`` file per column, and a metadata file (metadata.json) holding the
+number of rows, the column names and the cutflow histogram contents of each
+table::
+
+    hhskim.columns/
+        metadata.json
+        data12_JetTauEtmiss/
+            tau1_pt.npy
+            ...
+
+Columns are opened with ``np.load(mmap_mode='r')`` so reading a column does
+not copy it and the pages are shared through the page cache by all processes
+reading the same store. The tables implement the subset of the PyTables
+Table interface used by the samples (see CachedTable).
+
+Use the ntup-columnar script to convert hhskim.h5 into a columnar store and
+set HHANA_NTUPLE_BACKEND=columnar to read it.
+"""
+import os
+import json
+
+import numpy as np
+
+from . import log; log = log[__name__]
+from ..cachedtable import READ_CHUNKSIZE, memoize_or_nothing
+from ..selection import evaluate
+from .. import index_cache
+
+METADATA = 'metadata.json'
+
+
+class ColumnarTable(object):
+
+    def __init__(self, store, name, info):
+        self.store = store
+        self.name = name
+        self.nrows = info['nrows']
+        # json returns unicode strings
+        self.colnames = [str(name) for name in info['columns']]
+        self.path = os.path.join(store.path, name)
+        self._columns = {}
+        self._dtype = None
+
+    def __repr__(self):
+        return "ColumnarTable('{0}')".format(self.path)
+
+    __str__ = __repr__
+
+    def __contains__(self, name):
+        return name in self.colnames
+
+    def __getitem__(self, name):
+        return self.col(name)
+
+    def __len__(self):
+        return self.nrows
+
+    @property
+    def source(self):
+        """
+        File and name identifying this table in the selection index cache
+        """
+        return self.store.metadata_path, self.name
+
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            self._dtype = np.dtype([
+                (name, self.col(name).dtype) for name in self.colnames])
+        return self._dtype
+
+    def col(self, name):
+        """
+        The memory-mapped (read-only) column
+        """
+        try:
+            return self._columns[name]
+        except KeyError:
+            if name not in self.colnames:
+                raise KeyError(
+                    "table {0} has no column {1}".format(self.name, name))
+            column = np.load(os.path.join(self.path, name + '.npy'),
+                             mmap_mode='r')
+            self._columns[name] = column
+            return column
+
+    def get_where_list(self, condition, start=None, stop=None, step=None):
+        start, stop, step = slice(start, stop, step).indices(self.nrows)
+        coords = []
+        # evaluate the condition in blocks to bound the memory used by
+        # numexpr temporaries
+        block_size = READ_CHUNKSIZE * step
+        for begin in xrange(start, stop, block_size):
+            end = min(begin + block_size, stop)
+            block = slice(begin, end, step)
+            mask = evaluate(condition, _BlockColumns(self, block))
+            coords.append(np.arange(begin, end, step)[mask])
+        if not coords:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(coords).astype(np.int64)
+
+    def coordinates(self, condition=None, start=None, stop=None, step=None):
+        if condition:
+            return index_cache.get_where_list(
+                self, condition, start=start, stop=stop, step=step)
+        return np.arange(*slice(start, stop, step).indices(self.nrows))
+
+    @memoize_or_nothing
+    def read_fields(self, condition=None, fields=None,
+                    start=None, stop=None, step=None,
+                    return_idx=False):
+        """
+        Same as CachedTable.read_fields()
+        """
+        idx = self.coordinates(condition, start=start, stop=stop, step=step)
+        if fields is None:
+            fields = self.colnames
+        rec = np.empty(len(idx), dtype=np.dtype([
+            (name, self.col(name).dtype) for name in fields]))
+        for name in fields:
+            rec[name] = self.col(name)[idx]
+        if return_idx:
+            return rec, idx
+        return rec
+
+    def iter_fields(self, condition=None, fields=None,
+                    start=None, stop=None, step=None,
+                    chunksize=READ_CHUNKSIZE,
+                    return_idx=False):
+        """
+        Same as CachedTable.iter_fields()
+        """
+        idx = self.coordinates(condition, start=start, stop=stop, step=step)
+        if fields is None:
+            fields = self.colnames
+        dtype = np.dtype([(name, self.col(name).dtype) for name in fields])
+        for begin in xrange(0, len(idx), chunksize):
+            block_idx = idx[begin:begin + chunksize]
+            rec = np.empty(len(block_idx), dtype=dtype)
+            for name in fields:
+                rec[name] = self.col(name)[block_idx]
+            if return_idx:
+                yield rec, block_idx
+            else:
+                yield rec
+
+    def read_where(self, condition, start=None, stop=None, step=None):
+        return self.read_fields(condition, start=start, stop=stop, step=step)
+
+    def read(self, start=None, stop=None, step=None):
+        return self.read_fields(None, start=start, stop=stop, step=step)
+
+    def read_coordinates(self, coords):
+        rec = np.empty(len(coords), dtype=self.dtype)
+        for name in self.colnames:
+            rec[name] = self.col(name)[coords]
+        return rec
+
+
+class _BlockColumns(object):
+    """
+    Mapping of column names to a slice of each column
+    """
+    def __init__(self, table, block):
+        self.table = table
+        self.block = block
+
+    def __contains__(self, name):
+        return name in self.table
+
+    def __getitem__(self, name):
+        return self.table.col(name)[self.block]
+
+
+class _Root(object):
+    """
+    Natural naming access to the tables of a store as in PyTables
+    (store.root.tablename)
+    """
+    def __init__(self, store):
+        self._store = store
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._store.get_table(name)
+        except KeyError:
+            raise AttributeError(
+                "store {0} has no table {1}".format(self._store.path, name))
+
+    def __contains__(self, name):
+        return name in self._store.metadata['tables']
+
+
+class ColumnarStore(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.metadata_path = os.path.join(path, METADATA)
+        with open(self.metadata_path) as f:
+            self.metadata = json.load(f)
+        self.root = _Root(self)
+        self._tables = {}
+
+    def __repr__(self):
+        return "ColumnarStore('{0}')".format(self.path)
+
+    def __contains__(self, name):
+        return name in self.metadata['tables']
+
+    def __nonzero__(self):
+        return True
+
+    def tables(self):
+        return [self.get_table(name)
+                for name in sorted(self.metadata['tables'].keys())]
+
+    def get_table(self, name):
+        try:
+            return self._tables[name]
+        except KeyError:
+            table = ColumnarTable(self, name, self.metadata['tables'][name])
+            self._tables[name] = table
+            return table
+
+    def cutflow(self, name):
+        """
+        The contents of all bins (including underflow and overflow) of the
+        cutflow histogram of a table
+        """
+        return self.metadata['tables'][name]['cutflow']
+
+    def close(self):
+        self._tables = {}
+
+
+def write_table(path, name, table, cutflow=None, columns=None):
+    """
+    Write a PyTables table (or a ColumnarTable or a structured array) as a
+    directory of columns in the store at path and return its metadata. Only
+    the columns in columns are written if columns is not None. The store
+    metadata is not updated (see write_metadata).
+    """
+    table_path = os.path.join(path, name)
+    if not os.path.isdir(table_path):
+        os.makedirs(table_path)
+    colnames = list(table.dtype.names)
+    if columns is not None:
+        colnames = [colname for colname in colnames if colname in columns]
+    for colname in colnames:
+        if hasattr(table, 'col'):
+            column = table.col(colname)
+        else:
+            column = table[colname]
+        np.save(os.path.join(table_path, colname + '.npy'),
+                np.ascontiguousarray(column))
+    return {
+        'nrows': len(table),
+        'columns': colnames,
+        'cutflow': list(cutflow) if cutflow is not None else None,
+    }
+
+
+def write_metadata(path, tables):
+    """
+    Write the metadata of a store. tables maps the table names to the
+    metadata returned by write_table. Existing entries in the store are
+    preserved unless overwritten.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    metadata_path = os.path.join(path, METADATA)
+    metadata = {'tables': {}}
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    metadata['tables'].update(tables)
+    tmp_path = metadata_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f, indent=1)
+    os.rename(tmp_path, metadata_path)
+    return metadata
+
+
+def write_store(path, tables, cutflows=None, columns=None):
+    """
+    Write tables (PyTables or ColumnarTables) into the store at path.
+    cutflows maps the table names to the contents of their cutflow
+    histograms. The metadata is updated after each table so an interrupted
+    conversion leaves a usable store.
+    """
+    if cutflows is None:
+        cutflows = {}
+    for table in tables:
+        cutflow = cutflows.get(table.name, None)
+        if cutflow is None:
+            log.warning("{0} has no cutflow histogram".format(table.name))
+        log.info("writing {0} ({1:d} rows) ...".format(
+            table.name, len(table)))
+        write_metadata(path, {
+            table.name: write_table(path, table.name, table,
+                                    cutflow=cutflow, columns=columns)})
@@ -9,9 +9,12 @@ from rootpy.plotting import Hist
 # local imports
 from . import log; log = log[__name__]
 from .sample import Sample
+from .batch import ColumnBatch
 from .db import TEMPFILE, get_file
-from ..cachedtable import CachedTable
 from ..lumi import LUMI
+from ..cachedtable import READ_CHUNKSIZE
+from ..selection import union, masks, where_fields
+from ..utils import unique
 
 
 class DataInfo():
@@ -56,9 +59,8 @@ class Data(Sample):
             year=year, scale=1.,
             name=name, label=label,
             **kwargs)
-        h5file = get_file(self.ntuple_path, self.student, hdf=True)
         dataname = 'data%d_JetTauEtmiss' % (year % 1E3)
-        self.h5data = CachedTable.hook(getattr(h5file.root, dataname))
+        self.h5data = self.get_table(dataname)
         self.info = DataInfo(LUMI[self.year] / 1e3, self.energy)
 
     def draw_array(self, field_hist, category, region,
@@ -72,7 +74,8 @@ class Data(Sample):
                    max_score=None,
                    systematics=True,
                    systematics_components=None,
-                   bootstrap_data=False):
+                   bootstrap_data=False,
+                   chunksize=None):
         if bootstrap_data:
             scores = None
         elif scores is None and clf is not None:
@@ -91,7 +94,8 @@ class Data(Sample):
             scores=scores,
             min_score=min_score,
             max_score=max_score,
-            bootstrap_data=bootstrap_data)
+            bootstrap_data=bootstrap_data,
+            chunksize=chunksize)
 
     def scores(self, clf, category, region,
                cuts=None,
@@ -102,6 +106,56 @@ class Data(Sample):
                 region=region,
                 cuts=cuts)
 
+    def tables(self, systematic='NOMINAL'):
+        return [self.h5data]
+
+    def record_batches(self,
+                       category=None,
+                       region=None,
+                       fields=None,
+                       cuts=None,
+                       include_weight=True,
+                       systematic='NOMINAL',
+                       return_idx=False,
+                       **kwargs):
+        """
+        Same as records() but return a list of ColumnBatch
+        """
+        if include_weight and fields is not None:
+            if 'weight' not in fields:
+                fields = list(fields) + ['weight']
+
+        selection = self.cuts(category, region) & cuts
+        table_selection = self.table_selection(category, region, cuts=cuts)
+
+        log.info("requesting table from Data %d" % self.year)
+        log.debug("using selection: %s" % selection)
+
+        if fields is None:
+            read_fields = None
+        else:
+            # only read the requested fields
+            read_fields = tuple(f for f in fields if f != 'weight')
+
+        # read the table with a selection
+        rec, idx = self.h5data.read_fields(
+            table_selection, read_fields,
+            return_idx=True, **kwargs)
+
+        batch = ColumnBatch.from_records(rec)
+        # add weight field
+        if include_weight:
+            # data is not weighted
+            batch.add('weight', np.ones(len(batch), dtype='f8'))
+
+        if fields is not None:
+            batch = batch.select(fields)
+
+        if return_idx:
+            return [(batch, idx)]
+
+        return [batch]
+
     def records(self,
                 category=None,
                 region=None,
@@ -111,36 +165,121 @@ class Data(Sample):
                 systematic='NOMINAL',
                 return_idx=False,
                 **kwargs):
+        batches = self.record_batches(
+            category=category,
+            region=region,
+            fields=fields,
+            cuts=cuts,
+            include_weight=include_weight,
+            systematic=systematic,
+            return_idx=return_idx,
+            **kwargs)
+        if return_idx:
+            return [(batch.to_records(), idx) for batch, idx in batches]
+        return [batch.to_records() for batch in batches]
+
+    def yields(self, category=None, region=None,
+               cuts=None, systematics=('NOMINAL',),
+               weighted=True, scale=1.):
+        """
+        Same as SystematicsSample.yields(). Only the number of selected rows
+        is computed and the systematics are ignored.
+        """
+        num_events = float(len(self.h5data.coordinates(
+            self.table_selection(category, region, cuts=cuts))))
+        return dict((systematic, (num_events, num_events))
+                    for systematic in systematics)
+
+    def iter_records(self,
+                     category=None,
+                     region=None,
+                     fields=None,
+                     cuts=None,
+                     include_weight=True,
+                     systematic='NOMINAL',
+                     chunksize=READ_CHUNKSIZE,
+                     **kwargs):
+        """
+        Same as records() but yield the records in blocks of at most
+        chunksize rows
+        """
         if include_weight and fields is not None:
             if 'weight' not in fields:
                 fields = list(fields) + ['weight']
 
         selection = self.cuts(category, region) & cuts
+        table_selection = self.table_selection(category, region, cuts=cuts)
 
-        log.info("requesting table from Data %d" % self.year)
+        log.info("iterating over table from Data %d in blocks of %d rows" %
+                 (self.year, chunksize))
         log.debug("using selection: %s" % selection)
 
-        # read the table with a selection
-        if selection:
-            rec = self.h5data.read_where(selection.where(), **kwargs)
+        if fields is None:
+            read_fields = None
         else:
-            rec = self.h5data.read(**kwargs)
+            # only read the requested fields
+            read_fields = tuple(f for f in fields if f != 'weight')
 
-        # add weight field
-        if include_weight:
-            # data is not weighted
-            weights = np.ones(rec.shape[0], dtype='f8')
-            rec = recfunctions.rec_append_fields(rec,
-                names='weight',
-                data=weights,
-                dtypes='f8')
+        for rec in self.h5data.iter_fields(
+                table_selection, read_fields,
+                chunksize=chunksize, **kwargs):
+            if include_weight:
+                # data is not weighted
+                weights = np.ones(rec.shape[0], dtype='f8')
+                rec = recfunctions.rec_append_fields(rec,
+                    names='weight',
+                    data=weights,
+                    dtypes='f8')
+            if fields is not None:
+                rec = rec[fields]
+            yield rec
 
-        if fields is not None:
-            rec = rec[fields]
+    def multi_records(self, selections,
+                      fields=None,
+                      cuts=None,
+                      include_weight=True,
+                      **kwargs):
+        """
+        Same as SystematicsSample.multi_records(). The systematic of each
+        selection is ignored.
+        """
+        if include_weight and fields is not None:
+            if 'weight' not in fields:
+                fields = list(fields) + ['weight']
 
-        if return_idx:
-            # only valid if selection is non-empty
-            idx = self.h5data.get_where_list(selection.where(), **kwargs)
-            return [(rec, idx)]
+        conditions = []
+        for category, region, systematic in selections:
+            conditions.append(
+                self.table_selection(category, region, cuts=cuts))
+        table_selection = union(conditions)
+
+        log.info("requesting table from Data %d for %d selections" %
+                 (self.year, len(selections)))
+        log.debug("using selection: %s" % table_selection)
+
+        if fields is None:
+            read_fields = None
+        else:
+            # read the requested fields and the fields needed to split the
+            # selections
+            read_fields = [f for f in fields if f != 'weight']
+            for condition in conditions:
+                read_fields += where_fields(condition, self.h5data.colnames)
+            read_fields = tuple(unique(read_fields))
+
+        rec = self.h5data.read_fields(table_selection, read_fields, **kwargs)
 
-        return [rec]
+        output = []
+        for mask in masks(rec, conditions):
+            selected = rec[mask]
+            if include_weight:
+                # data is not weighted
+                weights = np.ones(selected.shape[0], dtype='f8')
+                selected = recfunctions.rec_append_fields(selected,
+                    names='weight',
+                    data=weights,
+                    dtypes='f8')
+            if fields is not None:
+                selected = selected[fields]
+            output.append([selected])
+        return output
@@ -1,5 +1,6 @@
 # stdlib imports
 import os
+import json
 import atexit
 
 # pytables imports
@@ -12,30 +13,178 @@ from rootpy.io import root_open, TemporaryFile
 from higgstautau import datasets
 
 # local imports
-from .. import NTUPLE_PATH, DEFAULT_STUDENT
+from .. import (NTUPLE_PATH, DEFAULT_STUDENT, NTUPLE_BACKEND, NTUPLE_SERVER,
+                NTUPLE_H5_DRIVER)
+from ..cachedtable import CachedTable
+from .columnar import ColumnarStore
+from . import server
 from . import log; log = log[__name__]
 
 
 DB = datasets.Database(name='datasets_hh', verbose=False)
 FILES = {}
+CUTFLOW_INDEX = {}
+CUTFLOW_SUFFIX = '_cutflow'
 TEMPFILE = TemporaryFile()
+BACKENDS = ('hdf5', 'columnar', 'shm')
 
 
-def get_file(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT, hdf=False, suffix='', force_reopen=False):
-    ext = '.h5' if hdf else '.root'
+def get_file(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT, hdf=False, suffix='', force_reopen=False,
+             columnar=False):
+    if columnar:
+        ext = '.columns'
+    else:
+        ext = '.h5' if hdf else '.root'
     filename = student + ext
     if filename in FILES and not force_reopen:
         return FILES[filename]
     file_path = os.path.join(ntuple_path, student + suffix, filename)
     log.info("opening {0} ...".format(file_path))
-    if hdf:
-        student_file = tables.open_file(file_path)#, driver="H5FD_CORE")
+    if columnar:
+        student_file = ColumnarStore(file_path)
+    elif hdf:
+        if NTUPLE_H5_DRIVER is not None:
+            student_file = tables.open_file(file_path, driver=NTUPLE_H5_DRIVER)
+        else:
+            student_file = tables.open_file(file_path)
     else:
         student_file = root_open(file_path, 'READ')
     FILES[filename] = student_file
     return student_file
 
 
+def get_store(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT,
+              backend=NTUPLE_BACKEND, force_reopen=False):
+    """
+    Return the columnar store of a student or the shared memory store
+    served by ntup-server
+    """
+    if backend == 'shm':
+        name = NTUPLE_SERVER or student
+        key = 'shm:' + name
+        if key in FILES and not force_reopen:
+            return FILES[key]
+        log.info("attaching to ntuple server {0} ...".format(name))
+        store = server.attach(name)
+        FILES[key] = store
+        return store
+    return get_file(ntuple_path, student, columnar=True,
+                    force_reopen=force_reopen)
+
+
+def get_table(name, ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT,
+              backend=NTUPLE_BACKEND, force_reopen=False):
+    """
+    Return the table holding the ntuple of a dataset from the requested
+    backend
+    """
+    if backend in ('columnar', 'shm'):
+        store = get_store(ntuple_path, student, backend=backend,
+                          force_reopen=force_reopen)
+        return store.get_table(name)
+    elif backend == 'hdf5':
+        h5file = get_file(ntuple_path, student, hdf=True,
+                          force_reopen=force_reopen)
+        return CachedTable.hook(getattr(h5file.root, name))
+    raise ValueError(
+        "unknown ntuple backend {0}, use one of {1}".format(
+            backend, ', '.join(BACKENDS)))
+
+
+def cutflow_index_path(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT):
+    return os.path.join(ntuple_path, student, student + '.cutflow.json')
+
+
+def write_cutflow_index(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT):
+    """
+    Write the contents of all cutflow histograms in <student>.root into the
+    sidecar index <student>.cutflow.json
+    """
+    root_path = os.path.join(ntuple_path, student, student + '.root')
+    cutflows = {}
+    with root_open(root_path) as rfile:
+        for key in rfile.GetListOfKeys():
+            name = key.GetName()
+            if not name.endswith(CUTFLOW_SUFFIX):
+                continue
+            hist = rfile[name]
+            cutflows[name[:-len(CUTFLOW_SUFFIX)]] = [
+                hist.GetBinContent(i) for i in xrange(hist.GetNbinsX() + 2)]
+    return save_cutflow_index(cutflow_index_path(ntuple_path, student),
+                              cutflows, source=os.path.getmtime(root_path))
+
+
+def save_cutflow_index(path, cutflows, source=None):
+    """
+    Write a cutflow index. cutflows maps the dataset names to the contents
+    of all bins of their cutflow histograms. source is the modification time
+    of the ROOT file holding the cutflow histograms or None if the cutflows
+    were not read from <student>.root (see ntup-merge).
+    """
+    index = {
+        'source': source,
+        'cutflows': cutflows,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.rename(tmp_path, path)
+    log.info("wrote {0:d} cutflows in {1}".format(len(cutflows), path))
+    return index
+
+
+def get_cutflow_index(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT):
+    """
+    Return the cutflow contents of the sidecar index or None if the index
+    does not exist or is older than <student>.root
+    """
+    path = cutflow_index_path(ntuple_path, student)
+    if path in CUTFLOW_INDEX:
+        return CUTFLOW_INDEX[path]
+    cutflows = None
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        root_path = os.path.join(ntuple_path, student, student + '.root')
+        if (index['source'] is not None and os.path.exists(root_path) and
+                os.path.getmtime(root_path) != index['source']):
+            log.warning(
+                "ignoring {0} since {1} has changed, "
+                "rebuild it with cutflow-index".format(path, root_path))
+        else:
+            cutflows = index['cutflows']
+    CUTFLOW_INDEX[path] = cutflows
+    return cutflows
+
+
+def get_cutflow_events(name, events_bin,
+                       ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT,
+                       backend=NTUPLE_BACKEND, force_reopen=False):
+    """
+    Return the content of a bin of the cutflow histogram of a dataset
+    """
+    if backend in ('columnar', 'shm'):
+        store = get_store(ntuple_path, student, backend=backend,
+                          force_reopen=force_reopen)
+        return store.cutflow(name)[events_bin]
+    cutflows = get_cutflow_index(ntuple_path, student)
+    if cutflows is not None and name in cutflows:
+        return cutflows[name][events_bin]
+    # ntup-merge stores the cutflows in the attributes of the tables
+    h5file = get_file(ntuple_path, student, hdf=True,
+                      force_reopen=force_reopen)
+    if name in h5file.root:
+        cutflow = getattr(getattr(h5file.root, name)._v_attrs, 'cutflow', None)
+        if cutflow is not None:
+            return cutflow[events_bin]
+    # <student>.root built by merge-ntup
+    rfile = get_file(ntuple_path, student, force_reopen=force_reopen)
+    cutflow_hist = rfile[name + CUTFLOW_SUFFIX]
+    events = cutflow_hist[events_bin].value
+    del cutflow_hist
+    return events
+
+
 @atexit.register
 def cleanup():
     if TEMPFILE:
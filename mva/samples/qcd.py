@@ -8,9 +8,10 @@ import numpy as np
 # local imports
 from .sample import Sample, Background
 from . import log; log = log[__name__]
-from ..systematics import systematic_name
 from ..regions import REGION_SYSTEMATICS
 from ..defaults import FAKES_REGION
+from ..cachedtable import READ_CHUNKSIZE, writeable
+from ..histogram import Histogram
 
 
 class QCD(Sample, Background):
@@ -111,7 +112,8 @@ class QCD(Sample, Background):
                    max_score=None,
                    systematics=True,
                    systematics_components=None,
-                   bootstrap_data=False):
+                   bootstrap_data=False,
+                   chunksize=None):
 
         if scores is not None:
             log.warning(
@@ -121,7 +123,9 @@ class QCD(Sample, Background):
         # TODO: support for field_weight_hist
         do_systematics = self.systematics and systematics
 
-        field_hist_MC_bkg = dict([(expr, hist.Clone())
+        # the MC backgrounds and the data are filled into Histograms so the
+        # QCD model and its systematic variations are computed with numpy
+        field_hist_MC_bkg = dict([(expr, Histogram.from_hist(hist, empty=True))
             for expr, hist in field_hist.items()])
 
         for mc_scale, mc in zip(self.mc_scales, self.mc):
@@ -136,9 +140,10 @@ class QCD(Sample, Background):
                 max_score=max_score,
                 systematics=systematics,
                 systematics_components=systematics_components,
-                scale=mc_scale)
+                scale=mc_scale,
+                chunksize=chunksize)
 
-        field_hist_data = dict([(expr, hist.Clone())
+        field_hist_data = dict([(expr, Histogram.from_hist(hist, empty=True))
             for expr, hist in field_hist.items()])
 
         self.data.draw_array(field_hist_data,
@@ -150,19 +155,36 @@ class QCD(Sample, Background):
             clf=clf,
             #scores=scores,
             min_score=min_score,
-            max_score=max_score)
+            max_score=max_score,
+            chunksize=chunksize)
 
+        field_qcd_hist = {}
         for expr, h in field_hist.items():
             mc_h = field_hist_MC_bkg[expr]
             d_h = field_hist_data[expr]
-            h += (d_h * self.data_scale - mc_h) * self.scale
+            if not do_systematics:
+                mc_h.systematics.clear()
+            for sys_term in (('QCDSHAPE_UP',), ('QCDSHAPE_DOWN',)):
+                mc_h.systematics.pop(sys_term, None)
+            # the variations of the MC are subtracted from the nominal data
+            qcd_h = (d_h * self.data_scale - mc_h) * self.scale
+            for sys_term, scale in (
+                    (('QCDFIT_UP',), self.scale + self.scale_error),
+                    (('QCDFIT_DOWN',), self.scale - self.scale_error)):
+                if sys_term in mc_h.systematics:
+                    qcd_h.systematics[sys_term] = (
+                        d_h * self.data_scale
+                        - mc_h.systematics[sys_term]) * scale
+            qcd_h.add_to_hist(h, systematics=False)
             h.SetTitle(self.label)
+            field_qcd_hist[expr] = qcd_h
 
         if do_systematics and systematics_components is None:
             # get shape systematic
             field_shape_sys = self.get_shape_systematic_array(
                 # use the nominal hist here
-                field_hist,
+                dict([(expr, h.to_hist() if isinstance(h, Histogram) else h)
+                      for expr, h in field_hist.items()]),
                 category, region,
                 cuts=cuts,
                 clf=clf,
@@ -174,10 +196,8 @@ class QCD(Sample, Background):
             field_shape_sys = None
 
         for expr, h in field_hist.items():
-            mc_h = field_hist_MC_bkg[expr]
-            d_h = field_hist_data[expr]
-
-            if not do_systematics or not hasattr(mc_h, 'systematics'):
+            qcd_h = field_qcd_hist[expr]
+            if not qcd_h.systematics:
                 continue
             if not hasattr(h, 'systematics'):
                 h.systematics = {}
@@ -185,23 +205,13 @@ class QCD(Sample, Background):
             if field_shape_sys is not None:
                 # add shape systematics
                 high, low = field_shape_sys[expr]
+                if isinstance(h, Histogram):
+                    high = Histogram.from_hist(high)
+                    low = Histogram.from_hist(low)
                 h.systematics[('QCDSHAPE_DOWN',)] = low
                 h.systematics[('QCDSHAPE_UP',)] = high
 
-            for sys_term, sys_hist in mc_h.systematics.items():
-                if sys_term in (('QCDSHAPE_UP',), ('QCDSHAPE_DOWN',)):
-                    continue
-                scale = self.scale
-                if sys_term == ('QCDFIT_UP',):
-                    scale = self.scale + self.scale_error
-                elif sys_term == ('QCDFIT_DOWN',):
-                    scale = self.scale - self.scale_error
-                qcd_hist = (d_h * self.data_scale - sys_hist) * scale
-                qcd_hist.name = h.name + '_' + systematic_name(sys_term)
-                if sys_term not in h.systematics:
-                    h.systematics[sys_term] = qcd_hist
-                else:
-                    h.systematics[sys_term] += qcd_hist
+            qcd_h.add_to_hist(h, nominal=False)
         # hack: no rec or weights
         return None, None
 
@@ -251,17 +261,20 @@ class QCD(Sample, Background):
 
         return scores_dict
 
-    def records(self,
-                category=None,
-                region=None,
-                fields=None,
-                cuts=None,
-                include_weight=True,
-                systematic='NOMINAL',
-                return_idx=False,
-                **kwargs):
+    def record_batches(self,
+                       category=None,
+                       region=None,
+                       fields=None,
+                       cuts=None,
+                       include_weight=True,
+                       systematic='NOMINAL',
+                       return_idx=False,
+                       **kwargs):
+        """
+        Same as records() but return a list of ColumnBatch
+        """
         assert include_weight == True
-        data_records = self.data.records(
+        data_batches = self.data.record_batches(
             category=category,
             region=self.shape_region,
             fields=fields,
@@ -271,14 +284,12 @@ class QCD(Sample, Background):
             return_idx=return_idx,
             **kwargs)
 
-        if return_idx:
-            arrays = [(d.copy(), idx) for d, idx in data_records]
-        else:
-            arrays = [d.copy() for d in data_records]
+        # the weights of the batches are new arrays that can be modified in
+        # place
+        batches = list(data_batches)
 
         for mc_scale, mc in zip(self.mc_scales, self.mc):
-            _arrays = []
-            _arrs = mc.records(
+            _batches = mc.record_batches(
                 category=category,
                 region=self.shape_region,
                 fields=fields,
@@ -288,18 +299,11 @@ class QCD(Sample, Background):
                 scale=mc_scale,
                 return_idx=return_idx,
                 **kwargs)
-            # FIX: weight may not be present if include_weight=False
-            if return_idx:
-                for partition, idx in _arrs:
-                    partition = partition.copy()
-                    partition['weight'] *= -1
-                    _arrays.append((partition, idx))
-            else:
-                for partition in _arrs:
-                    partition = partition.copy()
-                    partition['weight'] *= -1
-                    _arrays.append(partition)
-            arrays.extend(_arrays)
+            for partition in _batches:
+                if return_idx:
+                    partition = partition[0]
+                partition['weight'] *= -1
+            batches.extend(_batches)
 
         scale = self.scale
         if systematic == ('QCDFIT_UP',):
@@ -307,15 +311,166 @@ class QCD(Sample, Background):
         elif systematic == ('QCDFIT_DOWN',):
             scale -= self.scale_error
 
-        # FIX: weight may not be present if include_weight=False
+        for partition in batches:
+            if return_idx:
+                partition = partition[0]
+            partition['weight'] *= scale
+
+        return batches
+
+    def records(self,
+                category=None,
+                region=None,
+                fields=None,
+                cuts=None,
+                include_weight=True,
+                systematic='NOMINAL',
+                return_idx=False,
+                **kwargs):
+        batches = self.record_batches(
+            category=category,
+            region=region,
+            fields=fields,
+            cuts=cuts,
+            include_weight=include_weight,
+            systematic=systematic,
+            return_idx=return_idx,
+            **kwargs)
         if return_idx:
-            for partition, idx in arrays:
-                partition['weight'] *= scale
-        else:
+            return [(batch.to_records(), idx) for batch, idx in batches]
+        return [batch.to_records() for batch in batches]
+
+    def yields(self, category=None, region=None,
+               cuts=None, systematics=('NOMINAL',),
+               weighted=True, scale=1.):
+        """
+        Same as SystematicsSample.yields(). The data and MC yields are
+        computed in the shape region and the MC yields are subtracted from
+        the data yields. The unweighted yields are the number of data and
+        MC events, as in records().
+        """
+        data_sumw, data_sumw2 = self.data.yields(
+            category, self.shape_region, cuts=cuts,
+            weighted=weighted)['NOMINAL']
+        mc_yields = [
+            mc.yields(category, self.shape_region, cuts=cuts,
+                      systematics=systematics,
+                      weighted=weighted, scale=mc_scale)
+            for mc_scale, mc in zip(self.mc_scales, self.mc)]
+        yields = {}
+        for systematic in systematics:
+            if not weighted:
+                num_events = data_sumw + sum(
+                    y[systematic][0] for y in mc_yields)
+                yields[systematic] = (num_events, num_events)
+                continue
+            qcd_scale = self.scale
+            if systematic == ('QCDFIT_UP',):
+                qcd_scale += self.scale_error
+            elif systematic == ('QCDFIT_DOWN',):
+                qcd_scale -= self.scale_error
+            sumw = data_sumw - sum(y[systematic][0] for y in mc_yields)
+            sumw2 = data_sumw2 + sum(y[systematic][1] for y in mc_yields)
+            yields[systematic] = (
+                sumw * qcd_scale * scale,
+                sumw2 * (qcd_scale * scale) ** 2)
+        return yields
+
+    def iter_records(self,
+                     category=None,
+                     region=None,
+                     fields=None,
+                     cuts=None,
+                     include_weight=True,
+                     systematic='NOMINAL',
+                     chunksize=READ_CHUNKSIZE,
+                     **kwargs):
+        """
+        Same as records() but yield the records in blocks of at most
+        chunksize rows
+        """
+        assert include_weight == True
+        scale = self.scale
+        if systematic == ('QCDFIT_UP',):
+            scale += self.scale_error
+        elif systematic == ('QCDFIT_DOWN',):
+            scale -= self.scale_error
+
+        for rec in self.data.iter_records(
+                category=category,
+                region=self.shape_region,
+                fields=fields,
+                cuts=cuts,
+                include_weight=include_weight,
+                systematic='NOMINAL',
+                chunksize=chunksize,
+                **kwargs):
+            rec = writeable(rec)
+            rec['weight'] *= scale
+            yield rec
+
+        for mc_scale, mc in zip(self.mc_scales, self.mc):
+            for rec in mc.iter_records(
+                    category=category,
+                    region=self.shape_region,
+                    fields=fields,
+                    cuts=cuts,
+                    include_weight=include_weight,
+                    systematic=systematic,
+                    scale=mc_scale,
+                    chunksize=chunksize,
+                    **kwargs):
+                rec = writeable(rec)
+                rec['weight'] *= -scale
+                yield rec
+
+    def multi_records(self, selections,
+                      fields=None,
+                      cuts=None,
+                      include_weight=True,
+                      **kwargs):
+        """
+        Same as SystematicsSample.multi_records(). Data and each MC sample
+        are only read once in the shape region for all selections.
+        """
+        assert include_weight == True
+        shape_selections = [
+            (category, self.shape_region, systematic)
+            for category, region, systematic in selections]
+        output = [
+            [writeable(d) for d in data_records]
+            for data_records in self.data.multi_records(
+                [(category, region, 'NOMINAL')
+                 for category, region, _ in shape_selections],
+                fields=fields,
+                cuts=cuts,
+                include_weight=include_weight,
+                **kwargs)]
+
+        for mc_scale, mc in zip(self.mc_scales, self.mc):
+            mc_output = mc.multi_records(
+                shape_selections,
+                fields=fields,
+                cuts=cuts,
+                include_weight=include_weight,
+                scale=mc_scale,
+                **kwargs)
+            for arrays, mc_records in zip(output, mc_output):
+                for partition in mc_records:
+                    partition = writeable(partition)
+                    partition['weight'] *= -1
+                    arrays.append(partition)
+
+        for (_, _, systematic), arrays in zip(selections, output):
+            scale = self.scale
+            if systematic == ('QCDFIT_UP',):
+                scale += self.scale_error
+            elif systematic == ('QCDFIT_DOWN',):
+                scale -= self.scale_error
             for partition in arrays:
                 partition['weight'] *= scale
 
-        return arrays
+        return output
 
     def get_shape_systematic(self, nominal_hist, expr_or_clf,
                              category, region, **kwargs):
@@ -3,7 +3,7 @@ import os
 import sys
 import pickle
 from operator import add, itemgetter
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
 # numpy imports
 import numpy as np
@@ -18,7 +18,7 @@ from rootpy.stats import histfactory
 from rootpy import asrootpy
 
 # root_numpy imports
-from root_numpy import rec2array, stack, fill_hist
+from root_numpy import rec2array, stack
 
 # higgstautau imports
 from higgstautau import samples as samples_db
@@ -26,21 +26,69 @@ from higgstautau import samples as samples_db
 # local imports
 from . import log; log = log[__name__]
 from .. import variables
-from .. import NTUPLE_PATH, DEFAULT_STUDENT, ETC_DIR, CACHE_DIR
-from ..utils import print_hist, ravel_hist, uniform_hist
+from .. import NTUPLE_PATH, DEFAULT_STUDENT, NTUPLE_BACKEND, ETC_DIR, CACHE_DIR
+from ..utils import print_hist, ravel_hist, uniform_hist, unique
 from ..classify import histogram_scores, Classifier
 from ..regions import REGIONS
 from ..systematics import (
     get_systematics, SYSTEMATICS_BY_WEIGHT,
     iter_systematics, systematic_name)
 from ..lumi import LUMI, get_lumi_uncert
-from .db import DB, TEMPFILE, get_file
-from ..cachedtable import CachedTable
+from .db import DB, TEMPFILE, get_table, get_cutflow_events
+from .batch import ColumnBatch, ChunkedBatch
+from ..cachedtable import CachedTable, READ_CHUNKSIZE, writeable
+from ..selection import union, masks, where_fields
+from ..bitmask import Selection
 from ..variables import get_binning, get_scale
+from ..histfill import HistFiller
+from ..histogram import Histogram
+from ..reweight import weight_hist as weight_hist_lookup
 
 BCH_UNCERT = pickle.load(open(os.path.join(CACHE_DIR, 'bch_cleaning.cache')))
 
 
+class LazyDict(dict):
+    """
+    Dictionary of values computed by a function of the key on first access.
+    The keys are known up front so membership tests and missing keys behave
+    as with a plain dictionary.
+    """
+    def __init__(self, func, keys):
+        super(LazyDict, self).__init__()
+        self.func = func
+        self.lazy_keys = set(keys)
+
+    def __missing__(self, key):
+        if key not in self.lazy_keys:
+            raise KeyError(key)
+        value = self.func(key)
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.lazy_keys
+
+    def __iter__(self):
+        return iter(self.lazy_keys)
+
+    def __len__(self):
+        return len(self.lazy_keys)
+
+    def get(self, key, default=None):
+        if key in self.lazy_keys:
+            return self[key]
+        return default
+
+    def keys(self):
+        return list(self.lazy_keys)
+
+    def items(self):
+        return [(key, self[key]) for key in self.lazy_keys]
+
+    def values(self):
+        return [self[key] for key in self.lazy_keys]
+
+
 class Dataset(namedtuple('Dataset',
                          ('ds', 'tables', 'events',
                           'xs', 'kfact', 'effic'))):
@@ -104,6 +152,12 @@ class Sample(object):
     def corrections(self, rec):
         return []
 
+    def correction_fields(self):
+        """
+        Fields that corrections() requires in the records
+        """
+        return []
+
     def __init__(self, year, scale=1., cuts=None,
                  ntuple_path=NTUPLE_PATH,
                  student=DEFAULT_STUDENT,
@@ -111,6 +165,7 @@ class Sample(object):
                  trigger=True,
                  name='Sample',
                  label='Sample',
+                 backend=NTUPLE_BACKEND,
                  **hist_decor):
         self.year = year
         if year == 2011:
@@ -125,6 +180,7 @@ class Sample(object):
         self.ntuple_path = ntuple_path
         self.student = student
         self.force_reopen = force_reopen
+        self.backend = backend
         self.name = name
         self.label = label
         self.hist_decor = hist_decor
@@ -132,6 +188,24 @@ class Sample(object):
             self.hist_decor['fillstyle'] = 'solid'
         self.trigger = trigger
 
+    def get_table(self, name):
+        return get_table(name, self.ntuple_path, self.student,
+                         backend=self.backend,
+                         force_reopen=self.force_reopen)
+
+    def tables(self, systematic='NOMINAL'):
+        """
+        The tables read by record_batches() for a systematic, in the order of
+        the batches, or None if unknown
+        """
+        return None
+
+    def get_cutflow_events(self, name, events_bin):
+        return get_cutflow_events(name, events_bin,
+                                  self.ntuple_path, self.student,
+                                  backend=self.backend,
+                                  force_reopen=self.force_reopen)
+
     def decorate(self, name=None, label=None, **hist_decor):
         if name is not None:
             self.name = name
@@ -471,17 +545,41 @@ class Sample(object):
                 partitions.append(np.hstack(recs))
         return partitions
 
-    def merged_records(self,
+    def record_batches(self,
                        category=None,
                        region=None,
                        fields=None,
                        cuts=None,
-                       clf=None,
-                       clf_name='classifier',
-                       scores=None,
                        include_weight=True,
-                       systematic='NOMINAL'):
-        recs = self.records(
+                       systematic='NOMINAL',
+                       **kwargs):
+        """
+        Same as records() but return a list of ColumnBatch
+        """
+        return [ColumnBatch.from_records(rec) for rec in self.records(
+            category=category,
+            region=region,
+            fields=fields,
+            cuts=cuts,
+            include_weight=include_weight,
+            systematic=systematic,
+            **kwargs)]
+
+    def merged_batch(self,
+                     category=None,
+                     region=None,
+                     fields=None,
+                     cuts=None,
+                     clf=None,
+                     clf_name='classifier',
+                     scores=None,
+                     include_weight=True,
+                     systematic='NOMINAL'):
+        """
+        Same as merged_records() but return a ChunkedBatch over the records
+        of each dataset
+        """
+        batches = self.record_batches(
             category=category,
             region=region,
             fields=fields,
@@ -491,7 +589,8 @@ class Sample(object):
         if include_weight and fields is not None:
             if 'weight' not in fields:
                 fields = list(fields) + ['weight']
-        rec = stack(recs, fields=fields)
+        # the records of the datasets are not copied into a single array
+        batch = ChunkedBatch(batches, fields=fields)
         if clf is not None or scores is not None:
             if scores is None:
                 scores, _ = clf.classify(
@@ -503,14 +602,15 @@ class Sample(object):
             elif isinstance(scores, tuple):
                 # ignore weights
                 scores = scores[0]
-            rec = recfunctions.rec_append_fields(rec,
-                names=clf_name,
-                data=scores,
-                dtypes='f4')
-        return rec
+            batch.add(clf_name, np.asarray(scores, dtype='f4'))
+        return batch
+
+    def merged_records(self, *args, **kwargs):
+        return self.merged_batch(*args, **kwargs).to_records()
 
     def array(self, *args, **kwargs):
-        return rec2array(self.merged_records(*args, **kwargs))
+        batch = self.merged_batch(*args, **kwargs)
+        return batch.array(batch.names)
 
     def weights(self, systematic='NOMINAL'):
         weight_fields = self.weight_fields()
@@ -553,20 +653,31 @@ class Sample(object):
                     cuts &= variations['NOMINAL']
         return cuts
 
-    def draw_array_helper(self, field_hist, category, region,
-                          cuts=None,
-                          weighted=True,
-                          field_scale=None,
-                          weight_hist=None,
-                          field_weight_hist=None,
-                          clf=None,
-                          scores=None,
-                          min_score=None,
-                          max_score=None,
-                          systematic='NOMINAL',
-                          scale=1.,
-                          bootstrap_data=False):
-        from .data import Data, DataInfo
+    def table_selection(self, category=None, region=None,
+                        systematic='NOMINAL', cuts=None):
+        """
+        Return the condition selecting the rows of the tables for a category
+        and region or None if all rows are selected. The condition remembers
+        its category and region so the rows may be selected with the
+        precomputed bitmasks (see bitmask.py).
+        """
+        selection = self.cuts(category, region, systematic) & cuts
+        if not selection:
+            return None
+        # the cuts that are not stored in the bitmasks
+        residual = self.cuts(None, None, systematic) & cuts
+        return Selection(
+            selection.where(),
+            category=category.__name__ if category is not None else None,
+            region=region,
+            year=self.year,
+            residual=residual.where() if residual else '')
+
+    def field_hist_fields(self, field_hist):
+        """
+        Return the fields required to fill the histograms in field_hist and
+        the classifier if one of the keys is a classifier
+        """
         all_fields = []
         classifiers = []
         for f in field_hist.iterkeys():
@@ -587,6 +698,64 @@ class Sample(object):
             classifier = classifiers[0]
         else:
             classifier = None
+        return all_fields, classifier
+
+    def draw_array_helper(self, field_hist, category, region,
+                          cuts=None,
+                          weighted=True,
+                          field_scale=None,
+                          weight_hist=None,
+                          field_weight_hist=None,
+                          clf=None,
+                          scores=None,
+                          min_score=None,
+                          max_score=None,
+                          systematic='NOMINAL',
+                          scale=1.,
+                          bootstrap_data=False,
+                          chunksize=None):
+        """
+        Fill the histograms in field_hist and return the records and the
+        weights. If chunksize is not None the records are read and the
+        histograms are filled in blocks of at most chunksize rows so memory
+        does not grow with the size of the sample. The records are then not
+        returned and (None, None) is returned instead.
+        """
+        from .data import Data
+        all_fields, classifier = self.field_hist_fields(field_hist)
+        if (chunksize is not None and not bootstrap_data
+                and (all_fields or scores is None)):
+            if scores is None and classifier is not None:
+                scores, _ = classifier.classify(
+                    self, category, region,
+                    cuts=cuts, systematic=systematic)
+            elif isinstance(scores, tuple):
+                scores = scores[0]
+            offset = 0
+            for rec in self.iter_records(category, region,
+                    fields=all_fields, cuts=cuts,
+                    include_weight=True,
+                    systematic=systematic,
+                    chunksize=chunksize):
+                # the weights are modified in place
+                batch = ColumnBatch.from_records(writeable(rec))
+                block_scores = None
+                if scores is not None:
+                    # the scores follow the order of the records
+                    block_scores = scores[offset:offset + len(batch)]
+                    batch.add('classifier',
+                              np.asarray(block_scores, dtype='f4'))
+                offset += len(batch)
+                self.fill_field_hist(field_hist, batch,
+                    scores=block_scores,
+                    field_scale=field_scale,
+                    weight_hist=weight_hist,
+                    field_weight_hist=field_weight_hist,
+                    min_score=min_score,
+                    max_score=max_score,
+                    scale=scale)
+            self.add_datainfo(field_hist)
+            return None, None
         if isinstance(self, Data) and bootstrap_data:
             log.info("using bootstrapped data")
             analysis = bootstrap_data
@@ -630,14 +799,14 @@ class Sample(object):
             scores = rec['classifier']
         elif all_fields or scores is None:
             # TODO: only get unblinded vars
-            rec = self.merged_records(category, region,
+            rec = self.merged_batch(category, region,
                 fields=all_fields, cuts=cuts,
                 include_weight=True,
                 clf=classifier,
                 #scores=scores,
                 scores=scores[0] if isinstance(scores, tuple) else scores,
                 systematic=systematic)
-            if scores is None and 'classifier' in rec.dtype.names:
+            if scores is None and 'classifier' in rec:
                 scores = rec['classifier']
         else:
             # use scores only
@@ -645,8 +814,10 @@ class Sample(object):
                 weights = np.ones(len(scores))
             else:
                 scores, weights = scores
-            rec = np.core.records.fromarrays([scores, weights],
-                                             names=['classifier', 'weight'])
+            # the weights are modified in place
+            rec = ColumnBatch([
+                ('classifier', np.asarray(scores)),
+                ('weight', np.array(weights))])
 
         if isinstance(scores, tuple):
             # sanity
@@ -655,7 +826,47 @@ class Sample(object):
             # weights
             scores = scores[0]
 
+        rec, weights, scores = self.fill_field_hist(field_hist, rec,
+            scores=scores,
+            field_scale=field_scale,
+            weight_hist=weight_hist,
+            field_weight_hist=field_weight_hist,
+            min_score=min_score,
+            max_score=max_score,
+            scale=scale)
+        self.add_datainfo(field_hist)
+
+        if scores is not None and 'classifier' not in rec:
+            rec.add('classifier', np.asarray(scores, dtype='f4'))
+        return rec.to_records(), weights
+
+    def fill_field_hist(self, field_hist, rec,
+                        scores=None,
+                        field_scale=None,
+                        weight_hist=None,
+                        field_weight_hist=None,
+                        min_score=None,
+                        max_score=None,
+                        scale=1.,
+                        variations=None):
+        """
+        Fill the histograms in field_hist with the records (a record array,
+        a ColumnBatch or a ChunkedBatch) and return the records (as a
+        ChunkedBatch), weights and scores passing the score range. The
+        weights are modified in place. The histograms are filled chunk by
+        chunk so the records are never concatenated.
+
+        variations is a list of (field_hist, weights) pairs of histograms
+        filled with the same records but other weights (such as the weight
+        systematics). The bin of each record is found only once for all
+        histograms with the same fields and binning (see histfill.py).
+        """
+        rec = ChunkedBatch.from_records(rec)
         weights = rec['weight']
+        if variations is None:
+            variations = []
+        variation_weights = [
+            np.array(var_weights, dtype='f8') for _, var_weights in variations]
 
         if min_score is not None:
             if scores is None:
@@ -665,6 +876,7 @@ class Sample(object):
             rec = rec[idx]
             weights = weights[idx]
             scores = scores[idx]
+            variation_weights = [w[idx] for w in variation_weights]
         if max_score is not None:
             if scores is None:
                 raise RuntimeError("max_score specified when scores is None")
@@ -673,19 +885,17 @@ class Sample(object):
             rec = rec[idx]
             weights = weights[idx]
             scores = scores[idx]
+            variation_weights = [w[idx] for w in variation_weights]
 
-        def get_weight(array, hist):
-            edges = np.array(list(hist.xedges()))
-            # handle overflow
-            edges[0] -= 1E100
-            edges[-1] += 1E100
-            return np.array(list(hist.y())).take(
-                edges.searchsorted(array) - 1)
+        def apply_weight(factor):
+            weights[:] *= factor
+            for var_weights in variation_weights:
+                var_weights *= factor
 
         if weight_hist is not None and scores is not None:
             # apply weight according to the classifier score
             log.warning("applying a score weight histogram")
-            weights *= get_weight(scores, weight_hist)
+            apply_weight(weight_hist_lookup(weight_hist)(scores))
 
         if field_weight_hist is not None:
             # apply weight corrections according to certain fields
@@ -697,12 +907,29 @@ class Sample(object):
                         "attempting to apply a weight histogram using "
                         "field {0} but that field is not present in the "
                         "requested array")
-                weights *= get_weight(rec[field], hist)
+                # the field of a 2-D or 3-D weight histogram is a tuple of
+                # fields like the keys of field_hist
+                if isinstance(field, (list, tuple)):
+                    columns = [rec[name] for name in field]
+                else:
+                    columns = [rec[field]]
+                apply_weight(weight_hist_lookup(hist)(*columns))
 
         if scale != 1.:
-            weights *= scale
+            apply_weight(scale)
+
+        # the weights of the records are the modified weights
+        rec.add('weight', weights)
+        weight_chunks = rec.split(weights)
+        variation_chunks = [rec.split(w) for w in variation_weights]
+        if scores is not None:
+            score_chunks = rec.split(scores)
+        else:
+            score_chunks = [None] * len(rec.chunks)
 
-        for fields, hist in field_hist.items():
+        filler = HistFiller()
+        for key, hist in field_hist.items():
+            fields = key
             if isinstance(fields, Classifier) or fields is None:
                 fields = ['classifier']
             # fields can be a single field or list of fields
@@ -711,37 +938,47 @@ class Sample(object):
             if hist is None:
                 # this var might be blinded
                 continue
-            # defensive copy
-            if isinstance(fields, tuple):
-                # select columns in numpy recarray with a list
-                fields = list(fields)
-            arr = np.copy(rec[fields])
-            if field_scale is not None:
-                for field in fields:
-                    if field in field_scale:
-                        arr[field] *= field_scale[field]
-            # convert to array
-            arr = rec2array(arr, fields=fields)
             # include the scores if the histogram dimensionality allows
-            if scores is not None and hist.GetDimension() == len(fields) + 1:
-                arr = np.c_[arr, scores]
-            elif hist.GetDimension() != len(fields):
+            with_scores = (
+                scores is not None and hist.GetDimension() == len(fields) + 1)
+            if not with_scores and hist.GetDimension() != len(fields):
                 raise TypeError(
                     'histogram dimensionality does not match '
                     'number of fields: %s' % (', '.join(fields)))
-            fill_hist(hist, arr, weights)
-            if isinstance(self, Data):
-                if hasattr(hist, 'datainfo'):
-                    hist.datainfo += self.info
-                else:
-                    hist.datainfo = DataInfo(self.info.lumi, self.info.energies)
-
-        if scores is not None and 'classifier' not in rec.dtype.names:
-            rec = recfunctions.rec_append_fields(rec,
-                names='classifier',
-                data=scores,
-                dtypes='f4')
-        return rec, weights
+            for ichunk, (chunk, chunk_weights, chunk_scores) in enumerate(zip(
+                    rec.chunks, weight_chunks, score_chunks)):
+                if not len(chunk):
+                    continue
+                columns = []
+                for name in fields:
+                    column = chunk[name]
+                    if field_scale is not None and name in field_scale:
+                        column = column * field_scale[name]
+                    columns.append(column)
+                if with_scores:
+                    columns.append(chunk_scores)
+                # the bins are shared by the weight variations
+                index = filler.index(hist, columns)
+                filler.fill(hist, index, chunk_weights)
+                for (var_field_hist, _), chunks in zip(
+                        variations, variation_chunks):
+                    var_hist = var_field_hist[key]
+                    if var_hist is not None:
+                        filler.fill(var_hist, index, chunks[ichunk])
+        filler.flush()
+        return rec, weights, scores
+
+    def add_datainfo(self, field_hist):
+        from .data import Data, DataInfo
+        if not isinstance(self, Data):
+            return
+        for hist in field_hist.values():
+            if hist is None:
+                continue
+            if hasattr(hist, 'datainfo'):
+                hist.datainfo += self.info
+            else:
+                hist.datainfo = DataInfo(self.info.lumi, self.info.energies)
 
     def events(self, category=None, region=None,
                cuts=None, systematic='NOMINAL', hist=None,
@@ -776,14 +1013,16 @@ class Sample(object):
         """
         if hist is None:
             hist = Hist(1, -100, 100)
-        rec = self.merged_records(category=category, region=region,
-                                  cuts=cuts, systematic=systematic)
-        if weighted:
-            if scale != 1:
-                rec['weight'] *= scale
-            fill_hist(hist, np.ones(len(rec)), rec['weight'])
-        else:
-            fill_hist(hist, np.ones(len(rec)))
+        sumw, sumw2 = self.yields(category=category, region=region,
+                                  cuts=cuts, systematics=[systematic],
+                                  weighted=weighted)[systematic]
+        if weighted and scale != 1:
+            sumw *= scale
+            sumw2 *= scale ** 2
+        # same as filling the bin at 1 with each event
+        bin = hist.FindBin(1)
+        hist.SetBinContent(bin, hist.GetBinContent(bin) + sumw)
+        hist.SetBinError(bin, np.sqrt(hist.GetBinError(bin) ** 2 + sumw2))
         return hist
 
     def events_root(self, category=None, region=None, cuts=None, hist=None,
@@ -791,24 +1030,35 @@ class Sample(object):
         """
         QUICK FIX.
         DO NOT USE UNLESS YOU KNOW WHAT YOU'RE DOING
+
+        Same as events() but only with the luminosity, the cross section and
+        the weight branches (without the sample scale, the normalizations
+        and the corrections)
         """
-        rfile = get_file(self.ntuple_path, self.student, force_reopen=self.force_reopen)
         if hist is None:
             hist = Hist(1, -100, 100)
+        selection = (self.cuts(category, region) & cuts).where()
+        weight_branches = tuple(self.weights())
+        sumw, sumw2 = 0., 0.
         for ds in self.datasets:
-            treename = ds.name
-            treename = treename.replace('.', '_')
-            tree = rfile[treename]
-            events = ds.events['NOMINAL']
-            weight = LUMI[self.year] * scale * ds.xs * ds.kfact * ds.effic / events
-            selection =  (self.cuts(category, region) & cuts)
-            if weighted:
-                weight_branches = self.weights()
-                selection *= Cut(str(weight * scale))
-                selection *= Cut('*'.join(weight_branches))
+            table, events = self.dataset_table(ds)
             log.debug("requesing number of events from %s using cuts: %s"
-                % (tree.GetName(), selection))
-            tree.Draw('1', selection, hist=hist)
+                % (table.name, selection))
+            if not weighted:
+                num_events = len(table.coordinates(selection))
+                sumw += num_events
+                sumw2 += num_events
+                continue
+            weight = LUMI[self.year] * scale * ds.xs * ds.kfact * ds.effic / events
+            rec = table.read_fields(selection, weight_branches)
+            weights = weight * reduce(np.multiply,
+                [rec[br] for br in weight_branches], np.ones(len(rec)))
+            sumw += weights.sum()
+            sumw2 += np.dot(weights, weights)
+        # same as filling the bin at 1 with each event
+        bin = hist.FindBin(1)
+        hist.SetBinContent(bin, hist.GetBinContent(bin) + sumw)
+        hist.SetBinError(bin, np.sqrt(hist.GetBinError(bin) ** 2 + sumw2))
         return hist
 
 
@@ -936,8 +1186,6 @@ class SystematicsSample(Sample):
         self.systematics = systematics
         self.tau_id_sf = tau_id_sf
         self.norms = {}
-        rfile = get_file(self.ntuple_path, self.student, force_reopen=self.force_reopen)
-        h5file = get_file(self.ntuple_path, self.student, hdf=True, force_reopen=self.force_reopen)
 
         from .ztautau import Embedded_Ztautau
 
@@ -947,21 +1195,14 @@ class SystematicsSample(Sample):
             treename = name.replace('.', '_')
             treename = treename.replace('-', '_')
 
-            tables = {}
-            events = {}
-
             if isinstance(self, Embedded_Ztautau):
                 events_bin = 1
             else:
                 # use mc_weighted second bin
                 events_bin = 2
-            events_hist_suffix = '_cutflow'
 
-            tables['NOMINAL'] =  CachedTable.hook(getattr(
-                h5file.root, treename))
-            cutflow_hist = rfile[treename + events_hist_suffix]
-            events['NOMINAL'] = cutflow_hist[events_bin].value
-            del cutflow_hist
+            # map each systematic to the name of its table
+            table_names = {'NOMINAL': treename}
 
             if self.systematics:
 
@@ -971,24 +1212,26 @@ class SystematicsSample(Sample):
                 if systematics_terms:
                     for sys_term in systematics_terms:
                         sys_name = treename + '_' + '_'.join(sys_term)
-                        tables[sys_term] = CachedTable.hook(getattr(
-                            h5file.root, sys_name))
-                        cutflow_hist = rfile[sys_name + events_hist_suffix]
-                        events[sys_term] = cutflow_hist[events_bin].value
-                        del cutflow_hist
+                        table_names[sys_term] = sys_name
 
                 if systematics_samples:
                     for sample_name, sys_term in systematics_samples.items():
                         log.info("%s -> %s %s" % (name, sample_name, sys_term))
                         sys_term = tuple(sys_term.split(','))
-                        sys_ds = self.db[sample_name]
                         sample_name = sample_name.replace('.', '_')
                         sample_name = sample_name.replace('-', '_')
-                        tables[sys_term] = CachedTable.hook(getattr(
-                            h5file.root, sample_name))
-                        cutflow_hist = rfile[sample_name + events_hist_suffix]
-                        events[sys_term] = cutflow_hist[events_bin].value
-                        del cutflow_hist
+                        table_names[sys_term] = sample_name
+
+            # the tables and the cutflows are only opened when a systematic
+            # is first requested
+            tables = LazyDict(
+                lambda sys_term, table_names=table_names:
+                    self.get_table(table_names[sys_term]),
+                table_names.keys())
+            events = LazyDict(
+                lambda sys_term, table_names=table_names, events_bin=events_bin:
+                    self.get_cutflow_events(table_names[sys_term], events_bin),
+                table_names.keys())
 
             if hasattr(self, 'xsec_kfact_effic'):
                 xs, kfact, effic = self.xsec_kfact_effic(i)
@@ -997,9 +1240,8 @@ class SystematicsSample(Sample):
             log.debug(
                 "dataset: {0}  cross section: {1} [pb] "
                 "k-factor: {2} "
-                "filtering efficiency: {3} "
-                "events {4}".format(
-                    ds.name, xs, kfact, effic, events['NOMINAL']))
+                "filtering efficiency: {3}".format(
+                    ds.name, xs, kfact, effic))
             dataset = Dataset(ds=ds, tables=tables, events=events,
                               xs=xs, kfact=kfact, effic=effic)
             self.datasets.append(dataset)
@@ -1026,7 +1268,8 @@ class SystematicsSample(Sample):
                    systematics=False,
                    systematics_components=None,
                    scale=1.,
-                   bootstrap_data=False):
+                   bootstrap_data=False,
+                   chunksize=None):
 
         do_systematics = self.systematics and systematics
         if scores is None and clf is not None:
@@ -1045,7 +1288,8 @@ class SystematicsSample(Sample):
             min_score=min_score,
             max_score=max_score,
             systematic='NOMINAL',
-            scale=scale)
+            scale=scale,
+            chunksize=chunksize)
 
         if not do_systematics:
             return rec, weights
@@ -1057,10 +1301,7 @@ class SystematicsSample(Sample):
                 hist.systematics = {}
             all_sys_hists[field] = hist.systematics
 
-        for systematic in iter_systematics(False,
-                year=self.year,
-                components=systematics_components):
-
+        def get_sys_field_hist(systematic):
             sys_field_hist = {}
             for field, hist in field_hist.items():
                 if systematic in all_sys_hists[field]:
@@ -1071,8 +1312,62 @@ class SystematicsSample(Sample):
                     sys_hist.Reset()
                     all_sys_hists[field][systematic] = sys_hist
                 sys_field_hist[field] = sys_hist
-
-            self.draw_array_helper(sys_field_hist, category, region,
+            return sys_field_hist
+
+        systematics = list(iter_systematics(False,
+            year=self.year,
+            components=systematics_components))
+
+        weight_systematics = []
+        if chunksize is None:
+            weight_systematics = self.matrix_weight_systematics(
+                category, region, systematics, cuts=cuts)
+
+        if weight_systematics:
+            # fill the histograms of all weight systematics from a single
+            # read of the nominal table
+            all_fields, classifier = self.field_hist_fields(field_hist)
+            sys_rec, weight_matrix = self.weight_matrix_records(
+                category, region, weight_systematics,
+                fields=all_fields, cuts=cuts)
+            if scores:
+                # the scores of weight systematics are the nominal scores
+                sys_scores = scores['NOMINAL'][0]
+            elif classifier is not None:
+                sys_scores, _ = classifier.classify(
+                    self, category, region, cuts=cuts)
+            else:
+                sys_scores = None
+            if sys_rec is None:
+                sys_batch = ColumnBatch(length=len(weight_matrix))
+            else:
+                sys_batch = ColumnBatch.from_records(sys_rec, all_fields)
+            if sys_scores is not None:
+                sys_batch.add('classifier',
+                              np.asarray(sys_scores, dtype='f4'))
+            # fill the histograms of all weight systematics at once with
+            # the bins of the records found only once
+            # (fill_field_hist modifies the weights in place)
+            sys_batch.add('weight', weight_matrix[:, 0].copy())
+            self.fill_field_hist(
+                get_sys_field_hist(weight_systematics[0]), sys_batch,
+                scores=sys_scores,
+                field_scale=field_scale,
+                weight_hist=weight_hist,
+                field_weight_hist=field_weight_hist,
+                min_score=min_score,
+                max_score=max_score,
+                scale=scale,
+                variations=[
+                    (get_sys_field_hist(systematic), weight_matrix[:, i])
+                    for i, systematic in enumerate(weight_systematics)
+                    if i > 0])
+
+        for systematic in systematics:
+            if systematic in weight_systematics:
+                continue
+            self.draw_array_helper(get_sys_field_hist(systematic),
+                category, region,
                 cuts=cuts,
                 weighted=weighted,
                 field_scale=field_scale,
@@ -1082,7 +1377,8 @@ class SystematicsSample(Sample):
                 min_score=min_score,
                 max_score=max_score,
                 systematic=systematic,
-                scale=scale)
+                scale=scale,
+                chunksize=chunksize)
 
         return rec, weights
 
@@ -1096,17 +1392,38 @@ class SystematicsSample(Sample):
         do_systematics = self.systematics and systematics
         if scores_dict is None:
             scores_dict = {}
-        for systematic in iter_systematics(True,
+        all_systematics = [
+            systematic for systematic in iter_systematics(True,
                 year=self.year,
-                components=systematics_components):
-            if not do_systematics and systematic != 'NOMINAL':
-                continue
-            scores, weights = clf.classify(self,
-                category=category,
-                region=region,
-                cuts=cuts,
-                systematic=systematic)
-            weights *= scale
+                components=systematics_components)
+            if do_systematics or systematic == 'NOMINAL']
+        # the scores of weight systematics are the nominal scores and their
+        # weights are computed from a single read of the nominal table
+        weight_systematics = self.matrix_weight_systematics(
+            category, region, all_systematics, cuts=cuts)
+        if weight_systematics:
+            _, weight_matrix = self.weight_matrix_records(
+                category, region, weight_systematics, fields=[], cuts=cuts)
+        nominal_scores = None
+        for systematic in all_systematics:
+            if systematic in weight_systematics:
+                if nominal_scores is None:
+                    nominal_scores, _ = clf.classify(self,
+                        category=category,
+                        region=region,
+                        cuts=cuts)
+                scores = nominal_scores
+                weights = weight_matrix[:,
+                    weight_systematics.index(systematic)] * scale
+            else:
+                scores, weights = clf.classify(self,
+                    category=category,
+                    region=region,
+                    cuts=cuts,
+                    systematic=systematic)
+                weights *= scale
+                if systematic == 'NOMINAL':
+                    nominal_scores = scores
             if systematic not in scores_dict:
                 scores_dict[systematic] = (scores, weights)
             else:
@@ -1116,23 +1433,324 @@ class SystematicsSample(Sample):
                     np.concatenate((prev_weights, weights)))
         return scores_dict
 
-    def records(self,
-                category=None,
-                region=None,
-                fields=None,
-                cuts=None,
-                include_weight=True,
-                systematic='NOMINAL',
-                scale=1.,
-                return_idx=False,
-                **kwargs):
+    def dataset_table(self, ds, systematic='NOMINAL'):
+        """
+        Return the table and the number of generated events of a dataset for
+        a systematic, falling back on NOMINAL if the systematic table is not
+        present
+        """
+        try:
+            return ds.tables[systematic], ds.events[systematic]
+        except KeyError:
+            log.warning(
+                "table for %s not present for %s "
+                "using NOMINAL" % (systematic, ds.name))
+            return ds.tables['NOMINAL'], ds.events['NOMINAL']
+
+    def tables(self, systematic='NOMINAL'):
+        if systematic in SYSTEMATICS_BY_WEIGHT:
+            systematic = 'NOMINAL'
+        return [self.dataset_table(ds, systematic)[0] for ds in self.datasets]
 
+    def dataset_weight(self, ds, table, events, systematic='NOMINAL', scale=1.):
+        """
+        Return the global weight of the events of a dataset
+        """
         from .ztautau import Ztautau
+        log.debug(
+            "\ndataset: {0}"
+            "\ntable: {1}"
+            "\ncross section: {2} [pb]"
+            "\nk-factor: {3}"
+            "\nfiltering efficiency: {4}"
+            "\nevents {5}".format(
+                ds.name, table.name, ds.xs, ds.kfact, ds.effic, events))
+        actual_scale = self.scale
+        if isinstance(self, Ztautau):
+            if systematic == ('ZFIT_UP',):
+                log.debug("scaling up for ZFIT_UP")
+                actual_scale += self.scale_error
+            elif systematic == ('ZFIT_DOWN',):
+                log.debug("scaling down for ZFIT_DOWN")
+                actual_scale -= self.scale_error
+        weight = (
+            scale * actual_scale *
+            LUMI[self.year] *
+            ds.xs * ds.kfact * ds.effic / events)
+        if systematic in self.norms:
+            weight *= self.norms[systematic]
+        return weight
+
+    def event_weights(self, rec, weight, weight_branches):
+        """
+        Return the product of the global weight, the weight branches and the
+        corrections for each record
+        """
+        weights = np.empty(rec.shape[0], dtype='f8')
+        weights.fill(weight)
+        # merge the weight fields
+        weights *= reduce(np.multiply,
+            [rec[br] for br in weight_branches], np.ones(len(rec)))
+        correction_weights = self.corrections(rec)
+        if correction_weights:
+            weights *= reduce(np.multiply, correction_weights)
+        return weights
+
+    def yields(self, category=None, region=None,
+               cuts=None, systematics=('NOMINAL',),
+               weighted=True, scale=1.):
+        """
+        Return a dict mapping each systematic to the sum of weights and the
+        sum of squared weights of the selected events. Only the weight
+        branches are read and the systematics sharing a table and a
+        selection are computed from a single read.
+        """
+        # group the systematics by table systematic and selection
+        groups = OrderedDict()
+        for systematic in systematics:
+            table_selection = self.table_selection(
+                category, region, systematic, cuts)
+            weight_branches = self.weights(systematic)
+            table_systematic = systematic
+            if systematic in SYSTEMATICS_BY_WEIGHT:
+                table_systematic = 'NOMINAL'
+            groups.setdefault((table_systematic, table_selection), []).append(
+                (systematic, weight_branches))
+        yields = dict((systematic, [0., 0.]) for systematic in systematics)
+        for (table_systematic, table_selection), group in groups.items():
+            read_fields = []
+            if weighted:
+                for _, weight_branches in group:
+                    read_fields += weight_branches
+                read_fields += self.correction_fields()
+            read_fields = tuple(unique(read_fields))
+            for ds in self.datasets:
+                table, events = self.dataset_table(ds, table_systematic)
+                if not weighted:
+                    num_events = len(table.coordinates(table_selection))
+                    for systematic, _ in group:
+                        yields[systematic][0] += num_events
+                        yields[systematic][1] += num_events
+                    continue
+                weight = self.dataset_weight(
+                    ds, table, events, table_systematic, scale)
+                rec = table.read_fields(table_selection, read_fields)
+                for systematic, weight_branches in group:
+                    weights = self.event_weights(rec, weight, weight_branches)
+                    yields[systematic][0] += weights.sum()
+                    yields[systematic][1] += np.dot(weights, weights)
+        return dict((systematic, tuple(sums))
+                    for systematic, sums in yields.items())
+
+    def weighted_batch(self, table, rec, weight, weight_branches,
+                       fields=None, include_weight=True):
+        """
+        Same as weighted_records() but return a ColumnBatch holding views
+        of the fields of rec and the event weights
+        """
+        batch = ColumnBatch.from_records(rec, None if fields is None else [
+            f for f in fields if f != 'weight'])
+        if include_weight:
+            weights = self.event_weights(rec, weight, weight_branches)
+            # add the combined weight
+            batch.add('weight', weights)
+            if weights.shape[0] > 1 and weights.sum() == 0:
+                log.warning("{0}: weights sum to zero!".format(table.name))
+        if fields is not None:
+            # keep the order of the requested fields
+            batch = batch.select(fields)
+        return batch
+
+    def weighted_records(self, table, rec, weight, weight_branches,
+                         fields=None, include_weight=True):
+        """
+        Add the event weight to records read from a table and only keep the
+        requested fields
+        """
+        if not include_weight:
+            if fields is not None:
+                rec = rec[fields]
+            return rec
+        return self.weighted_batch(
+            table, rec, weight, weight_branches,
+            fields=fields, include_weight=include_weight).to_records()
+
+    def matrix_weight_systematics(self, category, region, systematics,
+                                  cuts=None):
+        """
+        Return the weight systematics among systematics that are read from
+        the nominal table with the nominal selection and can therefore be
+        computed with weight_matrix_records()
+        """
+        nominal_selection = self.cuts(category, region) & cuts
+        return [systematic for systematic in systematics
+                if systematic in SYSTEMATICS_BY_WEIGHT and
+                str(self.cuts(category, region, systematic) & cuts) ==
+                str(nominal_selection)]
+
+    def weight_matrix(self, rec, weight, weight_branches_list):
+        """
+        Return the (n_events, n_systematics) matrix of the event weights for
+        each list of weight branches in weight_branches_list. The products
+        are computed in the same order and with the same precision as
+        event_weights() so the weights are identical.
+        """
+        branches = unique(
+            br for weight_branches in weight_branches_list
+            for br in weight_branches)
+        # the last column is filled with ones to pad the shorter products.
+        # float64 holds the values of all branches exactly.
+        branch_matrix = np.ones((len(rec), len(branches) + 1), dtype='f8')
+        for i, br in enumerate(branches):
+            branch_matrix[:, i] = rec[br]
+        width = max(len(weight_branches)
+                    for weight_branches in weight_branches_list)
+        # group the products by the precision of each step of the product
+        # as in reduce(np.multiply, ...)
+        groups = OrderedDict()
+        for i, weight_branches in enumerate(weight_branches_list):
+            dtypes = []
+            dtype = rec.dtype[weight_branches[0]]
+            for br in weight_branches:
+                dtype = np.result_type(dtype, rec.dtype[br])
+                dtypes.append(dtype)
+            dtypes += [dtype] * (width - len(weight_branches))
+            index = [branches.index(br) for br in weight_branches]
+            index += [len(branches)] * (width - len(weight_branches))
+            groups.setdefault(tuple(dtypes), []).append((i, index))
+        weights = np.empty((len(rec), len(weight_branches_list)), dtype='f8')
+        weights.fill(weight)
+        for dtypes, group in groups.items():
+            columns = [i for i, _ in group]
+            index = np.array([index for _, index in group], dtype=np.intp)
+            products = branch_matrix[:, index[:, 0]].astype(dtypes[0])
+            for column in xrange(1, width):
+                products = products.astype(dtypes[column], copy=False)
+                products *= branch_matrix[:, index[:, column]]
+            weights[:, columns] *= products
+        correction_weights = self.corrections(rec)
+        if correction_weights:
+            weights *= reduce(np.multiply, correction_weights)[:, np.newaxis]
+        return weights
+
+    def weight_matrix_records(self, category, region, systematics,
+                              fields=None, cuts=None, scale=1., **kwargs):
+        """
+        Read the nominal table once and return the records with the requested
+        fields (without the weight) and the (n_events, n_systematics) matrix
+        of the event weights of the weight systematics. The rows follow the
+        order of records().
+        """
+        selection = self.cuts(category, region) & cuts
+        table_selection = self.table_selection(category, region, cuts=cuts)
+        log.info("requesting table from %s for %d weight systematics" %
+                 (self.__class__.__name__, len(systematics)))
+        log.debug("using selection: %s" % selection)
+        weight_branches_list = [
+            self.weights(systematic) for systematic in systematics]
+        if fields is None:
+            read_fields = None
+        else:
+            read_fields = [f for f in fields if f != 'weight']
+            for weight_branches in weight_branches_list:
+                read_fields += weight_branches
+            read_fields += self.correction_fields()
+            read_fields = tuple(unique(read_fields))
+            fields = unique(f for f in fields if f != 'weight')
+        recs = []
+        matrices = []
+        for ds in self.datasets:
+            table, events = self.dataset_table(ds, 'NOMINAL')
+            weight = self.dataset_weight(ds, table, events, 'NOMINAL', scale)
+            rec = table.read_fields(table_selection, read_fields, **kwargs)
+            matrices.append(self.weight_matrix(
+                rec, weight, weight_branches_list))
+            if fields is not None:
+                if not fields:
+                    continue
+                rec = rec[fields]
+            recs.append(rec)
+        if recs:
+            rec = stack(recs, fields=fields)
+        else:
+            # no fields were requested
+            rec = None
+        return rec, np.concatenate(matrices)
+
+    def record_fields(self, fields, weight_branches, include_weight=True):
+        """
+        The fields to read from the tables to build records with the
+        requested fields
+        """
+        if fields is None:
+            return None
+        # only read the requested fields and the fields needed to
+        # compute the weights
+        read_fields = [f for f in fields if f != 'weight']
+        if include_weight:
+            read_fields += weight_branches + self.correction_fields()
+        return tuple(unique(read_fields))
+
+    def iter_records(self,
+                     category=None,
+                     region=None,
+                     fields=None,
+                     cuts=None,
+                     include_weight=True,
+                     systematic='NOMINAL',
+                     scale=1.,
+                     chunksize=READ_CHUNKSIZE,
+                     **kwargs):
+        """
+        Same as records() but yield the records of each dataset in blocks of
+        at most chunksize rows instead of returning all records at once.
+        The blocks are yielded in the same order as the rows of records().
+        """
         if include_weight and fields is not None:
             if 'weight' not in fields:
                 fields = list(fields) + ['weight']
         selection = self.cuts(category, region, systematic) & cuts
-        table_selection = selection.where()
+        table_selection = self.table_selection(
+            category, region, systematic, cuts)
+        log.info("iterating over table from %s for systematic %s "
+                 "in blocks of %d rows" %
+                 (self.__class__.__name__, systematic_name(systematic),
+                  chunksize))
+        log.debug("using selection: %s" % selection)
+        weight_branches = self.weights(systematic)
+        if systematic in SYSTEMATICS_BY_WEIGHT:
+            systematic = 'NOMINAL'
+        read_fields = self.record_fields(
+            fields, weight_branches, include_weight)
+        for ds in self.datasets:
+            table, events = self.dataset_table(ds, systematic)
+            weight = self.dataset_weight(ds, table, events, systematic, scale)
+            for rec in table.iter_fields(table_selection, read_fields,
+                                         chunksize=chunksize, **kwargs):
+                yield self.weighted_records(
+                    table, rec, weight, weight_branches,
+                    fields=fields, include_weight=include_weight)
+
+    def record_batches(self,
+                       category=None,
+                       region=None,
+                       fields=None,
+                       cuts=None,
+                       include_weight=True,
+                       systematic='NOMINAL',
+                       scale=1.,
+                       return_idx=False,
+                       **kwargs):
+        """
+        Same as records() but return a ColumnBatch for each dataset. The
+        fields are not copied out of the rows read from the tables.
+        """
+        if include_weight and fields is not None:
+            if 'weight' not in fields:
+                fields = list(fields) + ['weight']
+        selection = self.cuts(category, region, systematic) & cuts
+        table_selection = self.table_selection(
+            category, region, systematic, cuts)
         if systematic == 'NOMINAL':
             log.info("requesting table from %s" %
                      (self.__class__.__name__))
@@ -1143,88 +1761,118 @@ class SystematicsSample(Sample):
         weight_branches = self.weights(systematic)
         if systematic in SYSTEMATICS_BY_WEIGHT:
             systematic = 'NOMINAL'
-        recs = []
+        read_fields = self.record_fields(
+            fields, weight_branches, include_weight)
+        batches = []
         if return_idx:
             idxs = []
         for ds in self.datasets:
-            try:
-                table = ds.tables[systematic]
-                events = ds.events[systematic]
-            except KeyError:
-                log.warning(
-                    "table for %s not present for %s "
-                    "using NOMINAL" % (systematic, ds.name))
-                table = ds.tables['NOMINAL']
-                events = ds.events['NOMINAL']
-            log.debug(
-                "\ndataset: {0}"
-                "\ntable: {1}"
-                "\ncross section: {2} [pb]"
-                "\nk-factor: {3}"
-                "\nfiltering efficiency: {4}"
-                "\nevents {5}".format(
-                    ds.name, table.name, ds.xs, ds.kfact, ds.effic, events))
-            actual_scale = self.scale
-            if isinstance(self, Ztautau):
-                if systematic == ('ZFIT_UP',):
-                    log.debug("scaling up for ZFIT_UP")
-                    actual_scale += self.scale_error
-                elif systematic == ('ZFIT_DOWN',):
-                    log.debug("scaling down for ZFIT_DOWN")
-                    actual_scale -= self.scale_error
-            weight = (
-                scale * actual_scale *
-                LUMI[self.year] *
-                ds.xs * ds.kfact * ds.effic / events)
-            if systematic in self.norms:
-                weight *= self.norms[systematic]
+            table, events = self.dataset_table(ds, systematic)
+            weight = self.dataset_weight(ds, table, events, systematic, scale)
             # read the table with a selection
             try:
-                if table_selection:
-                    rec = table.read_where(table_selection, **kwargs)
-                else:
-                    rec = table.read(**kwargs)
+                rec = table.read_fields(table_selection, read_fields,
+                                        return_idx=return_idx, **kwargs)
             except Exception as e:
                 print table
                 print e
                 continue
                 #raise
             if return_idx:
-                # only valid if table_selection is non-empty
-                idx = table.get_where_list(table_selection, **kwargs)
+                rec, idx = rec
                 idxs.append(idx)
-            # add weight field
-            if include_weight:
-                weights = np.empty(rec.shape[0], dtype='f8')
-                weights.fill(weight)
-                # merge the weight fields
-                weights *= reduce(np.multiply,
-                    [rec[br] for br in weight_branches])
-                correction_weights = self.corrections(rec)
-                if correction_weights:
-                    weights *= reduce(np.multiply, correction_weights)
-                # drop other weight fields
-                #rec = recfunctions.rec_drop_fields(rec, weight_branches)
-                # add the combined weight
-                rec = recfunctions.rec_append_fields(rec,
-                    names='weight',
-                    data=weights,
-                    dtypes='f8')
-                if rec['weight'].shape[0] > 1 and rec['weight'].sum() == 0:
-                    log.warning("{0}: weights sum to zero!".format(table.name))
-            if fields is not None:
-                try:
-                    rec = rec[fields]
-                except Exception as e:
-                    print table
-                    print rec.shape
-                    print rec.dtype
-                    print e
-                    raise
-            recs.append(rec)
+            batches.append(self.weighted_batch(
+                table, rec, weight, weight_branches,
+                fields=fields, include_weight=include_weight))
         if return_idx:
-            return zip(recs, idxs)
-        return recs
+            return zip(batches, idxs)
+        return batches
+
+    def records(self,
+                category=None,
+                region=None,
+                fields=None,
+                cuts=None,
+                include_weight=True,
+                systematic='NOMINAL',
+                scale=1.,
+                return_idx=False,
+                **kwargs):
+        batches = self.record_batches(
+            category=category,
+            region=region,
+            fields=fields,
+            cuts=cuts,
+            include_weight=include_weight,
+            systematic=systematic,
+            scale=scale,
+            return_idx=return_idx,
+            **kwargs)
+        if return_idx:
+            return [(batch.to_records(), idx) for batch, idx in batches]
+        return [batch.to_records() for batch in batches]
+
+    def multi_records(self, selections,
+                      fields=None,
+                      cuts=None,
+                      include_weight=True,
+                      scale=1.,
+                      **kwargs):
+        """
+        Return the records of several (category, region, systematic)
+        selections. Each table is only read once with the union of the
+        selections and the rows are then split among the selections in
+        memory. The output is a list holding the output of records() for each
+        selection.
+        """
+        if include_weight and fields is not None:
+            if 'weight' not in fields:
+                fields = list(fields) + ['weight']
+        # group the selections by the table systematic they are read from
+        groups = OrderedDict()
+        for i, (category, region, systematic) in enumerate(selections):
+            selection = self.table_selection(
+                category, region, systematic, cuts)
+            weight_branches = self.weights(systematic)
+            if systematic in SYSTEMATICS_BY_WEIGHT:
+                systematic = 'NOMINAL'
+            groups.setdefault(systematic, []).append(
+                (i, selection, weight_branches))
+        output = [[] for _ in selections]
+        for systematic, group in groups.items():
+            conditions = [condition for _, condition, _ in group]
+            table_selection = union(conditions)
+            log.info("requesting table from %s for %d selections" %
+                     (self.__class__.__name__, len(group)))
+            log.debug("using selection: %s" % table_selection)
+            for ds in self.datasets:
+                table, events = self.dataset_table(ds, systematic)
+                weight = self.dataset_weight(
+                    ds, table, events, systematic, scale)
+                if fields is None:
+                    read_fields = None
+                else:
+                    # read the requested fields and the fields needed to
+                    # compute the weights and split the selections
+                    read_fields = [f for f in fields if f != 'weight']
+                    for _, condition, weight_branches in group:
+                        if include_weight:
+                            read_fields += weight_branches
+                        read_fields += where_fields(condition, table.colnames)
+                    if include_weight:
+                        read_fields += self.correction_fields()
+                    read_fields = tuple(unique(read_fields))
+                rec = table.read_fields(table_selection, read_fields, **kwargs)
+                if len(group) == 1:
+                    group_masks = [None]
+                else:
+                    group_masks = masks(rec, conditions)
+                for (i, _, weight_branches), mask in zip(group, group_masks):
+                    selected = rec if mask is None else rec[mask]
+                    output[i].append(self.weighted_records(
+                        table, selected, weight, weight_branches,
+                        fields=fields, include_weight=include_weight))
+        return output
 
 
 class MC(SystematicsSample):
@@ -1377,44 +2025,19 @@ class CompositeSample(object):
         - systematics: boolean flag
         """
         field_hists_list = []
-        # -------- Retrieve the histograms dictionnary from each sample and store it into a list
+        # -------- Fill Histograms (see histogram.py) for each sample and store them into a list
         for s in self.samples_list:
-            # field_hists_temp = s.get_hist_array( field_hist_tot, category, region, systematics=systematics,**kwargs)
             field_hists_temp = {}
-            for field,hist in field_hist_tot.items():
-                field_hists_temp[field] = hist.Clone()
-                field_hists_temp[field].Reset()
+            for field, hist in field_hist_tot.items():
+                field_hists_temp[field] = Histogram.from_hist(hist, empty=True)
             s.draw_array(field_hists_temp, category, region, systematics=systematics,**kwargs)
             field_hists_list.append( field_hists_temp )
 
-        # -------- Reset the output histograms
-        for field, hist in field_hists_list[0].items():
-            hist_tot = hist.Clone()
-            hist_tot.Reset()
-            field_hist_tot[field] = hist_tot
-
-        # -------- Add the nominal histograms
-        for field_hist in field_hists_list:
-            for field, hist in field_hist.items():
-                field_hist_tot[field].Add( hist )
-
-        # --- Systematic Uncertainties block
-        if systematics:
-            #--- loop over the dictionnary of the summed histograms
-            for field,hist in field_hist_tot.items():
-                # --- Add a dictionary to the nominal summed histogram
-                if not hasattr( hist,'systematics'):
-                    hist.systematics = {}
-                # --- loop over the systematic uncercainties
-                for sys in iter_systematics(self.samples_list[0].year):
-                    if sys is 'NOMINAL':
-                        continue
-                    log.info ( "Fill the %s syst for the field %s" % (sys,field) )
-                    # -- Create an histogram for each systematic uncertainty
-                    hist.systematics[sys] =  hist.Clone()
-                    hist.systematics[sys].Reset()
-                    # -- loop over the samples and sum-up the syst-applied histograms
-                    for field_hist_sample in field_hists_list:
-                        field_hist_syst = field_hist_sample[field].systematics
-                        hist.systematics[sys].Add( field_hist_syst[sys] )
+        # -------- Sum the nominal histograms and their systematic variations
+        for field, hist in field_hist_tot.items():
+            hist_tot = sum([field_hist[field] for field_hist in field_hists_list])
+            if not systematics:
+                hist_tot.systematics.clear()
+            # -- convert to a new output histogram
+            field_hist_tot[field] = hist_tot.to_hist(hist, name=hist.GetName())
         return
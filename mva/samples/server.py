@@ -0,0 +1,99 @@
+"""
+Shared memory ntuple server.
+
+The ntup-server script copies the requested tables and columns of the
+ntuples into a columnar store (see columnar.py) under /dev/shm (or
+HHANA_SHM_DIR). Files in /dev/shm live in RAM, so processes attaching to
+the store map the same pages and N parallel workers do not hold N copies
+of the columns. Attaching only opens files and is safe after fork, unlike
+a PyTables handle.
+
+Workers attach to a store by name with HHANA_NTUPLE_BACKEND=shm and
+HHANA_NTUPLE_SERVER=<name> (the student by default) or with attach().
+The store stays in memory until it is released with ntup-server stop.
+"""
+import os
+import shutil
+from glob import glob
+
+import tables
+
+from . import log; log = log[__name__]
+from .. import NTUPLE_PATH, DEFAULT_STUDENT
+from .columnar import ColumnarStore, write_store
+
+SHM_DIR = os.getenv('HHANA_SHM_DIR', '/dev/shm')
+PREFIX = 'hhana-'
+SUFFIX = '.columns'
+
+
+def store_path(name):
+    return os.path.join(SHM_DIR, PREFIX + name + SUFFIX)
+
+
+def served():
+    """
+    The names of the stores in shared memory
+    """
+    names = []
+    for path in glob(os.path.join(SHM_DIR, PREFIX + '*' + SUFFIX)):
+        names.append(os.path.basename(path)[len(PREFIX):-len(SUFFIX)])
+    return names
+
+
+def attach(name):
+    path = store_path(name)
+    if not os.path.exists(path):
+        raise IOError(
+            "no ntuple server named {0} is running "
+            "(start one with ntup-server)".format(name))
+    return ColumnarStore(path)
+
+
+def serve(name=None, ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT,
+          table_names=None, columns=None):
+    """
+    Copy the tables in table_names (all tables by default) and only the
+    columns in columns (all columns by default) of a student into shared
+    memory. The columnar store of the student is used as the source if it
+    exists and <student>.h5 otherwise.
+    """
+    from .db import get_cutflow_index
+    if name is None:
+        name = student
+    path = store_path(name)
+    columnar_path = os.path.join(ntuple_path, student, student + SUFFIX)
+    if os.path.exists(columnar_path):
+        source = ColumnarStore(columnar_path)
+        source_tables = source.tables()
+        cutflows = dict((table.name, source.cutflow(table.name))
+                        for table in source_tables)
+        h5file = None
+    else:
+        h5file = tables.open_file(
+            os.path.join(ntuple_path, student, student + '.h5'))
+        source_tables = [table for table in h5file.root
+                         if isinstance(table, tables.Table)]
+        cutflows = get_cutflow_index(ntuple_path, student)
+        if cutflows is None:
+            log.warning(
+                "the cutflow index of {0} is missing or out of date, "
+                "run cutflow-index first".format(student))
+    if table_names is not None:
+        source_tables = [table for table in source_tables
+                         if table.name in table_names]
+    log.info("serving {0:d} tables of {1} in {2}".format(
+        len(source_tables), student, path))
+    try:
+        write_store(path, source_tables, cutflows=cutflows, columns=columns)
+    finally:
+        if h5file is not None:
+            h5file.close()
+    return path
+
+
+def release(name):
+    path = store_path(name)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+        log.info("released {0}".format(path))
@@ -4,13 +4,11 @@ import os
 from rootpy.tree import Cut
 from rootpy.io import root_open
 
-# root_numpy imports
-from root_numpy import rec2array, evaluate
-
 # local imports
 from . import log
 from .sample import SystematicsSample, Background, MC
 from ..regions import REGIONS
+from ..reweight import weight_hist
 from .. import DAT_DIR
 
 
@@ -106,9 +104,15 @@ class Embedded_Ztautau(Ztautau, SystematicsSample):
         # posterior trigger correction
         if not self.posterior_trigger_correction:
             return
-        arr = rec2array(rec[['tau1_pt', 'tau2_pt']])
-        weights = evaluate(self.trigger_correct, arr)
-        return [weights]
+        # the content of the bin of each event as root_numpy.evaluate
+        # (including the underflow and overflow)
+        correct = weight_hist(self.trigger_correct, clip=False)
+        return [correct(rec['tau1_pt'], rec['tau2_pt'])]
+
+    def correction_fields(self):
+        if not self.posterior_trigger_correction:
+            return []
+        return ['tau1_pt', 'tau2_pt']
 
     def systematics_components(self):
         # No FAKERATE for embedding since fakes are data
@@ -0,0 +1,167 @@
+"""
+Persistent store of the classifier scores of the events of each table.
+
+Classifier.classify() evaluates both BDTs on every selected event of every
+dataset table of a sample and for every systematic each time the scores are
+requested (by workspace, plot-bdt, optimize-binning...). The scores of the
+events of a table passing a selection are stored here in the order of the
+rows of the table, keyed by:
+
+- the classifier: the SHA1 hashes of the pickles of both BDTs in the order
+  they are applied to the partitions, the input fields and the partition
+  key;
+- the table: its file, name and version (see manifest.table_version);
+- the canonical selection condition (built from the category, region,
+  systematic and additional cuts).
+
+A classifier trained again or a dataset updated by ntup-merge --update
+therefore never reuses stale scores. The total size of the store is bounded
+by HHANA_SCORE_CACHE_MB and the least recently used entries are evicted
+first. Set NOSCORECACHE to disable the store.
+"""
+import os
+import hashlib
+from glob import glob
+
+import numpy as np
+
+from . import log; log = log[__name__]
+from . import CACHE_DIR
+from .zonemap import table_source
+from .manifest import table_version
+from .index_cache import canonical
+
+
+SCORE_CACHE_DIR = os.path.join(CACHE_DIR, 'scores')
+SCORE_CACHE_MB = float(os.getenv('HHANA_SCORE_CACHE_MB', 1024))
+ENABLED = not os.getenv('NOSCORECACHE', None)
+
+if not ENABLED:
+    log.warning("classifier score store is disabled")
+
+# increment to invalidate all entries (2: scores of rows selected with the
+# bitmasks of another category of the same name)
+VERSION = 2
+
+
+def classifier_key(clf_hashes, fields, partition_key):
+    """
+    A string identifying the scores of a pair of classifiers applied on the
+    partitions
+    """
+    return '{0}:{1}:{2}'.format(
+        ','.join(clf_hashes), ','.join(fields), partition_key)
+
+
+def get_key(clf_key, table, condition):
+    filename, name = table_source(table)
+    filename = os.path.abspath(filename)
+    key = '{0}:{1}:{2}:{3}:{4}:{5}'.format(
+        VERSION, clf_key, filename, table_version(table), name,
+        canonical(condition or ''))
+    return hashlib.sha1(key).hexdigest()
+
+
+def entry_path(key):
+    return os.path.join(SCORE_CACHE_DIR, key + '.npy')
+
+
+def entries():
+    return glob(os.path.join(SCORE_CACHE_DIR, '*.npy'))
+
+
+def get(key):
+    path = entry_path(key)
+    try:
+        scores = np.load(path)
+    except (IOError, ValueError):
+        return None
+    # mark as recently used
+    os.utime(path, None)
+    return scores
+
+
+def put(key, scores):
+    if not os.path.isdir(SCORE_CACHE_DIR):
+        os.makedirs(SCORE_CACHE_DIR)
+    path = entry_path(key)
+    # write to a temporary file first so that other processes never read a
+    # partially written entry
+    tmp_path = '{0}.{1:d}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, scores)
+    os.rename(tmp_path, path)
+    evict()
+
+
+def get_all(keys):
+    """
+    The stored scores of all keys or None if any of them is missing
+    """
+    if not ENABLED or not keys:
+        return None
+    all_scores = []
+    for key in keys:
+        scores = get(key)
+        if scores is None:
+            return None
+        all_scores.append(scores)
+    return all_scores
+
+
+def put_all(keys, all_scores):
+    if not ENABLED:
+        return
+    for key, scores in zip(keys, all_scores):
+        put(key, scores)
+
+
+def evict(max_mb=None):
+    """
+    Remove the least recently used entries until the total size of the
+    store is below max_mb (HHANA_SCORE_CACHE_MB by default)
+    """
+    if max_mb is None:
+        max_mb = SCORE_CACHE_MB
+    max_bytes = max_mb * 1024 ** 2
+    stats = []
+    for path in entries():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed by another process
+            continue
+        stats.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in stats)
+    removed = 0
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        log.info(
+            "evicted {0:d} entries from the classifier score store".format(
+                removed))
+    return removed
+
+
+def clear():
+    """
+    Remove all entries from the store
+    """
+    removed = evict(0)
+    log.info("cleared the classifier score store")
+    return removed
+
+
+def info():
+    """
+    Return the number of entries and the total size in bytes of the store
+    """
+    paths = entries()
+    return len(paths), sum(os.path.getsize(path) for path in paths)
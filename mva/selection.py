@@ -0,0 +1,89 @@
+"""
+Helpers to evaluate selections (numexpr condition strings as returned by
+``Cut.where()``) on columns held in memory
+"""
+import re
+
+import numpy as np
+import numexpr
+
+from . import log; log = log[__name__]
+from .cutengine import compile as compile_condition
+
+
+# names appearing in a numexpr condition string
+IDENTIFIER = re.compile(r'\b([A-Za-z_][A-Za-z0-9_]*)\b')
+
+
+def where_fields(condition, colnames=None):
+    """
+    Return the names referenced by a numexpr condition in order of first
+    appearance. If colnames is specified then only the names that are also in
+    colnames are returned, which drops numexpr functions such as ``abs``.
+    """
+    if not condition:
+        return []
+    fields = []
+    for name in IDENTIFIER.findall(condition):
+        if name in fields:
+            continue
+        if colnames is not None and name not in colnames:
+            continue
+        fields.append(name)
+    return fields
+
+
+def evaluate(condition, columns):
+    """
+    Evaluate a numexpr condition on a mapping of column names to arrays (or
+    on a record array) and return the boolean mask of the passing rows
+    """
+    if isinstance(columns, np.ndarray):
+        names = where_fields(condition, columns.dtype.names)
+    else:
+        names = where_fields(condition, columns)
+    return numexpr.evaluate(
+        condition, local_dict=dict((name, columns[name]) for name in names))
+
+
+def union(conditions):
+    """
+    Return the numexpr condition selecting the rows that pass any of the
+    conditions, or None if one of the conditions selects all rows
+    """
+    if not all(conditions):
+        return None
+    unique_conditions = []
+    for condition in conditions:
+        if condition not in unique_conditions:
+            unique_conditions.append(condition)
+    if len(unique_conditions) == 1:
+        return unique_conditions[0]
+    return ' | '.join('({0})'.format(condition)
+                      for condition in unique_conditions)
+
+
+def masks(rec, conditions):
+    """
+    Return the boolean mask of each condition on a record array. Identical
+    conditions are only evaluated once and the atoms shared by several
+    conditions (see cutengine.py) are only evaluated once.
+    """
+    atoms = {}
+
+    def atom_mask(source):
+        if source not in atoms:
+            atoms[source] = evaluate(source, rec)
+        return atoms[source]
+
+    evaluated = {}
+    output = []
+    for condition in conditions:
+        if condition not in evaluated:
+            if condition:
+                evaluated[condition] = compile_condition(condition).mask(
+                    atom_mask, len(rec))
+            else:
+                evaluated[condition] = np.ones(len(rec), dtype=np.bool_)
+        output.append(evaluated[condition])
+    return output
@@ -0,0 +1,41 @@
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+import tables
+from numpy.testing import assert_array_equal
+
+from mva.augment import augment_table
+
+
+def test_augment_table():
+    handle, path = tempfile.mkstemp(suffix='.h5')
+    os.close(handle)
+    rec = np.zeros(2500, dtype=[('x', 'f4'), ('y', 'i4')])
+    rec['x'] = np.random.rand(len(rec))
+    rec['y'] = np.arange(len(rec))
+    h5file = tables.open_file(path, 'w')
+    try:
+        table = h5file.create_table('/', 'test', rec)
+        table.attrs.cutflow = [1., 2.]
+
+        def derive(columns):
+            return OrderedDict([
+                ('z', (columns['x'] * columns['y']).astype('f8'))])
+
+        table = augment_table(table, ['x', 'y'], derive, chunksize=1000)
+        assert table.name == 'test'
+        assert table.colnames == ['x', 'y', 'z']
+        assert list(table.attrs.cutflow) == [1., 2.]
+        out = table.read()
+        assert_array_equal(out['x'], rec['x'])
+        assert_array_equal(out['z'], rec['x'] * rec['y'].astype('f8'))
+    finally:
+        h5file.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -0,0 +1,54 @@
+import numpy as np
+from numpy.lib import recfunctions
+from numpy.testing import assert_array_equal
+
+from root_numpy import rec2array, stack
+
+from mva.samples.batch import ColumnBatch, ChunkedBatch
+
+
+def make_records(n):
+    rec = np.zeros(n, dtype=[('x', 'f4'), ('y', 'i4'), ('z', 'f8')])
+    rec['x'] = np.random.rand(n)
+    rec['y'] = np.random.randint(-3, 4, n)
+    rec['z'] = np.random.randn(n)
+    return rec
+
+
+def test_batch():
+    recs = [make_records(100), make_records(50)]
+    weights = [np.random.rand(len(rec)) for rec in recs]
+    batches = []
+    expected = []
+    for rec, weight in zip(recs, weights):
+        batches.append(ColumnBatch.from_records(rec, ['x', 'y']).add(
+            'weight', weight))
+        expected.append(recfunctions.rec_append_fields(
+            rec[['x', 'y']], names='weight', data=weight, dtypes='f8'))
+    for batch, rec in zip(batches, expected):
+        assert_array_equal(batch.to_records(), rec)
+    fields = ['x', 'weight']
+    batch = ChunkedBatch(batches, fields)
+    rec = stack(expected, fields=fields)
+    assert_array_equal(batch.to_records(), rec)
+    assert_array_equal(batch['x'], rec['x'])
+    assert_array_equal(batch.concatenate().to_records(), rec)
+    # adding a field does not copy the others
+    scores = np.random.rand(len(batch)).astype('f4')
+    batch.add('classifier', scores)
+    assert batch.chunks[0]['x'] is batches[0]['x']
+    assert_array_equal(batch['classifier'], scores)
+    # same as the scaled copy converted with rec2array
+    arr = np.copy(rec[fields])
+    arr['x'] *= 0.5
+    assert_array_equal(
+        batch.array(fields, field_scale={'x': 0.5}),
+        rec2array(arr, fields=fields))
+    mask = batch['x'] > 0.5
+    assert_array_equal(batch[mask].to_records(fields), rec[mask])
+    batch.scale('weight', 2.)
+    assert_array_equal(batch['weight'], rec['weight'] * 2.)
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
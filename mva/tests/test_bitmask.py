@@ -0,0 +1,140 @@
+import os
+import tempfile
+
+import numpy as np
+import tables
+from numpy.testing import assert_array_equal
+
+from mva import bitmask
+
+
+def test_pack():
+    masks = [np.random.rand(1000) > 0.5 for _ in xrange(70)]
+    bits = bitmask.pack(masks)
+    assert bits.shape == (1000, 2)
+    for index, mask in enumerate(masks):
+        assert_array_equal(bitmask.test(bits, index), mask)
+
+
+def check_where_list(table, selection, start=None, stop=None, step=None):
+    assert_array_equal(
+        bitmask.get_where_list(
+            table, selection, start=start, stop=stop, step=step),
+        table.get_where_list(
+            selection, start=start, stop=stop, step=step))
+
+
+def test_bitmask():
+    handle, path = tempfile.mkstemp(suffix='.h5')
+    os.close(handle)
+    rec = np.zeros(20000, dtype=[('x', 'f4'), ('y', 'i4'), ('t', 'b1')])
+    rec['x'] = np.random.rand(len(rec))
+    rec['y'] = np.random.randint(-3, 4, len(rec))
+    rec['t'] = np.random.rand(len(rec)) > 0.3
+    h5file = tables.open_file(path, 'w')
+    h5file.create_table('/', 'test', rec)
+    h5file.close()
+    # bits of the categories A: x > 0.5, B: x < 0.125 and of the region
+    # OS: y == 1
+    selection_path = os.path.splitext(path)[0] + bitmask.SUFFIX
+    outfile = tables.open_file(selection_path, 'w')
+    outfile.root._v_attrs.version = bitmask.VERSION
+    outfile.root._v_attrs.source_mtime = os.path.getmtime(path)
+    outfile.root._v_attrs.categories = ['A', 'B']
+    outfile.root._v_attrs.regions = ['OS']
+    group = outfile.create_group('/', 'test')
+    group._v_attrs.nrows = len(rec)
+    for year in bitmask.YEARS:
+        outfile.create_array(group, 'categories_{0:d}'.format(year),
+                             bitmask.pack([rec['x'] > 0.5, rec['x'] < 0.125]))
+    outfile.create_array(group, 'regions', bitmask.pack([rec['y'] == 1]))
+    outfile.close()
+    h5file = tables.open_file(path)
+    table = h5file.root.test
+    try:
+        # plain conditions are not handled
+        assert bitmask.get_where_list(table, '(x > 0.5) & (y == 1)') is None
+        # unknown categories are not handled
+        assert bitmask.get_where_list(table, bitmask.Selection(
+            'x > 0.9', category='C', year=2012)) is None
+        for selection in (
+                bitmask.Selection('(x > 0.5) & (y == 1) & t',
+                                  category='A', region='OS', year=2012,
+                                  residual='t'),
+                bitmask.Selection('x < 0.125', category='B', year=2011),
+                bitmask.Selection('(y == 1) & (x > 0.25)',
+                                  region='OS', residual='x > 0.25')):
+            yield check_where_list, table, selection
+            yield check_where_list, table, selection, 17, 15000, 3
+    finally:
+        h5file.close()
+        bitmask.cleanup()
+        bitmask.FILES.clear()
+        os.remove(path)
+        os.remove(selection_path)
+
+
+class Cut(str):
+
+    def where(self):
+        return str(self)
+
+
+class Category_A(object):
+
+    @staticmethod
+    def get_cuts(year):
+        return Cut('x > 0.5')
+
+
+def test_write_update():
+    handle, path = tempfile.mkstemp(suffix='.h5')
+    os.close(handle)
+    selection_path = os.path.splitext(path)[0] + bitmask.SUFFIX
+    rec = np.zeros(1000, dtype=[('x', 'f4'), ('y', 'i4')])
+    rec['x'] = np.random.rand(len(rec))
+    rec['y'] = np.random.randint(-3, 4, len(rec))
+    h5file = tables.open_file(path, 'w')
+    for name in ('a', 'b'):
+        h5file.create_table('/', name, rec)
+    h5file.close()
+    category_definitions = bitmask.category_definitions
+    region_definitions = bitmask.region_definitions
+    bitmask.category_definitions = lambda: [Category_A]
+    bitmask.region_definitions = lambda: [('OS', Cut('y == 1'))]
+    try:
+        bitmask.write(path)
+        # the bits of the other tables are kept when updating a table
+        bitmask.write(path, table_names=['a'])
+        with tables.open_file(selection_path) as outfile:
+            assert 'a' in outfile.root and 'b' in outfile.root
+        # and all tables are rebuilt if the bits have changed
+        with tables.open_file(selection_path, 'a') as outfile:
+            outfile.root._v_attrs.version = 'outdated'
+        bitmask.write(path, table_names=['a'])
+        with tables.open_file(selection_path) as outfile:
+            assert outfile.root._v_attrs.version == bitmask.VERSION
+            assert_array_equal(
+                bitmask.test(outfile.root.b.regions.read(), 0),
+                rec['y'] == 1)
+    finally:
+        bitmask.category_definitions = category_definitions
+        bitmask.region_definitions = region_definitions
+        os.remove(path)
+        os.remove(selection_path)
+
+
+def test_category_definitions():
+    from mva.categories import Category_VBF, Category_VBF_NO_DETAJJ_CUT
+    names = [category.__name__
+             for category in bitmask.category_definitions()]
+    assert len(set(names)) == len(names)
+    assert Category_VBF.__name__ in names
+    # a variant sharing the name of a category has no bits of its own
+    assert Category_VBF_NO_DETAJJ_CUT.name == Category_VBF.name
+    assert Category_VBF_NO_DETAJJ_CUT.__name__ not in names
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
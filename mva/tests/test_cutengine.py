@@ -0,0 +1,99 @@
+import os
+import tempfile
+
+import numpy as np
+import tables
+from numpy.testing import assert_array_equal
+
+from mva import cutengine
+from mva.selection import masks
+
+
+def test_decompose():
+    compiled = cutengine.compile(
+        '((a > 1) & (b == -1)) & ~((a > 1) | c) & (abs(d) < 2.5)')
+    assert compiled.tree[0] == 'and'
+    assert compiled.atoms == [
+        '(a > 1)', '(b == -1)', 'c', '(abs(d) < 2.5)']
+    # unsupported expressions are evaluated as a single atom
+    assert cutengine.compile('a[0] > 1').atoms == ['a[0]>1']
+
+
+def check_where_list(table, condition, start=None, stop=None, step=None):
+    assert_array_equal(
+        cutengine.get_where_list(
+            table, condition, start=start, stop=stop, step=step),
+        table.get_where_list(
+            condition, start=start, stop=stop, step=step))
+
+
+def create_table(nrows):
+    handle, path = tempfile.mkstemp(suffix='.h5')
+    os.close(handle)
+    rec = np.zeros(nrows, dtype=[('x', 'f4'), ('y', 'i4'), ('t', 'b1'),
+                                 ('z', 'f4')])
+    rec['x'] = np.random.rand(len(rec))
+    rec['y'] = np.random.randint(-3, 4, len(rec))
+    rec['t'] = np.random.rand(len(rec)) > 0.3
+    # sorted so that the zone maps of z are selective
+    rec['z'] = np.sort(np.random.rand(len(rec)))
+    h5file = tables.open_file(path, 'w')
+    h5file.create_table('/', 'test', rec)
+    h5file.close()
+    return path
+
+
+def test_cutengine():
+    path = create_table(30000)
+    h5file = tables.open_file(path)
+    table = h5file.root.test
+    conditions = [
+        '(x > 0.5) & (y == 1) & t',
+        '((x > 0.5) & ~(y == 1)) | (x * 2 < 0.25)',
+        '~t & (abs(y) != 2)',
+        '(x > 0.5) & True',
+        't',
+        '(z > 0.9) & (y == 1) & t',
+        '((z < 0.05) & ~(y == 1)) | ((z > 0.99) & t)',
+    ]
+    try:
+        for condition in conditions:
+            yield check_where_list, table, condition
+            yield check_where_list, table, condition, 17, 25000, 3
+        # masks on records share the atoms in the same way
+        rec = table.read()
+        for condition, mask in zip(conditions, masks(rec, conditions)):
+            yield (assert_array_equal, np.flatnonzero(mask),
+                   table.get_where_list(condition))
+    finally:
+        h5file.close()
+        os.remove(path)
+
+
+def test_zones():
+    path = create_table(100000)
+    h5file = tables.open_file(path)
+    table = h5file.root.test
+    read_rows = []
+    read_block = cutengine.read_block
+
+    def counting_read_block(table, names, start, stop):
+        read_rows.append(stop - start)
+        return read_block(table, names, start, stop)
+
+    cutengine.read_block = counting_read_block
+    try:
+        condition = '(z > 0.95) & (y == 1) & ~t'
+        assert_array_equal(cutengine.get_where_list(table, condition),
+                           table.get_where_list(condition))
+        # only the zones that may pass z > 0.95 are read
+        assert 0 < sum(read_rows) < table.nrows / 2
+    finally:
+        cutengine.read_block = read_block
+        h5file.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -0,0 +1,40 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from mva.forest import CompiledForest
+
+
+def check_forest(n_classes, max_depth):
+    random_state = np.random.RandomState(0)
+    X = random_state.normal(size=(2000, 4))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] > 0).astype(int)
+    if n_classes > 2:
+        y += (X[:, 3] > 0.5).astype(int)
+    weights = random_state.uniform(0.5, 1.5, len(y))
+    clf = AdaBoostClassifier(
+        DecisionTreeClassifier(max_depth=max_depth),
+        n_estimators=20,
+        learning_rate=0.1,
+        algorithm='SAMME.R',
+        random_state=0)
+    clf.fit(X, y, sample_weight=weights)
+    forest = CompiledForest.compile(clf)
+    X_test = random_state.normal(size=(5000, 4))
+    # include values on the thresholds
+    X_test[:10, 0] = forest.threshold[:10]
+    assert_array_equal(forest.decision_function(X_test),
+                       clf.decision_function(X_test))
+
+
+def test_forest():
+    for n_classes in (2, 3):
+        for max_depth in (1, 3, None):
+            yield check_forest, n_classes, max_depth
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
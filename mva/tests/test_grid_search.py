@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from glob import glob
+
+import numpy as np
+
+from sklearn.cross_validation import StratifiedKFold
+from sklearn.metrics import roc_auc_score
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from mva.grid_search import BoostGridSearchCV
+
+
+random_state = np.random.RandomState(0)
+X = random_state.normal(size=(500, 3))
+y = (X[:, 0] + X[:, 1] * X[:, 2] > 0).astype(int)
+weights = random_state.uniform(0.5, 1.5, len(y))
+
+
+def grid_scores(**kwargs):
+    grid_clf = BoostGridSearchCV(
+        AdaBoostClassifier(
+            DecisionTreeClassifier(),
+            learning_rate=0.1,
+            algorithm='SAMME.R',
+            random_state=0),
+        {'base_estimator__min_fraction_leaf': [0.01, 0.1, 0.3]},
+        max_n_estimators=5,
+        min_n_estimators=2,
+        score_func=roc_auc_score,
+        cv=StratifiedKFold(y, 3),
+        **kwargs)
+    grid_clf.fit(X, y, sample_weight=weights)
+    return [(score.parameters, score.mean_validation_score)
+            for score in grid_clf.grid_scores_]
+
+
+def check_shared(n_jobs, expected):
+    assert grid_scores(shared_memory=True, n_jobs=n_jobs) == expected
+
+
+def test_shared():
+    expected = grid_scores(n_jobs=1)
+    for n_jobs in (1, 2):
+        yield check_shared, n_jobs, expected
+
+
+def test_resume():
+    expected = grid_scores(n_jobs=1)
+    results_dir = tempfile.mkdtemp()
+    try:
+        assert grid_scores(shared_memory=True, n_jobs=2,
+                           results_dir=results_dir) == expected
+        results = glob(os.path.join(results_dir, '*', '*.pickle'))
+        # one result per grid point and fold
+        assert len(results) == 9
+        # an interrupted search
+        os.remove(results[0])
+        assert grid_scores(shared_memory=True, n_jobs=2,
+                           results_dir=results_dir) == expected
+        assert len(glob(os.path.join(results_dir, '*', '*.pickle'))) == 9
+    finally:
+        shutil.rmtree(results_dir)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
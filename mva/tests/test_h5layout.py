@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import tables
+from numpy.testing import assert_array_equal
+
+from mva.h5layout import Layout, repack, replay
+
+
+def test_parse():
+    layout = Layout.parse('zlib:1:shuffle:16384')
+    assert layout.complib == 'zlib'
+    assert layout.complevel == 1
+    assert layout.shuffle
+    assert layout.chunkrows == 16384
+    assert str(Layout.parse(str(layout))) == str(layout)
+    assert str(Layout.parse('lzo:0')) == 'lzo:0:noshuffle'
+
+
+def check_repack(path, rec, spec):
+    layout = Layout.parse(spec)
+    output = os.path.splitext(path)[0] + '.repacked.h5'
+    repack(path, output, layout)
+    h5file = tables.open_file(output)
+    try:
+        table = h5file.root.test
+        assert_array_equal(table.read(), rec)
+        assert table.filters.complevel == layout.complevel
+        if layout.chunkrows is not None:
+            assert table.chunkshape == (layout.chunkrows,)
+        assert list(table.attrs.cutflow) == [1., 2.]
+    finally:
+        h5file.close()
+    accesses = [
+        {'table': 'test', 'condition': 'x > 0.5', 'fields': ['y'],
+         'start': None, 'stop': None, 'step': None},
+        {'table': 'test', 'condition': None, 'fields': None,
+         'start': 10, 'stop': 1000, 'step': 3}]
+    result = replay(output, accesses)
+    assert result['rows'] == (rec['x'] > 0.5).sum() + len(xrange(10, 1000, 3))
+
+
+def test_repack():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'test.h5')
+    rec = np.zeros(20000, dtype=[('x', 'f4'), ('y', 'i4')])
+    rec['x'] = np.random.rand(len(rec))
+    rec['y'] = np.arange(len(rec))
+    h5file = tables.open_file(path, 'w')
+    table = h5file.create_table('/', 'test', rec)
+    table.attrs.cutflow = [1., 2.]
+    h5file.close()
+    try:
+        for spec in ('lzo:0', 'zlib:1:shuffle', 'zlib:1:noshuffle:4096'):
+            yield check_repack, path, rec, spec
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
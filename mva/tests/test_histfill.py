@@ -0,0 +1,106 @@
+import numpy as np
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+
+from mva.histfill import Axis, HistFiller, bin_index, num_cells
+from mva.histogram import hist_axes
+
+
+def find_bin(axis, x):
+    # TAxis::FindBin
+    if x < axis.xmin:
+        return 0
+    if not x < axis.xmax:
+        return axis.nbins + 1
+    if axis.edges is None:
+        return 1 + int(axis.nbins * (x - axis.xmin) / (axis.xmax - axis.xmin))
+    return int(np.searchsorted(axis.edges, x, side='right'))
+
+
+def check_axis(axis):
+    values = np.concatenate([
+        np.random.uniform(axis.xmin - 1, axis.xmax + 1, 1000),
+        # the edges themselves
+        np.linspace(axis.xmin, axis.xmax, axis.nbins + 1),
+        [np.nan]])
+    assert_array_equal(axis.index(values),
+                       [find_bin(axis, x) for x in values])
+
+
+def test_axis():
+    for axis in (Axis(10, 0., 1.), Axis(7, -2.5, 3.1),
+                 Axis(3, 0., 10., edges=[0., 1., 5., 10.])):
+        yield check_axis, axis
+
+
+def test_bin_index():
+    axes = [Axis(4, 0., 4.), Axis(3, 0., 3.)]
+    x = np.array([-1., 0.5, 3.5, 10.])
+    y = np.array([0.5, 2.5, -1., 1.5])
+    # TH2::GetBin(binx, biny) = binx + (nx + 2) * biny
+    assert_array_equal(bin_index(axes, [x, y]),
+                       [0 + 6 * 1, 1 + 6 * 3, 4 + 6 * 0, 5 + 6 * 2])
+    assert num_cells(axes) == 6 * 5
+
+
+class FakeHist(object):
+
+    def __init__(self, axis):
+        self.axis = axis
+
+
+def test_fill():
+    axis = Axis(5, 0., 1., edges=[0., 0.1, 0.2, 0.5, 0.7, 1.])
+    filler = HistFiller()
+    hists = [FakeHist(axis), FakeHist(axis)]
+    for hist in hists:
+        filler.axes[id(hist)] = [axis]
+    x = np.random.uniform(-0.1, 1.1, 10000)
+    weights = np.random.normal(1, 0.3, len(x))
+    index = filler.index(hists[0], [x])
+    filler.fill(hists[0], index, weights)
+    filler.fill(hists[1], index, weights * 2)
+    filler.fill(hists[1], index)
+    edges = np.concatenate([[-np.inf], axis.edges, [np.inf]])
+    sumw, _ = np.histogram(x, bins=edges, weights=weights)
+    sumw2, _ = np.histogram(x, bins=edges, weights=weights ** 2)
+    counts, _ = np.histogram(x, bins=edges)
+    sums = filler.sums[id(hists[0])]
+    assert sums.weighted
+    assert sums.entries == len(x)
+    assert_array_almost_equal(sums.sumw, sumw)
+    assert_array_almost_equal(sums.sumw2, sumw2)
+    sums = filler.sums[id(hists[1])]
+    assert sums.entries == 2 * len(x)
+    assert_array_almost_equal(sums.sumw, 2 * sumw + counts)
+    assert_array_almost_equal(sums.sumw2, 4 * sumw2 + counts)
+
+
+def check_flush(hist, ncolumns):
+    columns = [np.random.uniform(-0.5, 4.5, 500) for _ in xrange(ncolumns)]
+    weights = np.random.normal(1, 0.3, 500)
+    expected = hist.Clone()
+    # TH1::Fill entry by entry
+    for entry in zip(*(columns + [weights])):
+        expected.Fill(*entry)
+    filler = HistFiller()
+    filler.fill(hist, filler.index(hist, columns), weights)
+    filler.flush()
+    cells = range(num_cells(hist_axes(hist)))
+    assert_array_almost_equal(
+        [hist.GetBinContent(cell) for cell in cells],
+        [expected.GetBinContent(cell) for cell in cells])
+    assert_array_almost_equal(
+        [hist.GetBinError(cell) for cell in cells],
+        [expected.GetBinError(cell) for cell in cells])
+    assert hist.GetEntries() == expected.GetEntries()
+
+
+def test_flush():
+    from rootpy.plotting import Hist, Hist2D
+    yield check_flush, Hist([0., 0.5, 1., 2.5, 4.]), 1
+    yield check_flush, Hist2D(4, 0., 4., 3, 0., 3.), 2
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
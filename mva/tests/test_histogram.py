@@ -0,0 +1,79 @@
+import numpy as np
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+
+from mva.histogram import Axis, Histogram
+from mva.histfill import HistFiller
+
+
+def random_hist(axes, terms=()):
+    hist = Histogram(axes)
+    hist.sumw[:] = np.random.uniform(0, 10, len(hist.sumw))
+    hist.sumw2[:] = np.random.uniform(0, 1, len(hist.sumw))
+    hist.entries = 100.
+    for term in terms:
+        hist.systematics[term] = Histogram(
+            axes, hist.sumw * np.random.uniform(0.9, 1.1, len(hist.sumw)),
+            hist.sumw2)
+    return hist
+
+
+def test_arithmetic():
+    axes = [Axis(5, 0., 1.)]
+    data = random_hist(axes)
+    mc = random_hist(axes, terms=[('JES_UP',), ('JES_DOWN',)])
+    qcd = (data * 1.1 - mc) * 0.5
+    assert_array_almost_equal(qcd.sumw, (data.sumw * 1.1 - mc.sumw) * 0.5)
+    # the errors are propagated as by TH1::Add and TH1::Scale
+    assert_array_almost_equal(
+        qcd.sumw2, (data.sumw2 * 1.1 ** 2 + mc.sumw2) * 0.5 ** 2)
+    assert sorted(qcd.systematics) == [('JES_DOWN',), ('JES_UP',)]
+    for term, sys_hist in mc.systematics.items():
+        # the data has no variations so its nominal is used
+        assert_array_almost_equal(
+            qcd.systematics[term].sumw,
+            (data.sumw * 1.1 - sys_hist.sumw) * 0.5)
+    # the operands are unchanged
+    assert not data.systematics
+    total = sum([mc, data])
+    assert_array_almost_equal(total.sumw, mc.sumw + data.sumw)
+    assert_array_almost_equal(
+        total.systematics[('JES_UP',)].sumw,
+        mc.systematics[('JES_UP',)].sumw + data.sumw)
+
+
+def test_integral():
+    axes = [Axis(4, 0., 4.), Axis(3, 0., 3.)]
+    hist = random_hist(axes)
+    inner = hist.sumw.reshape(5, 6)[1:-1, 1:-1]
+    assert_array_almost_equal(hist.integral(), inner.sum())
+    assert_array_almost_equal(hist.integral(overflow=True), hist.sumw.sum())
+
+
+def test_fill():
+    axes = [Axis(3, 0., 10., edges=[0., 1., 5., 10.])]
+    hist = Histogram(axes, name='test')
+    clone = hist.Clone(name='test_clone')
+    assert clone.name == 'test_clone'
+    assert clone.GetDimension() == 1
+    x = np.random.uniform(-1, 11, 1000)
+    weights = np.random.normal(1, 0.3, len(x))
+    filler = HistFiller()
+    index = filler.index(hist, [x])
+    filler.fill(hist, index, weights)
+    filler.fill(clone, index)
+    filler.flush()
+    edges = np.concatenate([[-np.inf], axes[0].edges, [np.inf]])
+    sumw, _ = np.histogram(x, bins=edges, weights=weights)
+    sumw2, _ = np.histogram(x, bins=edges, weights=weights ** 2)
+    counts, _ = np.histogram(x, bins=edges)
+    assert_array_almost_equal(hist.sumw, sumw)
+    assert_array_almost_equal(hist.sumw2, sumw2)
+    assert_array_equal(clone.sumw, counts)
+    assert hist.entries == len(x)
+    hist.Reset()
+    assert not hist.sumw.any()
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import tables
+
+from mva import manifest
+
+
+def test_changed():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'hhskim.a.root')
+        with open(path, 'wb') as f:
+            f.write('x' * 1000)
+        current = {'outputs': {}, 'datasets': {}}
+        assert manifest.changed(current, 'a', path)
+        current['datasets']['a'] = manifest.file_info(path)
+        assert not manifest.changed(current, 'a', path)
+        # touched but not modified
+        os.utime(path, (0, 0))
+        assert not manifest.changed(current, 'a', path)
+        assert current['datasets']['a']['mtime'] == 0
+        # same size but another content
+        with open(path, 'wb') as f:
+            f.write('y' * 1000)
+        assert manifest.changed(current, 'a', path)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_table_version():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'hhskim.h5')
+        h5file = tables.open_file(path, 'w')
+        for name in ('a', 'b'):
+            h5file.create_table('/', name, np.zeros(10, dtype=[('x', 'f4')]))
+        h5file.close()
+        h5file = tables.open_file(path)
+        try:
+            # without a manifest
+            mtime = repr(os.path.getmtime(path))
+            assert manifest.table_version(h5file.root.a) == mtime
+            manifest.write(manifest.manifest_path(path), {
+                'outputs': {path: os.path.getmtime(path)},
+                'datasets': {
+                    'a': {'sha1': 'abc', 'nrows': 10},
+                    'b': {'sha1': 'def', 'nrows': 5}}})
+            assert manifest.table_version(h5file.root.a) == 'abc'
+            # the number of rows differs
+            assert manifest.table_version(h5file.root.b) == mtime
+        finally:
+            h5file.close()
+    finally:
+        manifest.MANIFESTS.clear()
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
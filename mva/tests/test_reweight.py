@@ -0,0 +1,72 @@
+import numpy as np
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+
+from mva.histogram import Axis
+from mva.reweight import WeightHist, Interpolator
+
+
+def find_bin(axis, x, clip):
+    # TAxis::FindBin
+    if x < axis.xmin:
+        index = 0
+    elif not x < axis.xmax:
+        index = axis.nbins + 1
+    elif axis.edges is None:
+        index = 1 + int(axis.nbins * (x - axis.xmin) / (axis.xmax - axis.xmin))
+    else:
+        index = int(np.searchsorted(axis.edges, x, side='right'))
+    if clip:
+        index = min(max(index, 1), axis.nbins)
+    return index
+
+
+def check_lookup(axes, clip):
+    ncells = reduce(lambda cells, axis: cells * (axis.nbins + 2), axes, 1)
+    values = np.random.uniform(0.5, 1.5, ncells)
+    lookup = WeightHist(axes, values, clip=clip)
+    columns = [np.random.uniform(axis.xmin - 1, axis.xmax + 1, 500)
+               for axis in axes]
+    expected = []
+    for point in zip(*columns):
+        # TH1::GetBin
+        cell = 0
+        stride = 1
+        for axis, x in zip(axes, point):
+            cell += find_bin(axis, x, clip) * stride
+            stride *= axis.nbins + 2
+        expected.append(values[cell])
+    assert_array_equal(lookup(*columns), expected)
+
+
+def test_lookup():
+    for axes in ([Axis(10, -1., 1.)],
+                 [Axis(4, 0., 4.), Axis(3, 0., 30., edges=[0., 5., 10., 30.])],
+                 [Axis(2, 0., 1.), Axis(3, 0., 3.), Axis(2, -1., 1.)]):
+        for clip in (True, False):
+            yield check_lookup, axes, clip
+
+
+def interpolate(centers, contents, x):
+    # TH1::Interpolate
+    if x <= centers[0]:
+        return contents[0]
+    if x >= centers[-1]:
+        return contents[-1]
+    i = np.searchsorted(centers, x) - 1
+    slope = (contents[i + 1] - contents[i]) / (centers[i + 1] - centers[i])
+    return contents[i] + (x - centers[i]) * slope
+
+
+def test_interpolator():
+    centers = np.array([0.5, 1.5, 3., 7.])
+    contents = np.array([1.2, 0.8, 1.1, 0.9])
+    interpolator = Interpolator(centers, contents)
+    x = np.random.uniform(-2, 10, 1000)
+    assert_array_almost_equal(
+        interpolator(x),
+        [interpolate(centers, contents, value) for value in x])
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -2,8 +2,9 @@ from mva.analysis import Analysis
 from mva.samples import Higgs, QCD
 from mva.categories import Category_VBF, Category_Boosted, Category_Preselection
 from mva.defaults import TARGET_REGION
+from mva.systematics import SYSTEMATICS_BY_WEIGHT
 from rootpy.plotting import Hist
-from root_numpy import fill_hist
+from root_numpy import fill_hist, stack
 from numpy.testing import assert_almost_equal
 from numpy.testing import assert_array_equal
 from nose.tools import assert_equal
@@ -16,6 +17,58 @@ def check_partition(sample, category, region):
     assert_equal(left.shape[0] + right.shape[0], rec.shape[0])
 
 
+def check_projection(sample, category, region):
+    rec = sample.merged_records(
+        category, region)
+    proj_rec = sample.merged_records(
+        category, region, fields=['tau1_pt', 'tau2_pt'])
+    assert_equal(proj_rec.dtype.names, ('tau1_pt', 'tau2_pt', 'weight'))
+    assert_array_equal(proj_rec['tau1_pt'], rec['tau1_pt'])
+    assert_array_equal(proj_rec['weight'], rec['weight'])
+
+
+def check_multi_records(sample, categories, regions):
+    selections = [(category, region, 'NOMINAL')
+                  for category in categories
+                  for region in regions]
+    fields = ['tau1_pt', 'tau2_pt']
+    multi_recs = sample.multi_records(selections, fields=fields)
+    assert_equal(len(multi_recs), len(selections))
+    for (category, region, _), recs in zip(selections, multi_recs):
+        rec = sample.merged_records(category, region, fields=fields)
+        multi_rec = stack(recs, fields=fields + ['weight'])
+        assert_array_equal(multi_rec['tau1_pt'], rec['tau1_pt'])
+        assert_array_equal(multi_rec['weight'], rec['weight'])
+
+
+def check_chunks(sample, category, region):
+    hist = Hist(20, 0, 200)
+    chunked_hist = hist.Clone()
+    sample.draw_array({'tau1_pt': hist}, category, region)
+    sample.draw_array({'tau1_pt': chunked_hist}, category, region,
+                      chunksize=1000)
+    assert_array_equal(list(chunked_hist.y()), list(hist.y()))
+    if not isinstance(sample, QCD):
+        rec = sample.merged_records(category, region, fields=['tau1_pt'])
+        chunks = list(sample.iter_records(category, region,
+                                          fields=['tau1_pt'], chunksize=1000))
+        assert all(len(chunk) <= 1000 for chunk in chunks)
+        assert_array_equal(stack(chunks, fields=['tau1_pt', 'weight']), rec)
+
+
+def check_weight_matrix(sample, category, region):
+    systematics = sample.matrix_weight_systematics(
+        category, region, SYSTEMATICS_BY_WEIGHT)
+    rec, weight_matrix = sample.weight_matrix_records(
+        category, region, systematics, fields=['tau1_pt'])
+    assert_equal(weight_matrix.shape, (len(rec), len(systematics)))
+    for i, systematic in enumerate(systematics):
+        sys_rec = sample.merged_records(
+            category, region, fields=['tau1_pt'], systematic=systematic)
+        assert_array_equal(rec['tau1_pt'], sys_rec['tau1_pt'])
+        assert_array_equal(weight_matrix[:, i], sys_rec['weight'])
+
+
 def check_events(analysis, sample, category, region):
     clf = analysis.get_clf(category, mass=125, load=True)
     scores, weights = sample.scores(
@@ -35,6 +88,17 @@ def check_events(analysis, sample, category, region):
     assert_almost_equal(sample_events, rec['weight'].sum(), 1)
     assert_almost_equal(sample_events, clf_events, 1)
 
+    # test yields
+    sumw, sumw2 = sample.yields(category, region)['NOMINAL']
+    assert_almost_equal(sumw, rec['weight'].sum(), 1)
+    assert_almost_equal(sumw2, (rec['weight'] ** 2).sum(), 1)
+
+    # the unweighted yields count the records
+    assert_equal(sample.yields(category, region, weighted=False)['NOMINAL'],
+                 (len(rec), len(rec)))
+    assert_equal(sample.events(category, region, weighted=False)[1].value,
+                 len(rec))
+
     # test draw_array
     hist = Hist(1, -1000, 1000)
     sample.draw_array({'tau1_charge': hist}, category, region)
@@ -61,10 +125,16 @@ def test_samples():
         analysis = Analysis(year)
         analysis.normalize(Category_Preselection)
         for sample in analysis.backgrounds + [analysis.higgs_125]:
+            yield (check_multi_records, sample,
+                   (Category_VBF, Category_Boosted),
+                   ('OS_ISOL', 'OS', 'nOS_ISOL'))
             for category in (Category_VBF, Category_Boosted):
                 for region in ('OS_ISOL', 'OS', 'nOS_ISOL'):
                     if not isinstance(sample, QCD):
                         yield check_partition, sample, category, region
+                        yield check_weight_matrix, sample, category, region
+                    yield check_projection, sample, category, region
+                    yield check_chunks, sample, category, region
                     yield check_events, analysis, sample, category, region
 
 
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import tables
+from numpy.testing import assert_array_equal
+
+from mva import score_cache
+
+
+def test_store():
+    directory = tempfile.mkdtemp()
+    cache_dir = score_cache.SCORE_CACHE_DIR
+    score_cache.SCORE_CACHE_DIR = os.path.join(directory, 'scores')
+    try:
+        path = os.path.join(directory, 'hhskim.h5')
+        h5file = tables.open_file(path, 'w')
+        try:
+            for name in ('a', 'b'):
+                h5file.create_table(
+                    '/', name, np.zeros(10, dtype=[('x', 'f4')]))
+            clf_key = score_cache.classifier_key(
+                ['abc', 'def'], ['x'], 'EventNumber')
+            keys = [score_cache.get_key(clf_key, table, 'x > 0')
+                    for table in (h5file.root.a, h5file.root.b)]
+            assert keys[0] != keys[1]
+            # the condition is canonical
+            assert keys[0] == score_cache.get_key(
+                clf_key, h5file.root.a, ' x>0 ')
+            assert keys[0] != score_cache.get_key(
+                clf_key, h5file.root.a, 'x > 1')
+            # the classifiers in the other order
+            swapped_key = score_cache.classifier_key(
+                ['def', 'abc'], ['x'], 'EventNumber')
+            assert keys[0] != score_cache.get_key(
+                swapped_key, h5file.root.a, 'x > 0')
+        finally:
+            h5file.close()
+        assert score_cache.get_all(keys) is None
+        all_scores = [np.random.rand(3), np.random.rand(5)]
+        score_cache.put_all(keys, all_scores)
+        for scores, stored in zip(all_scores, score_cache.get_all(keys)):
+            assert_array_equal(scores, stored)
+        assert score_cache.info()[0] == 2
+        score_cache.clear()
+        assert score_cache.get_all(keys) is None
+    finally:
+        score_cache.SCORE_CACHE_DIR = cache_dir
+        shutil.rmtree(directory)
+
+
+def test_evict():
+    directory = tempfile.mkdtemp()
+    cache_dir = score_cache.SCORE_CACHE_DIR
+    score_cache.SCORE_CACHE_DIR = directory
+    try:
+        for key in ('a', 'b', 'c'):
+            score_cache.put(key, np.zeros(1000))
+        # the oldest entry is the least recently used after get
+        os.utime(score_cache.entry_path('a'), (0, 0))
+        os.utime(score_cache.entry_path('b'), (1, 1))
+        assert score_cache.get('a') is not None
+        size = os.path.getsize(score_cache.entry_path('a'))
+        assert score_cache.evict(2.5 * size / 1024. ** 2) == 1
+        assert score_cache.get('b') is None
+        assert score_cache.get('a') is not None
+        assert score_cache.get('c') is not None
+    finally:
+        score_cache.SCORE_CACHE_DIR = cache_dir
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+
+import numpy as np
+import tables
+from numpy.testing import assert_array_equal
+
+from mva import zonemap
+
+
+def check_where_list(table, condition):
+    assert_array_equal(
+        zonemap.get_where_list(table, condition),
+        table.get_where_list(condition))
+    assert_array_equal(
+        zonemap.get_where_list(table, condition, start=17, step=3),
+        table.get_where_list(condition, start=17, step=3))
+
+
+def test_zonemap():
+    handle, path = tempfile.mkstemp(suffix='.h5')
+    os.close(handle)
+    rec = np.zeros(100000, dtype=[('x', 'f4'), ('y', 'i4'), ('z', 'f8')])
+    rec['x'] = np.sort(np.random.rand(len(rec)) * 100)
+    rec['y'] = np.random.randint(-3, 4, len(rec))
+    rec['z'] = np.random.randn(len(rec))
+    rec['z'][5000:9000] = np.nan
+    h5file = tables.open_file(path, 'w')
+    h5file.create_table('/', 'test', rec, chunkshape=(1000,))
+    h5file.close()
+    h5file = tables.open_file(path)
+    table = h5file.root.test
+    try:
+        # narrow range cuts only scan a few zones
+        passes = zonemap.passing_zones(table, '(x > 90) & (y == 1)')
+        assert passes.sum() < len(passes) / 5
+        for condition in (
+                '(x > 90) & (y == 1)',
+                '(x < 5) | (x > 95)',
+                'abs(x - 50) < 2',
+                '(y * x) == -150',
+                '~(x > 3)',
+                'z > 1',
+                'x > 1000'):
+            yield check_where_list, table, condition
+    finally:
+        h5file.close()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -27,6 +27,15 @@ def print_hist(hist):
     log.info(out.getvalue())
 
 
+def unique(items):
+    """
+    Remove duplicates from a sequence while preserving the order
+    """
+    seen = set()
+    return [item for item in items
+            if not (item in seen or seen.add(item))]
+
+
 def hist_to_dict(hist):
     hist_dict = dict()
     for i, value in enumerate(hist):
@@ -0,0 +1,288 @@
+"""
+Zone maps: the minimum and maximum of the columns in each zone (a block of
+consecutive rows aligned with the HDF5 chunks) of a table.
+
+A condition is evaluated on the zone ranges to find the zones that may
+contain passing rows and only those zones are scanned. Narrow range cuts
+such as ``jet1_pt > 50000`` or ``resonance_pt > 100000`` then only touch
+the chunks holding candidate rows. The evaluation is conservative: any part
+of a condition that is not understood is assumed to possibly pass.
+
+The zone maps are built on first use for each column referenced by a
+condition and are stored in CACHE_DIR/zonemaps keyed by the path of the
+file and the version of the table (see manifest.table_version), so
+rewriting the file or updating the dataset of a table invalidates them.
+"""
+import os
+import ast
+import hashlib
+
+import numpy as np
+
+from . import log; log = log[__name__]
+from . import CACHE_DIR
+from .manifest import table_version
+
+ZONEMAP_DIR = os.path.join(CACHE_DIR, 'zonemaps')
+ENABLED = not os.getenv('NOZONEMAP', None)
+# minimum number of rows in a zone
+MIN_ZONE_ROWS = 4096
+# scan the whole range if more than this fraction of the zones may pass
+MAX_PASS_FRACTION = 0.5
+# number of rows read at once when building a zone map
+BUILD_ROWS = 100000
+
+if not ENABLED:
+    log.warning("zone maps are disabled")
+
+
+def table_source(table):
+    """
+    The file and the name identifying a table
+    """
+    if hasattr(table, 'source'):
+        return table.source
+    return table._v_file.filename, table._v_pathname
+
+
+def zone_rows(table):
+    """
+    The number of rows in each zone of a table: a multiple of the HDF5
+    chunk size of at least MIN_ZONE_ROWS
+    """
+    chunkshape = getattr(table, 'chunkshape', None)
+    if not chunkshape:
+        return MIN_ZONE_ROWS
+    chunk_rows = chunkshape[0]
+    return chunk_rows * int(np.ceil(MIN_ZONE_ROWS / float(chunk_rows)))
+
+
+def zonemap_dir(table):
+    filename, name = table_source(table)
+    filename = os.path.abspath(filename)
+    key = '{0}:{1}:{2}:{3:d}:{4:d}'.format(
+        filename, table_version(table), name,
+        table.nrows, zone_rows(table))
+    return os.path.join(ZONEMAP_DIR, hashlib.sha1(key).hexdigest())
+
+
+def read_column(table, name, start, stop):
+    if hasattr(table, 'chunkshape'):
+        # PyTables
+        return table.read(start=start, stop=stop, field=name)
+    return table.col(name)[start:stop]
+
+
+def build(table, name):
+    """
+    Return the (n_zones, 2) array of the minimum and maximum of a column in
+    each zone. NaN values are ignored.
+    """
+    rows = zone_rows(table)
+    # read whole numbers of zones at once
+    block_rows = rows * max(1, BUILD_ROWS // rows)
+    ranges = []
+    for start in xrange(0, table.nrows, block_rows):
+        column = read_column(table, name,
+                             start, min(start + block_rows, table.nrows))
+        offsets = np.arange(0, len(column), rows)
+        ranges.append(np.column_stack((
+            np.fmin.reduceat(column, offsets),
+            np.fmax.reduceat(column, offsets))))
+    if not ranges:
+        return np.empty((0, 2))
+    return np.concatenate(ranges).astype(np.float64)
+
+
+def get(table, name):
+    """
+    Return the zone map of a column, building it if it does not exist
+    """
+    path = os.path.join(zonemap_dir(table), name + '.npy')
+    try:
+        return np.load(path)
+    except (IOError, ValueError):
+        pass
+    log.info("building zone map of {0} in {1}".format(name, table.name))
+    zones = build(table, name)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = '{0}.{1:d}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, zones)
+    os.rename(tmp_path, path)
+    return zones
+
+
+class _Ranges(object):
+    """
+    Evaluate a numexpr condition on the zone ranges of the columns
+    """
+    def __init__(self, table, num_zones):
+        self.table = table
+        self.num_zones = num_zones
+        self.zones = {}
+
+    def column(self, name):
+        if name not in self.zones:
+            zones = get(self.table, name)
+            self.zones[name] = zones[:, 0], zones[:, 1]
+        return self.zones[name]
+
+    def may_pass(self, node):
+        """
+        Boolean array of the zones that may contain rows passing node
+        """
+        everything = np.ones(self.num_zones, dtype=np.bool_)
+        if isinstance(node, ast.Expression):
+            return self.may_pass(node.body)
+        if isinstance(node, ast.BinOp):
+            if isinstance(node.op, ast.BitAnd):
+                return self.may_pass(node.left) & self.may_pass(node.right)
+            if isinstance(node.op, ast.BitOr):
+                return self.may_pass(node.left) | self.may_pass(node.right)
+            return everything
+        if isinstance(node, ast.BoolOp):
+            passes = [self.may_pass(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return reduce(np.logical_and, passes)
+            return reduce(np.logical_or, passes)
+        if isinstance(node, ast.Compare):
+            passes = everything
+            left = self.range(node.left)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.range(comparator)
+                if left is not None and right is not None:
+                    passes = passes & self.compare(op, left, right)
+                left = right
+            return passes
+        if isinstance(node, ast.Name):
+            value = self.range(node)
+            if value is not None:
+                # boolean column
+                low, high = value
+                return (low != 0) | (high != 0)
+        return everything
+
+    def compare(self, op, left, right):
+        left_low, left_high = left
+        right_low, right_high = right
+        if isinstance(op, ast.Gt):
+            passes = left_high > right_low
+        elif isinstance(op, ast.GtE):
+            passes = left_high >= right_low
+        elif isinstance(op, ast.Lt):
+            passes = left_low < right_high
+        elif isinstance(op, ast.LtE):
+            passes = left_low <= right_high
+        elif isinstance(op, ast.Eq):
+            passes = (left_low <= right_high) & (right_low <= left_high)
+        else:
+            return np.ones(self.num_zones, dtype=np.bool_)
+        # undefined bounds (all-NaN zones or inf * 0) may pass
+        unknown = reduce(np.logical_or, [
+            np.isnan(bound) for bound in
+            (left_low, left_high, right_low, right_high)])
+        return passes | unknown
+
+    def range(self, node):
+        """
+        The (low, high) bounds of an expression in each zone or None if the
+        bounds are unknown
+        """
+        if isinstance(node, ast.Num):
+            return node.n, node.n
+        if isinstance(node, ast.Name):
+            if node.id not in self.table.colnames:
+                return None
+            return self.column(node.id)
+        if isinstance(node, ast.UnaryOp):
+            value = self.range(node.operand)
+            if value is None:
+                return None
+            if isinstance(node.op, ast.USub):
+                return -value[1], -value[0]
+            if isinstance(node.op, ast.UAdd):
+                return value
+            return None
+        if isinstance(node, ast.Call):
+            if (isinstance(node.func, ast.Name) and node.func.id == 'abs'
+                    and len(node.args) == 1):
+                value = self.range(node.args[0])
+                if value is None:
+                    return None
+                low, high = value
+                abs_high = np.maximum(np.abs(low), np.abs(high))
+                abs_low = np.where((low <= 0) & (high >= 0), 0.,
+                                   np.minimum(np.abs(low), np.abs(high)))
+                return abs_low, abs_high
+            return None
+        if isinstance(node, ast.BinOp):
+            left = self.range(node.left)
+            right = self.range(node.right)
+            if left is None or right is None:
+                return None
+            if isinstance(node.op, ast.Add):
+                return left[0] + right[0], left[1] + right[1]
+            if isinstance(node.op, ast.Sub):
+                return left[0] - right[1], left[1] - right[0]
+            if isinstance(node.op, ast.Mult):
+                products = [left[0] * right[0], left[0] * right[1],
+                            left[1] * right[0], left[1] * right[1]]
+                return (reduce(np.minimum, products),
+                        reduce(np.maximum, products))
+        return None
+
+
+def passing_zones(table, condition):
+    """
+    Boolean array of the zones of a table that may contain rows passing
+    condition
+    """
+    num_zones = int(np.ceil(table.nrows / float(zone_rows(table))))
+    try:
+        tree = ast.parse(condition.strip(), mode='eval')
+    except SyntaxError:
+        log.warning("unable to parse condition {0}".format(condition))
+        return np.ones(num_zones, dtype=np.bool_)
+    return _Ranges(table, num_zones).may_pass(tree)
+
+
+def zone_runs(passes):
+    """
+    The (begin, end) zone indices of the runs of consecutive passing zones
+    """
+    edges = np.diff(np.concatenate(([0], passes.astype(np.int8), [0])))
+    return zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1))
+
+
+def get_where_list(table, condition, start=None, stop=None, step=None):
+    """
+    Same as table.get_where_list(condition, start, stop, step) but only scan
+    the zones that may contain passing rows
+    """
+    if not ENABLED or not condition:
+        return table.get_where_list(
+            condition, start=start, stop=stop, step=step)
+    start, stop, step = slice(start, stop, step).indices(table.nrows)
+    passes = passing_zones(table, condition)
+    if passes.mean() > MAX_PASS_FRACTION:
+        return table.get_where_list(
+            condition, start=start, stop=stop, step=step)
+    rows = zone_rows(table)
+    coords = []
+    for begin, end in zone_runs(passes):
+        begin = max(begin * rows, start)
+        end = min(end * rows, stop)
+        # align the beginning of the run on the step
+        begin += (start - begin) % step
+        if begin >= end:
+            continue
+        coords.append(table.get_where_list(
+            condition, start=begin, stop=end, step=step))
+    log.debug("scanned {0:d} of {1:d} zones of {2}".format(
+        int(passes.sum()), len(passes), table.name))
+    if not coords:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(coords).astype(np.int64)